@@ -0,0 +1,159 @@
+# app/activity.py
+"""
+Tóm tắt hoạt động của hội thoại, giữ sẵn để inbox không phải tính MAX(messages.id):
+
+- conversations.last_message_id / last_message_at / last_message_preview / message_count
+- conversation_members.unread_count: số tin của người khác sau watermark đã xem
+
+Cập nhật trong cùng transaction với crud.save_message (record_messages) và
+crud.mark_read (đếm lại trong _mark_read_stmt). Nếu bị lệch (sửa DB tay, restore...)
+thì dựng lại từ bảng gốc:
+    python -m app.activity
+"""
+from collections import Counter, defaultdict
+
+from sqlalchemy import case, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import models
+
+PREVIEW_LENGTH = 100
+
+
+def preview(content) -> str:
+    return (content or "")[:PREVIEW_LENGTH]
+
+
+# ============================================================
+# GHI NHẬN TIN MỚI
+# ============================================================
+def _record_stmts(msgs):
+    """UPDATE cho các tin vừa flush (đã có id), gom theo hội thoại."""
+    conv = models.Conversation
+    member = models.ConversationMember
+
+    by_conversation = defaultdict(list)
+    for msg in msgs:
+        by_conversation[msg.conversation_id].append(msg)
+
+    stmts = []
+    for conversation_id, items in by_conversation.items():
+        last = max(items, key=lambda m: m.id)
+        # 2 transaction ghi chen nhau không được kéo tin cuối lùi lại
+        newer = or_(conv.last_message_id.is_(None), conv.last_message_id < last.id)
+        stmts.append(
+            update(conv)
+            .where(conv.id == conversation_id)
+            .values(
+                message_count=conv.message_count + len(items),
+                last_message_id=case((newer, last.id), else_=conv.last_message_id),
+                last_message_at=case((newer, last.created_at), else_=conv.last_message_at),
+                last_message_preview=case((newer, preview(last.content)), else_=conv.last_message_preview),
+            )
+        )
+        for sender_id, n in Counter(m.sender_id for m in items).items():
+            stmts.append(
+                update(member)
+                .where(member.conversation_id == conversation_id, member.user_id != sender_id)
+                .values(unread_count=member.unread_count + n)
+            )
+    return stmts
+
+
+def record_messages(db: Session, msgs):
+    """Gọi trong cùng transaction với INSERT messages, sau flush."""
+    for stmt in _record_stmts(msgs):
+        db.execute(stmt)
+
+
+async def async_record_messages(db, msgs):
+    """Bản async của record_messages (db là AsyncSession)."""
+    for stmt in _record_stmts(msgs):
+        await db.execute(stmt)
+
+
+def unread_after(conversation_id: int, user_id: int, watermark):
+    """Subquery đếm tin của người khác sau watermark — giá trị mới của unread_count khi đọc."""
+    return (
+        select(func.count())
+        .where(
+            models.Message.conversation_id == conversation_id,
+            models.Message.id > watermark,
+            models.Message.sender_id != user_id
+        )
+        .scalar_subquery()
+    )
+
+
+# ============================================================
+# REPAIR — dựng lại từ messages + watermark
+# ============================================================
+def repair_stmts():
+    conv = models.Conversation
+    member = models.ConversationMember
+    msg = models.Message
+
+    def latest(column):
+        return (
+            select(column)
+            .where(msg.conversation_id == conv.id)
+            .order_by(msg.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+
+    last_id = latest(msg.id)
+    last_at = latest(msg.created_at)
+    last_preview = latest(func.substr(func.coalesce(msg.content, ""), 1, PREVIEW_LENGTH))
+    count = select(func.count()).where(msg.conversation_id == conv.id).scalar_subquery()
+
+    unread = (
+        select(func.count())
+        .where(
+            msg.conversation_id == member.conversation_id,
+            msg.id > func.coalesce(member.last_read_message_id, 0),
+            msg.sender_id != member.user_id
+        )
+        .scalar_subquery()
+    )
+
+    # Chỉ ghi dòng bị lệch → rowcount = số dòng đã sửa
+    return {
+        "conversations": (
+            update(conv)
+            .where(or_(
+                conv.last_message_id.is_distinct_from(last_id),
+                conv.last_message_at.is_distinct_from(last_at),
+                conv.last_message_preview.is_distinct_from(last_preview),
+                conv.message_count.is_distinct_from(count),
+            ))
+            .values(
+                last_message_id=last_id,
+                last_message_at=last_at,
+                last_message_preview=last_preview,
+                message_count=count,
+            )
+        ),
+        "members": (
+            update(member)
+            .where(member.unread_count.is_distinct_from(unread))
+            .values(unread_count=unread)
+        ),
+    }
+
+
+def repair(db: Session) -> dict:
+    """Sửa mọi dòng lệch so với bảng gốc; trả về số dòng đã sửa theo bảng."""
+    fixed = {name: db.execute(stmt).rowcount for name, stmt in repair_stmts().items()}
+    db.commit()
+    return fixed
+
+
+if __name__ == "__main__":
+    from . import db as database
+
+    session = database.SessionLocal()
+    try:
+        print("Repaired:", repair(session))
+    finally:
+        session.close()
@@ -1,14 +1,27 @@
 # app/auth.py
 from passlib.context import CryptContext
 from jose import JWTError, jwt
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 from typing import Optional
+import os
+import threading
+import time
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
 from . import db, models
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Cost bcrypt; đổi giá trị → hash cũ được hash lại lần đăng nhập kế tiếp
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Số process chuyên hash / verify (0 = chạy ngay trong thread của request như cũ)
+PASSWORD_POOL_SIZE = int(os.getenv("PASSWORD_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+# Số yêu cầu đang chờ pool tối đa, vượt quá → 503 ngay
+PASSWORD_QUEUE_MAX = int(os.getenv("PASSWORD_QUEUE_MAX", str(max(PASSWORD_POOL_SIZE, 1) * 4)))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 SECRET_KEY = "dev-secret-key"
 ALGORITHM = "HS256"
@@ -17,37 +30,234 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 # ✅ OAuth2 config
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-def get_password_hash(password: str):
+# Cache user đã xác thực: tối đa AUTH_CACHE_SIZE token, sống AUTH_CACHE_TTL giây
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+
+# -------------------------------------------------------------
+# Bcrypt trong process pool riêng
+# Mỗi lần hash tốn hàng trăm ms CPU: chạy trong thread của request thì một đợt
+# login dồn dập chiếm hết threadpool của Starlette. Pool giới hạn số process,
+# còn PASSWORD_QUEUE_MAX giới hạn số thread request được phép đứng chờ pool.
+# -------------------------------------------------------------
+class PasswordPool:
+    def __init__(self, size: int = PASSWORD_POOL_SIZE, queue_max: int = PASSWORD_QUEUE_MAX):
+        self.size = size
+        self.queue_max = queue_max
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        # Tạo lúc dùng lần đầu, không fork process khi import
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.size)
+        return self._executor
+
+    def run(self, fn, *args):
+        if self.size <= 0:
+            return fn(*args)
+
+        with self._lock:
+            if self.pending >= self.queue_max:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server busy, please retry",
+                    headers={"Retry-After": "1"},
+                )
+            self.pending += 1
+
+        try:
+            for attempt in (1, 2):
+                with self._lock:
+                    executor = self._get_executor()
+                try:
+                    return executor.submit(fn, *args).result()
+                except BrokenProcessPool:
+                    # Worker chết (OOM, bị kill...) → tạo pool mới, thử lại 1 lần
+                    with self._lock:
+                        if self._executor is executor:
+                            self._executor = None
+                    if attempt == 2:
+                        raise
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "queue_max": self.queue_max,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+        }
+
+
+password_pool = PasswordPool()
+
+
+# Chạy trong process con (phải là hàm cấp module để pickle được)
+def _hash(password: str):
     return pwd_context.hash(password)
 
-def verify_password(plain, hashed):
+def _verify(plain: str, hashed: str):
     return pwd_context.verify(plain, hashed)
 
+def _verify_and_update(plain: str, hashed: str):
+    return pwd_context.verify_and_update(plain, hashed)
+
+
+def get_password_hash(password: str):
+    return password_pool.run(_hash, password)
+
+def verify_password(plain, hashed):
+    return password_pool.run(_verify, plain, hashed)
+
+def verify_and_update_password(plain, hashed):
+    """
+    Verify + cho biết có cần hash lại không (BCRYPT_ROUNDS đã đổi).
+    Trả về (ok, new_hash) — new_hash là None nếu hash hiện tại vẫn dùng được.
+    """
+    return password_pool.run(_verify_and_update, plain, hashed)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db_s: Session = Depends(db.get_db)):
-    credentials_exception = HTTPException(
+# -------------------------------------------------------------
+# Cache principal: token → bản chụp User (LRU + TTL)
+# -------------------------------------------------------------
+class PrincipalCache:
+    """
+    Lưu bản chụp các cột của User theo token đã xác thực, để get_current_user
+    không phải decode JWT + SELECT users mỗi request.
+    Bản chụp không gắn với session nào; khi dùng được merge(load=False) vào
+    session của request nên route vẫn sửa / commit user như bình thường.
+    crud gọi invalidate(user_id) sau khi ghi vào bảng users.
+    """
+
+    def __init__(self, maxsize: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()   # token -> (user_id, expires, snapshot)
+        self._by_user = {}              # user_id -> {token}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, token: str, user, token_exp: Optional[float] = None):
+        snapshot = models.User(**{
+            c.key: getattr(user, c.key) for c in models.User.__table__.columns
+        })
+        make_transient_to_detached(snapshot)
+
+        expires = time.monotonic() + self.ttl
+        if token_exp is not None:
+            # Không giữ lâu hơn hạn của chính token
+            expires = min(expires, time.monotonic() + token_exp - time.time())
+
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (user.id, expires, snapshot)
+            self._by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            for token in list(self._by_user.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._by_user.get(entry[0])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[entry[0]]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0,
+        }
+
+
+principal_cache = PrincipalCache()
+
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Not authenticated",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def _decode_claims(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    if not payload.get("sub"):
+        raise _credentials_exception()
+    return payload
+
 
-    user = db_s.query(models.User).filter(models.User.id == int(user_id)).first()
+def get_current_user(token: str = Depends(oauth2_scheme), db_s: Session = Depends(db.get_db)):
+    cached = principal_cache.get(token)
+    if cached is not None:
+        return db_s.merge(cached, load=False)
+
+    payload = _decode_claims(token)
+    user = db_s.query(models.User).filter(models.User.id == int(payload["sub"])).first()
     if not user:
-        raise credentials_exception
+        raise _credentials_exception()
+
+    principal_cache.put(token, user, payload.get("exp"))
     return user
 
+
+def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
+    """Chỉ đọc claims của JWT, không chạm DB — cho route chỉ cần id."""
+    return int(_decode_claims(token)["sub"])
+
 def decode_access_token(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -1,8 +1,16 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import delete
-from . import models, auth
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from collections import Counter
+from typing import TYPE_CHECKING
+from . import models, auth, search, storage, thumbnails, activity, reactions, sync
+from .membership import membership
 from datetime import datetime
 
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
 
 # ============================================================
 # USER
@@ -25,10 +33,14 @@ def update_user_profile(db: Session, user_id: int, **fields):
     if not user:
         return None
 
+    if "avatar_url" in fields and fields["avatar_url"] != user.avatar_url:
+        _swap_blob_ref(db, user.avatar_url, fields["avatar_url"])
+
     for k, v in fields.items():
         setattr(user, k, v)
 
     db.commit()
+    auth.principal_cache.invalidate(user_id)
     db.refresh(user)
     return user
 
@@ -38,8 +50,11 @@ def update_user_avatar(db: Session, user_id: int, avatar_url: str):
     if not user:
         return None
 
+    if avatar_url != user.avatar_url:
+        _swap_blob_ref(db, user.avatar_url, avatar_url)
     user.avatar_url = avatar_url
     db.commit()
+    auth.principal_cache.invalidate(user_id)
     db.refresh(user)
     return user
 
@@ -51,9 +66,19 @@ def change_password(db: Session, user_id: int, new_password: str):
 
     user.password_hash = auth.get_password_hash(new_password)
     db.commit()
+    auth.principal_cache.invalidate(user_id)
     return True
 
 
+def update_password_hash(db: Session, user_id: int, password_hash: str):
+    """Lưu hash đã tính sẵn (hash lại khi đăng nhập sau khi đổi BCRYPT_ROUNDS)."""
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {models.User.password_hash: password_hash}, synchronize_session=False
+    )
+    db.commit()
+    auth.principal_cache.invalidate(user_id)
+
+
 # ============================================================
 # CONVERSATION
 # ============================================================
@@ -69,8 +94,10 @@ def create_conversation(db: Session, name: str, is_group: bool, member_ids: list
 
     for uid in member_ids:
         db.add(models.ConversationMember(conversation_id=conv.id, user_id=uid))
+    sync.log(db, [sync.change(conv.id, sync.MEMBER_ADDED, user_id=uid) for uid in member_ids])
 
     db.commit()
+    membership.invalidate(conv.id)
     return conv
 
 
@@ -83,6 +110,45 @@ def get_conversations_by_user(db: Session, user_id: int):
     )
 
 
+_EPOCH = datetime(1970, 1, 1)
+
+
+def get_inbox(db: Session, user_id: int, before: tuple = None, limit: int = 50):
+    """
+    Hộp thư của user, hoạt động gần nhất trước, số query cố định mỗi trang:
+    hội thoại + tin cuối + unread (1), members + users (2, selectinload).
+    Đọc từ tóm tắt hoạt động giữ sẵn (app/activity.py), không quét messages.
+    before: (last_activity_at, conversation_id) của dòng cuối trang trước.
+    Trả về ([(conversation, last_message, unread_count, last_activity_at)], has_more).
+    """
+    member = models.ConversationMember
+    conv = models.Conversation
+    activity_at = func.coalesce(conv.last_message_at, conv.created_at, _EPOCH)
+
+    q = (
+        db.query(conv, models.Message, member.unread_count, activity_at)
+        .join(member, and_(member.conversation_id == conv.id, member.user_id == user_id))
+        .outerjoin(models.Message, models.Message.id == conv.last_message_id)
+        .options(selectinload(conv.members).selectinload(member.user))
+    )
+    if before is not None:
+        at, conversation_id = before
+        q = q.filter(or_(
+            activity_at < at,
+            and_(activity_at == at, conv.id < conversation_id)
+        ))
+
+    rows = q.order_by(activity_at.desc(), conv.id.desc()).limit(limit + 1).all()
+    return [tuple(row) for row in rows[:limit]], len(rows) > limit
+
+
+def get_conversation_ids_for_user(db: Session, user_id: int):
+    rows = db.query(models.ConversationMember.conversation_id).filter(
+        models.ConversationMember.user_id == user_id
+    ).all()
+    return [cid for (cid,) in rows]
+
+
 def update_nickname(db: Session, conversation_id: int, user_id: int, nickname: str):
     member = db.query(models.ConversationMember).filter(
         models.ConversationMember.conversation_id == conversation_id,
@@ -93,6 +159,7 @@ def update_nickname(db: Session, conversation_id: int, user_id: int, nickname: s
         return None
 
     member.nickname = nickname
+    sync.log(db, [sync.change(conversation_id, sync.NICKNAME, user_id=user_id)])
     db.commit()
     db.refresh(member)
     return member
@@ -108,7 +175,9 @@ def leave_group(db: Session, conversation_id: int, user_id: int):
         return False
 
     db.delete(member)
+    sync.log(db, [sync.change(conversation_id, sync.MEMBER_REMOVED, user_id=user_id)])
     db.commit()
+    membership.invalidate(conversation_id)
 
     # Nếu phòng không còn ai → xoá luôn
     remaining = db.query(models.ConversationMember).filter(
@@ -131,7 +200,9 @@ def remove_member(db: Session, conversation_id: int, member_id: int):
         return False
 
     db.delete(member)
+    sync.log(db, [sync.change(conversation_id, sync.MEMBER_REMOVED, user_id=member_id)])
     db.commit()
+    membership.invalidate(conversation_id)
     return True
 
 
@@ -141,6 +212,38 @@ def get_conversation(db: Session, conversation_id: int):
     ).first()
 
 
+def update_theme(db: Session, conversation_id: int, theme: str):
+    conv = get_conversation(db, conversation_id)
+    if not conv:
+        return None
+
+    conv.theme = theme
+    sync.log(db, [sync.change(conversation_id, sync.THEME)])
+    db.commit()
+    db.refresh(conv)
+    return conv
+
+
+def conversation_state(conv) -> dict:
+    """Thông tin hội thoại + thành viên cho client (members.user nên được selectinload sẵn)."""
+    return {
+        "id": conv.id,
+        "name": conv.name,
+        "is_group": conv.is_group,
+        "theme": conv.theme,
+        "members": [
+            {
+                "id": m.user.id,
+                "username": m.user.username,
+                "avatar_url": m.user.avatar_url,
+                "display_name": m.user.display_name,
+                "nickname": m.nickname
+            }
+            for m in conv.members
+        ]
+    }
+
+
 # ============================================================
 # DELETE CONVERSATION
 # ============================================================
@@ -149,11 +252,30 @@ def delete_conversation(db: Session, conversation_id: int):
     if not conv:
         return False
 
+    # Bỏ tham chiếu tới blob của file đính kèm / media (GC sẽ dọn file)
+    file_urls = [url for (url,) in db.query(models.Message.file_url).filter(
+        models.Message.conversation_id == conversation_id,
+        models.Message.file_url.isnot(None)
+    )]
+    file_urls += [url for (url,) in db.query(models.Media.url).filter(
+        models.Media.conversation_id == conversation_id
+    )]
+    add_blob_refs(db, file_urls, -1)
+
     # Xoá media files
     db.query(models.Media).filter(
         models.Media.conversation_id == conversation_id
     ).delete(synchronize_session=False)
 
+    # Xoá reaction + bảng đếm
+    conversation_message_ids = db.query(models.Message.id).filter(models.Message.conversation_id == conversation_id)
+    db.query(models.ReactionCount).filter(
+        models.ReactionCount.message_id.in_(conversation_message_ids)
+    ).delete(synchronize_session=False)
+    db.query(models.MessageReaction).filter(
+        models.MessageReaction.message_id.in_(conversation_message_ids)
+    ).delete(synchronize_session=False)
+
     # Xoá seen
     db.query(models.MessageSeen).filter(
         models.MessageSeen.message_id.in_(
@@ -161,12 +283,20 @@ def delete_conversation(db: Session, conversation_id: int):
         )
     ).delete(synchronize_session=False)
 
-    # Xoá messages
+    # Xoá messages (gỡ khỏi search index trước)
+    search.unindex_conversation(db, conversation_id)
     db.query(models.Message).filter(
         models.Message.conversation_id == conversation_id
     ).delete(synchronize_session=False)
 
-    # Xoá members
+    # Xoá members (log để /sync báo cho từng người), log cũ của hội thoại không còn ai đọc
+    db.query(models.Change).filter(
+        models.Change.conversation_id == conversation_id
+    ).delete(synchronize_session=False)
+    member_ids = [uid for (uid,) in db.query(models.ConversationMember.user_id).filter(
+        models.ConversationMember.conversation_id == conversation_id
+    )]
+    sync.log(db, [sync.change(conversation_id, sync.MEMBER_REMOVED, user_id=uid) for uid in member_ids])
     db.query(models.ConversationMember).filter(
         models.ConversationMember.conversation_id == conversation_id
     ).delete(synchronize_session=False)
@@ -174,6 +304,7 @@ def delete_conversation(db: Session, conversation_id: int):
     # Xoá hội thoại
     db.delete(conv)
     db.commit()
+    membership.invalidate(conversation_id)
     return True
 
 
@@ -189,74 +320,339 @@ def save_message(db: Session, conversation_id: int, sender_id: int, content: str
         created_at=datetime.utcnow()
     )
     db.add(msg)
+    db.flush()
+    search.index_message(db, msg.id, content)
+    add_blob_refs(db, [file_url])
+    add_message_media(db, [msg])
+    activity.record_messages(db, [msg])
+    sync.log(db, [sync.change(conversation_id, sync.MESSAGE, msg.id)])
     db.commit()
     db.refresh(msg)
     return msg
 
 
+def save_messages_batch(db: Session, rows: list):
+    """
+    Lưu nhiều tin nhắn trong 1 transaction (group commit).
+    rows: [{"conversation_id", "sender_id", "content", "file_url"}]
+    """
+    msgs = [models.Message(created_at=datetime.utcnow(), **row) for row in rows]
+    db.add_all(msgs)
+    db.flush()
+    search.index_messages(db, [(m.id, m.content) for m in msgs])
+    add_blob_refs(db, [m.file_url for m in msgs])
+    add_message_media(db, msgs)
+    activity.record_messages(db, msgs)
+    sync.log(db, [sync.change(m.conversation_id, sync.MESSAGE, m.id) for m in msgs])
+    db.commit()
+    return msgs
+
+
+def mark_read(db: Session, conversation_id: int, user_id: int, message_id: int):
+    """
+    Đẩy watermark đã xem của user lên message_id bằng 1 câu UPDATE.
+    Chỉ tiến, không lùi; watermark luôn trỏ tới 1 tin có thật trong hội thoại.
+    Trả về watermark mới, hoặc None nếu không thay đổi.
+    """
+    new_watermark = db.execute(_mark_read_stmt(conversation_id, user_id, message_id)).scalar_one_or_none()
+    if new_watermark is not None:
+        sync.log(db, [sync.change(conversation_id, sync.READ, new_watermark, user_id)])
+    db.commit()
+    return new_watermark
+
+
+def _mark_read_stmt(conversation_id: int, user_id: int, message_id: int):
+    member = models.ConversationMember
+    target = (
+        select(func.max(models.Message.id))
+        .where(
+            models.Message.conversation_id == conversation_id,
+            models.Message.id <= message_id
+        )
+        .scalar_subquery()
+    )
+    return (
+        update(member)
+        .where(
+            member.conversation_id == conversation_id,
+            member.user_id == user_id,
+            target.isnot(None),
+            or_(member.last_read_message_id.is_(None), member.last_read_message_id < target)
+        )
+        .values(
+            last_read_message_id=target,
+            last_read_at=datetime.utcnow(),
+            unread_count=activity.unread_after(conversation_id, user_id, target)
+        )
+        .returning(member.last_read_message_id)
+    )
+
+
+def get_messages_page(db: Session, conversation_id: int, before_id: int = None,
+                      after_id: int = None, limit: int = 50):
+    """
+    Keyset pagination theo (conversation_id, id).
+    - không có cursor: trang mới nhất
+    - before_id: các tin cũ hơn before_id
+    - after_id: các tin mới hơn after_id
+    Trả về (messages tăng dần theo id, has_older, has_newer).
+    """
+    q = db.query(models.Message).filter(models.Message.conversation_id == conversation_id)
+
+    if after_id is not None:
+        rows = (
+            q.filter(models.Message.id > after_id)
+            .order_by(models.Message.id.asc())
+            .limit(limit + 1)
+            .all()
+        )
+        has_newer = len(rows) > limit
+        # after_id có thể trỏ tới tin đã xoá / phòng chưa có tin cũ hơn → hỏi thẳng DB
+        has_older = db.query(q.filter(models.Message.id <= after_id).exists()).scalar()
+        return rows[:limit], has_older, has_newer
+
+    if before_id is not None:
+        q = q.filter(models.Message.id < before_id)
+
+    rows = q.order_by(models.Message.id.desc()).limit(limit + 1).all()
+    has_older = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, has_older, before_id is not None
+
+
+# ============================================================
+# BLOB (upload content-addressed + đếm tham chiếu)
+# ============================================================
+def register_blob(db: Session, sha256: str, size: int, ext: str):
+    """Ghi nhận 1 lần upload; blob đã có → chỉ làm mới uploaded_at (GC chờ lại từ đầu)."""
+    for _ in range(3):
+        blob = db.query(models.Blob).filter(models.Blob.sha256 == sha256).first()
+        if blob:
+            blob.uploaded_at = datetime.utcnow()
+        else:
+            blob = models.Blob(sha256=sha256, size=size, ext=ext, uploaded_at=datetime.utcnow())
+            db.add(blob)
+        try:
+            db.commit()
+            return blob
+        except IntegrityError:
+            # Request khác vừa tạo cùng blob → đọc lại
+            db.rollback()
+        except StaleDataError:
+            # GC vừa xoá dòng giữa lúc đọc và commit → thử lại, lần này INSERT
+            db.rollback()
+            db.expunge(blob)
+    raise RuntimeError(f"Could not register blob {sha256}")
+
+
+def _blob_ref_counts(urls):
+    return Counter(sha for sha in map(storage.blob_sha_from_url, urls) if sha)
+
+
+def _blob_ref_stmt(sha256: str, delta: int):
+    return (
+        update(models.Blob)
+        .where(models.Blob.sha256 == sha256)
+        .values(ref_count=models.Blob.ref_count + delta)
+    )
+
+
+def add_blob_refs(db: Session, urls, sign: int = 1):
+    """Tăng (sign=1) / giảm (sign=-1) ref_count của các blob mà urls trỏ tới, chưa commit."""
+    for sha, n in _blob_ref_counts(urls).items():
+        db.execute(_blob_ref_stmt(sha, sign * n))
+
+
+def _swap_blob_ref(db: Session, old_url, new_url):
+    add_blob_refs(db, [old_url], -1)
+    add_blob_refs(db, [new_url])
+
+
+def set_image_meta(db: Session, sha256: str, width: int, height: int, blurhash: str):
+    """Lưu kích thước + blurhash cho blob ảnh và mọi dòng media đang trỏ tới nó."""
+    blob = db.query(models.Blob).filter(models.Blob.sha256 == sha256).first()
+    if not blob:
+        return None
+    blob.width, blob.height, blob.blurhash = width, height, blurhash
+    db.query(models.Media).filter(
+        models.Media.url == storage.blob_url(blob.sha256, blob.ext)
+    ).update({"width": width, "height": height, "blurhash": blurhash}, synchronize_session=False)
+    db.commit()
+    return blob
+
+
+def _image_meta_stmt(urls):
+    shas = {storage.blob_sha_from_url(url) for url in urls} - {None}
+    return select(
+        models.Blob.sha256, models.Blob.ext,
+        models.Blob.width, models.Blob.height, models.Blob.blurhash
+    ).where(models.Blob.sha256.in_(shas), models.Blob.width.isnot(None))
+
+
+def _image_meta_rows(rows):
+    return {
+        storage.blob_url(sha, ext): {"width": width, "height": height, "blurhash": blurhash}
+        for sha, ext, width, height, blurhash in rows
+    }
+
+
+def get_image_meta_map(db: Session, urls):
+    """{file_url: {"width", "height", "blurhash"}} cho các ảnh đã sinh thumbnail, 1 query."""
+    urls = [url for url in urls if url]
+    if not urls:
+        return {}
+    return _image_meta_rows(db.execute(_image_meta_stmt(urls)).all())
+
+
+def get_blob(db: Session, sha256: str):
+    return db.query(models.Blob).filter(models.Blob.sha256 == sha256).first()
+
+
+def get_unreferenced_blobs(db: Session, cutoff: datetime, limit: int = 500):
+    return db.query(models.Blob).filter(
+        models.Blob.ref_count <= 0,
+        models.Blob.uploaded_at < cutoff
+    ).limit(limit).all()
+
+
+def delete_blob_if_unreferenced(db: Session, blob_id: int, cutoff: datetime):
+    """Xoá dòng blob nếu vẫn không ai dùng; False nếu vừa có tham chiếu / upload mới."""
+    result = db.execute(
+        delete(models.Blob).where(
+            models.Blob.id == blob_id,
+            models.Blob.ref_count <= 0,
+            models.Blob.uploaded_at < cutoff
+        )
+    )
+    db.commit()
+    return result.rowcount > 0
+
+
 # ============================================================
 # MEDIA
 # ============================================================
 def save_media(db: Session, conversation_id: int, sender_id: int, file_url: str, is_image: bool):
+    kind, mime = storage.media_kind(file_url)
     media = models.Media(
         conversation_id=conversation_id,
         sender_id=sender_id,
         url=file_url,
+        filename=storage.media_filename(None, file_url),
+        kind=kind,
+        mime=mime,
         is_image=is_image
     )
     db.add(media)
+    add_blob_refs(db, [file_url])
     db.commit()
     db.refresh(media)
     return media
 
 
-def get_media(db: Session, conversation_id: int):
-    images = db.query(models.Media).filter(
-        models.Media.conversation_id == conversation_id,
-        models.Media.is_image == True
-    ).all()
-
-    files = db.query(models.Media).filter(
-        models.Media.conversation_id == conversation_id,
-        models.Media.is_image == False
-    ).all()
+def _blob_info_stmt(urls):
+    shas = {storage.blob_sha_from_url(url) for url in urls} - {None}
+    return select(
+        models.Blob.sha256, models.Blob.size,
+        models.Blob.width, models.Blob.height, models.Blob.blurhash
+    ).where(models.Blob.sha256.in_(shas))
+
+
+def _message_media(msgs, blob_rows):
+    """
+    Dòng media cho các tin có file; size / kích thước ảnh lấy từ bảng blobs.
+    Gán thêm msg.preview (thumb_url / preview_url + width / height / blurhash).
+    """
+    blobs = {row.sha256: row for row in blob_rows}
+    items = []
+    for msg in msgs:
+        if not msg.file_url:
+            continue
+        kind, mime = storage.media_kind(msg.file_url)
+        blob = blobs.get(storage.blob_sha_from_url(msg.file_url))
+        # Broadcast WS dùng luôn metadata ảnh vừa đọc, không mở session khác (main.message_event)
+        meta = {"width": blob.width, "height": blob.height, "blurhash": blob.blurhash} \
+            if blob is not None and blob.width is not None else None
+        msg.preview = file_preview(msg.file_url, {msg.file_url: meta} if meta else {})
+        items.append(models.Media(
+            conversation_id=msg.conversation_id,
+            sender_id=msg.sender_id,
+            message_id=msg.id,
+            url=msg.file_url,
+            filename=storage.media_filename(msg.content, msg.file_url),
+            kind=kind,
+            mime=mime,
+            size=blob.size if blob else None,
+            width=blob.width if blob else None,
+            height=blob.height if blob else None,
+            blurhash=blob.blurhash if blob else None,
+            is_image=kind == "image",
+            uploaded_at=msg.created_at
+        ))
+    return items
+
+
+def add_message_media(db: Session, msgs):
+    """Ghi media cho tin có file đính kèm, cùng transaction với tin nhắn (chưa commit)."""
+    urls = [m.file_url for m in msgs if m.file_url]
+    if not urls:
+        return []
+    items = _message_media(msgs, db.execute(_blob_info_stmt(urls)).all())
+    db.add_all(items)
+    # Mỗi dòng media giữ 1 tham chiếu riêng (delete_conversation trừ cả 2)
+    add_blob_refs(db, urls)
+    return items
+
+
+def get_media_page(db: Session, conversation_id: int, kinds=None,
+                   before_id: int = None, limit: int = 50):
+    """
+    Keyset pagination theo index (conversation_id, kind, id), mới nhất trước.
+    Trả về (media giảm dần theo id, has_more).
+    """
+    q = db.query(models.Media).filter(models.Media.conversation_id == conversation_id)
+    if kinds:
+        q = q.filter(models.Media.kind.in_(kinds))
+    if before_id is not None:
+        q = q.filter(models.Media.id < before_id)
+
+    rows = q.order_by(models.Media.id.desc()).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+
+def get_media_counts(db: Session, conversation_id: int):
+    """{kind: số lượng} — GROUP BY chỉ đọc index, không chạm vào bảng."""
+    rows = db.query(models.Media.kind, func.count()).filter(
+        models.Media.conversation_id == conversation_id
+    ).group_by(models.Media.kind).all()
 
-    return {"images": images, "files": files}
+    counts = dict.fromkeys(storage.MEDIA_KINDS, 0)
+    counts.update({kind: n for kind, n in rows if kind})
+    return counts
 
 # ============================================================
 # MESSAGE REACTION
 # ============================================================
-def add_or_update_reaction(db, message_id, user_id, emoji):
-    from .models import MessageReaction
+def add_or_update_reaction(db: Session, message_id: int, user_id: int, emoji: str):
+    """Upsert + cập nhật reaction_counts, trả về delta (xem reactions.apply)."""
+    return reactions.apply(db, message_id, user_id, emoji)
 
-    reaction = db.query(MessageReaction).filter(
-        MessageReaction.message_id == message_id,
-        MessageReaction.user_id == user_id
-    ).first()
-
-    if reaction:
-        reaction.emoji = emoji
-    else:
-        reaction = MessageReaction(
-            message_id=message_id,
-            user_id=user_id,
-            emoji=emoji
-        )
-        db.add(reaction)
+def get_message_reactions(db: Session, message_id: int):
+    rows = db.execute(_reaction_rows_stmt(message_id)).all()
+    return _group_reactions(rows)
 
-    db.commit()
-    db.refresh(reaction)
-    return reaction
 
-def get_message_reactions(db: Session, message_id: int):
+def _reaction_rows_stmt(message_id: int):
     from .models import MessageReaction, User
-    rows = (
-        db.query(MessageReaction.emoji, User.username)
+    return (
+        select(MessageReaction.emoji, User.username)
         .join(User, User.id == MessageReaction.user_id)
-        .filter(MessageReaction.message_id == message_id)
-        .all()
+        .where(MessageReaction.message_id == message_id)
+        .order_by(MessageReaction.id)
     )
 
+
+def _group_reactions(rows):
     result = {}
     for emoji, username in rows:
         if emoji not in result:
@@ -269,3 +665,183 @@ def get_message_reactions(db: Session, message_id: int):
         result[emoji]["users"].append(username)
 
     return list(result.values())
+
+
+# ============================================================
+# BATCH HYDRATION (seen_by + reactions cho cả trang tin nhắn)
+# ============================================================
+def get_seen_map(db: Session, messages: list):
+    """
+    {message_id: [{"user_id", "seen_at"}]} suy ra từ watermark của thành viên
+    (1 query cho mọi hội thoại có trong danh sách).
+    """
+    result = {m.id: [] for m in messages}
+    conversation_ids = {m.conversation_id for m in messages}
+    if not conversation_ids:
+        return result
+
+    rows = (
+        db.query(
+            models.ConversationMember.conversation_id,
+            models.ConversationMember.user_id,
+            models.ConversationMember.last_read_message_id,
+            models.ConversationMember.last_read_at,
+        )
+        .filter(
+            models.ConversationMember.conversation_id.in_(conversation_ids),
+            models.ConversationMember.last_read_message_id.isnot(None)
+        )
+        .order_by(models.ConversationMember.last_read_message_id.desc())
+        .all()
+    )
+
+    watermarks = {}
+    for conversation_id, user_id, last_read_id, last_read_at in rows:
+        watermarks.setdefault(conversation_id, []).append((last_read_id, user_id, last_read_at))
+
+    for msg in messages:
+        for last_read_id, user_id, last_read_at in watermarks.get(msg.conversation_id, []):
+            # Sắp xếp giảm dần → gặp watermark nhỏ hơn là dừng
+            if last_read_id < msg.id:
+                break
+            if user_id != msg.sender_id:
+                result[msg.id].append({"user_id": user_id, "seen_at": last_read_at})
+    return result
+
+
+def get_reactions_map(db: Session, message_ids: list):
+    """
+    {message_id: [{"emoji", "count", "users"}]} cho nhiều tin nhắn trong 1 query,
+    cùng format với get_message_reactions.
+    """
+    from .models import MessageReaction, User
+
+    grouped = {mid: {} for mid in message_ids}
+    if not message_ids:
+        return {}
+
+    rows = (
+        db.query(MessageReaction.message_id, MessageReaction.emoji, User.username)
+        .join(User, User.id == MessageReaction.user_id)
+        .filter(MessageReaction.message_id.in_(message_ids))
+        .order_by(MessageReaction.message_id, MessageReaction.id)
+        .all()
+    )
+    for message_id, emoji, username in rows:
+        per_emoji = grouped[message_id]
+        if emoji not in per_emoji:
+            per_emoji[emoji] = {
+                "emoji": emoji,
+                "count": 0,
+                "users": []
+            }
+        per_emoji[emoji]["count"] += 1
+        per_emoji[emoji]["users"].append(username)
+
+    return {mid: list(per_emoji.values()) for mid, per_emoji in grouped.items()}
+
+
+def hydrate_messages(db: Session, messages: list):
+    """
+    Chuyển danh sách Message thành dict trả về cho client.
+    Số query cố định bất kể số lượng tin nhắn: 3 (watermark thành viên,
+    reactions, metadata ảnh — bỏ qua nếu không tin nào kèm file), chưa tính
+    query lấy trang của get_messages_page.
+    """
+    message_ids = [m.id for m in messages]
+    seen_map = get_seen_map(db, messages)
+    reactions_map = get_reactions_map(db, message_ids)
+
+    image_meta = get_image_meta_map(db, [m.file_url for m in messages])
+
+    return [
+        {
+            "id": msg.id,
+            "conversation_id": msg.conversation_id,
+            "sender_id": msg.sender_id,
+            "content": msg.content,
+            "file_url": msg.file_url,
+            "created_at": msg.created_at,
+            "reactions": reactions_map[msg.id],
+            "seen_by": seen_map[msg.id],
+            **file_preview(msg.file_url, image_meta)
+        }
+        for msg in messages
+    ]
+
+
+def file_preview(file_url, image_meta: dict):
+    """thumb_url / preview_url + width / height / blurhash cho tin nhắn có ảnh."""
+    return {**thumbnails.derivative_urls(file_url), **image_meta.get(file_url, {})}
+
+
+# ============================================================
+# ASYNC — cho WebSocket hot path (db.AsyncSessionLocal)
+# ============================================================
+async def async_save_message(db: "AsyncSession", conversation_id: int, sender_id: int,
+                             content: str = None, file_url: str = None):
+    msg = models.Message(
+        conversation_id=conversation_id,
+        sender_id=sender_id,
+        content=content,
+        file_url=file_url,
+        created_at=datetime.utcnow()
+    )
+    db.add(msg)
+    await db.flush()
+    await search.async_index_message(db, msg.id, content)
+    await async_add_blob_refs(db, [file_url])
+    await async_add_message_media(db, [msg])
+    await activity.async_record_messages(db, [msg])
+    await sync.async_log(db, [sync.change(conversation_id, sync.MESSAGE, msg.id)])
+    # expire_on_commit=False → không cần refresh lại
+    await db.commit()
+    return msg
+
+
+async def async_save_messages_batch(db: "AsyncSession", rows: list):
+    msgs = [models.Message(created_at=datetime.utcnow(), **row) for row in rows]
+    db.add_all(msgs)
+    await db.flush()
+    await search.async_index_messages(db, [(m.id, m.content) for m in msgs])
+    await async_add_blob_refs(db, [m.file_url for m in msgs])
+    await async_add_message_media(db, msgs)
+    await activity.async_record_messages(db, msgs)
+    await sync.async_log(db, [sync.change(m.conversation_id, sync.MESSAGE, m.id) for m in msgs])
+    await db.commit()
+    return msgs
+
+
+async def async_mark_read(db: "AsyncSession", conversation_id: int, user_id: int, message_id: int):
+    result = await db.execute(_mark_read_stmt(conversation_id, user_id, message_id))
+    new_watermark = result.scalar_one_or_none()
+    if new_watermark is not None:
+        await sync.async_log(db, [sync.change(conversation_id, sync.READ, new_watermark, user_id)])
+    await db.commit()
+    return new_watermark
+
+
+async def async_add_or_update_reaction(db: "AsyncSession", message_id: int, user_id: int, emoji: str):
+    return await reactions.async_apply(db, message_id, user_id, emoji)
+
+
+async def async_add_blob_refs(db: "AsyncSession", urls, sign: int = 1):
+    for sha, n in _blob_ref_counts(urls).items():
+        await db.execute(_blob_ref_stmt(sha, sign * n))
+
+
+async def async_add_message_media(db: "AsyncSession", msgs):
+    urls = [m.file_url for m in msgs if m.file_url]
+    if not urls:
+        return []
+    items = _message_media(msgs, (await db.execute(_blob_info_stmt(urls))).all())
+    db.add_all(items)
+    await async_add_blob_refs(db, urls)
+    return items
+
+
+async def async_get_image_meta_map(db: "AsyncSession", urls):
+    urls = [url for url in urls if url]
+    if not urls:
+        return {}
+    return _image_meta_rows((await db.execute(_image_meta_stmt(urls))).all())
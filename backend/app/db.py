@@ -17,3 +17,33 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# -------------------------------------------------------------
+# Async engine cho WebSocket hot path (REST vẫn dùng engine sync ở trên)
+# USE_ASYNC_DB=0 để tắt; thiếu driver (aiosqlite / asyncpg) → tự tắt
+# -------------------------------------------------------------
+def _async_url(url: str):
+    scheme, sep, rest = url.partition("://")
+    dialect = scheme.split("+")[0]
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if dialect in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return None
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+async_engine = None
+AsyncSessionLocal = None
+
+if os.getenv("USE_ASYNC_DB", "1") == "1" and ASYNC_DATABASE_URL:
+    try:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        async_engine = create_async_engine(ASYNC_DATABASE_URL)
+        AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+    except ImportError:
+        async_engine = None
+        AsyncSessionLocal = None
@@ -1,9 +1,8 @@
 # app/main.py
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
-from . import db, models, auth
+from . import db, models, auth, crud, migrations, storage, thumbnails, sync
 from .routes import (
     auth_routes,
     conversation_routes,
@@ -11,17 +10,59 @@ from .routes import (
     user_routes,
     message_routes,
     settings_routes,
-    media_routes
+    media_routes,
+    upload_routes,
+    sync_routes
 )
 
 from .websocket_manager import manager
+from .membership import membership
+from . import message_writer
 
 from starlette.concurrency import run_in_threadpool
 from fastapi.openapi.utils import get_openapi
+import asyncio
 import json
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
 import socket
 
-app = FastAPI(title="Chat backend (FastAPI)")
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------
+# Vòng đời các thành phần nền: khởi động theo thứ tự dưới,
+# dừng theo thứ tự ngược lại
+# -------------------------------------------------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pub/sub giữa các worker (PUBSUB_URL); worker khác thêm / xoá thành viên
+    # → cache của worker này biết ngay
+    await manager.start()
+    membership.bind(manager, asyncio.get_running_loop())
+    # Group commit tin nhắn WS (MESSAGE_BATCH_ENABLED)
+    if message_writer.MESSAGE_BATCH_ENABLED:
+        message_writer.writer.start()
+    # Dọn blob upload không còn tham chiếu (app/storage.py)
+    if storage.BLOB_GC_ENABLED:
+        storage.blob_gc.start()
+    # Xoá change log quá hạn giữ (app/sync.py)
+    sync.pruner.start()
+    try:
+        yield
+    finally:
+        await sync.pruner.stop()
+        await storage.blob_gc.stop()
+        thumbnails.generator.shutdown()
+        # Ghi nốt batch đang chờ trước khi đóng pub/sub và DB
+        await message_writer.writer.stop()
+        await manager.stop()
+        auth.password_pool.shutdown()
+        if db.async_engine is not None:
+            await db.async_engine.dispose()
+
+
+app = FastAPI(title="Chat backend (FastAPI)", lifespan=lifespan)
 
 
 # -------------------------------------------------------------
@@ -45,18 +86,21 @@ app.include_router(user_routes.router)
 app.include_router(message_routes.router)
 app.include_router(settings_routes.router)
 app.include_router(media_routes.router)
+app.include_router(upload_routes.router)
+app.include_router(sync_routes.router)
 
 
 # -------------------------------------------------------------
 # DB init
 # -------------------------------------------------------------
 models.Base.metadata.create_all(bind=db.engine)
+migrations.run_migrations(db.engine)
 
 
 # -------------------------------------------------------------
 # Static: serve uploaded files
 # -------------------------------------------------------------
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# /uploads được phục vụ bởi routes/upload_routes.py (ETag, Range, cache immutable)
 
 # -------------------------------------------------------------
 # Lấy địa chỉ IP của máy chủ
@@ -85,183 +129,513 @@ def server_info(request: Request):
     }
 
 
+@app.get("/server-info/ws")
+def websocket_stats():
+    # Số kết nối, độ sâu hàng đợi gửi, số event bị bỏ / client bị loại
+    return {**manager.stats(), "message_writer": message_writer.writer.stats()}
+
+
+@app.get("/server-info/auth-cache")
+def auth_cache_stats():
+    # Tỉ lệ hit của cache principal trong get_current_user
+    return auth.principal_cache.stats()
+
+
+@app.get("/server-info/password-pool")
+def password_pool_stats():
+    return auth.password_pool.stats()
+
+
+@app.get("/server-info/membership-cache")
+def membership_cache_stats():
+    return membership.stats()
+
+
+@app.get("/server-info/blob-gc")
+def blob_gc_stats():
+    return {**storage.blob_gc.stats(), "thumbnails": thumbnails.generator.stats()}
+
+
+@app.get("/server-info/change-log")
+def change_log_stats():
+    return sync.pruner.stats()
+
+
+# -------------------------------------------------------------
+# WEBSOCKET – xử lý 1 frame của client trong 1 phòng
+# (dùng chung cho /ws/{conversation_id}/{user_id} và /ws/{user_id})
+# -------------------------------------------------------------
+async def reject_event(websocket: WebSocket, conversation_id: Optional[int], detail: str):
+    # Frame lỗi thay vì để exception làm rớt socket
+    await manager.send_safe(websocket, {
+        "type": "error",
+        "conversation_id": conversation_id,
+        "detail": detail
+    })
+
+
+async def handle_client_event(websocket: WebSocket, conversation_id: int, user_id: int, payload: dict):
+    # ======================================================
+    # SEND MESSAGE
+    # ======================================================
+    if payload.get("type") == "message":
+        content = payload.get("content")
+        file_url = payload.get("file_url")
+
+        try:
+            msg = await persist_message(int(conversation_id), int(user_id), content, file_url)
+        except Exception as e:
+            # Timeout của writer / lỗi DB: báo client, giữ socket (và mọi phòng khác) sống
+            logger.warning("Saving message in conversation %s failed: %r", conversation_id, e)
+            await reject_event(websocket, conversation_id, "Message could not be saved, please retry")
+            return
+
+        await manager.broadcast_safe(conversation_id, await message_event(msg))
+
+    # ======================================================
+    # TYPING
+    # ======================================================
+    elif payload.get("type") == "typing":
+        # Manager tự gộp: chỉ phát khi bắt đầu / dừng gõ
+        await manager.typing.update(conversation_id, user_id, bool(payload.get("status", True)))
+
+    # ======================================================
+    # SEEN
+    # ======================================================
+    elif payload.get("type") == "seen":
+        message_ids = payload.get("message_ids", [])
+        try:
+            ids = [int(mid) for mid in message_ids]
+        except (TypeError, ValueError):
+            await reject_event(websocket, conversation_id, "message_ids must be a list of integers")
+            return
+
+        last_read_id = await persist_seen(int(conversation_id), int(user_id), max(ids)) if ids else None
+
+        # Watermark không tiến (tin cũ / đã xem) → khỏi broadcast
+        if last_read_id is not None:
+            await manager.broadcast_safe(
+                conversation_id,
+                {
+                    "type": "seen",
+                    "user_id": user_id,
+                    "message_ids": message_ids,
+                    "last_read_message_id": last_read_id
+                }
+            )
+    # ======================================================
+    # MESSAGE REACTION
+    # ======================================================
+    elif payload.get("type") == "reaction":
+        message_id = payload.get("message_id")
+        emoji = payload.get("emoji")
+        if message_id is None or not emoji:
+            return
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            await reject_event(websocket, conversation_id, "message_id must be an integer")
+            return
+
+        # Tin phải thuộc đúng phòng của socket, không thì delta lọt sang phòng khác
+        msg = await load_message(message_id)
+        if msg is None or msg.conversation_id != conversation_id:
+            await reject_event(websocket, conversation_id, "Message not found in this conversation")
+            return
+
+        delta = await persist_reaction(message_id, user_id, emoji)
+
+        # Chỉ gửi phần thay đổi; danh sách đầy đủ: GET /messages/reactions/{message_id}
+        if delta is not None:
+            await manager.broadcast_safe(
+                conversation_id,
+                {"type": "reaction_delta", **delta}
+            )
+
+
+# -------------------------------------------------------------
+# DB cho WebSocket: await thẳng async engine nếu có,
+# không thì chạy crud sync trong threadpool như cũ
+# -------------------------------------------------------------
+async def persist_message(conversation_id: int, user_id: int, content, file_url):
+    # Group commit (MESSAGE_BATCH_ENABLED=1)
+    if message_writer.writer.running:
+        return await message_writer.writer.submit(conversation_id, user_id, content, file_url)
+
+    if db.AsyncSessionLocal is not None:
+        async with db.AsyncSessionLocal() as db_s:
+            return await crud.async_save_message(db_s, conversation_id, user_id, content, file_url)
+
+    def save_msg():
+        db_s = next(db.get_db())
+        try:
+            msg = crud.save_message(db_s, conversation_id, user_id, content, file_url)
+            db_s.expunge(msg)
+            return msg
+        finally:
+            db_s.close()
+
+    return await run_in_threadpool(save_msg)
+
+
+async def message_event(msg):
+    return {
+        "type": "message",
+        "message": {
+            "id": msg.id,
+            "conversation_id": msg.conversation_id,
+            "sender_id": msg.sender_id,
+            "content": msg.content,
+            "file_url": msg.file_url,
+            "created_at": str(msg.created_at),
+            # persist_message đã đọc sẵn trong cùng transaction; tin đọc lại từ DB thì tra riêng
+            **(getattr(msg, "preview", None) or await file_preview(msg.file_url))
+        }
+    }
+
+
+async def load_message(message_id: int):
+    if db.AsyncSessionLocal is not None:
+        async with db.AsyncSessionLocal() as db_s:
+            return await db_s.get(models.Message, message_id)
+
+    def load():
+        db_s = next(db.get_db())
+        try:
+            msg = db_s.get(models.Message, message_id)
+            if msg is not None:
+                db_s.expunge(msg)
+            return msg
+        finally:
+            db_s.close()
+
+    return await run_in_threadpool(load)
+
+
+async def refetch_event(ref: dict):
+    """Event quá lớn cho pub/sub (vd. NOTIFY 8000 byte) → node nhận đọc lại tin từ DB."""
+    if ref.get("event_type") != "message":
+        return None
+    msg = await load_message(int(ref["message_id"]))
+    return await message_event(msg) if msg is not None else None
+
+
+manager.refetch = refetch_event
+
+
+async def file_preview(file_url):
+    # Chỉ tin nhắn kèm ảnh mới cần tra width / height / blurhash
+    if not thumbnails.derivative_urls(file_url):
+        return {}
+
+    if db.AsyncSessionLocal is not None:
+        async with db.AsyncSessionLocal() as db_s:
+            meta = await crud.async_get_image_meta_map(db_s, [file_url])
+    else:
+        def load_meta():
+            db_s = next(db.get_db())
+            try:
+                return crud.get_image_meta_map(db_s, [file_url])
+            finally:
+                db_s.close()
+
+        meta = await run_in_threadpool(load_meta)
+
+    return crud.file_preview(file_url, meta)
+
+
+async def persist_seen(conversation_id: int, user_id: int, message_id: int):
+    if db.AsyncSessionLocal is not None:
+        async with db.AsyncSessionLocal() as db_s:
+            return await crud.async_mark_read(db_s, conversation_id, user_id, message_id)
+
+    def save_seen():
+        db_s = next(db.get_db())
+        try:
+            return crud.mark_read(db_s, conversation_id, user_id, message_id)
+        finally:
+            db_s.close()
+
+    return await run_in_threadpool(save_seen)
+
+
+async def persist_reaction(message_id: int, user_id: int, emoji: str):
+    if db.AsyncSessionLocal is not None:
+        async with db.AsyncSessionLocal() as db_s:
+            return await crud.async_add_or_update_reaction(db_s, message_id, user_id, emoji)
+
+    def save_reaction():
+        db_s = next(db.get_db())
+        try:
+            return crud.add_or_update_reaction(db_s, message_id, user_id, emoji)
+        finally:
+            db_s.close()
+
+    return await run_in_threadpool(save_reaction)
+
+
+async def join_room(websocket: WebSocket, conversation_id: int, user_id: int, resume=None):
+    # resume = (last_seq, epoch) từ lần kết nối trước → phát lại event bị lỡ
+    last_seq, epoch = resume or (None, None)
+    first = await manager.connect(conversation_id, user_id, websocket, last_seq, epoch)
+
+    # Send list of online users to this user
+    await manager.send_to_socket(websocket, conversation_id, {
+        "type": "online_list",
+        "users": manager.get_online_users(conversation_id)
+    })
+
+    # Notify everyone that this user is online (chỉ socket đầu tiên của user)
+    if first:
+        await manager.broadcast_safe(
+            conversation_id,
+            {
+                "type": "presence",
+                "user_id": user_id,
+                "status": "online"
+            },
+            exclude_user=None
+        )
+
+
+async def leave_room(websocket: WebSocket, conversation_id: int, user_id: int):
+    if manager.disconnect(conversation_id, user_id, websocket):
+        await manager.typing.forget(conversation_id, user_id)
+        await manager.broadcast_safe(
+            conversation_id,
+            {
+                "type": "presence",
+                "user_id": user_id,
+                "status": "offline"
+            }
+        )
+
+
+def _parse_resume(raw) -> dict:
+    """{"<conversation_id>": {"last_seq": n, "epoch": "..."}} → {conversation_id: (last_seq, epoch)}"""
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            return {}
+    if not isinstance(raw, dict):
+        return {}
+    result = {}
+    for cid, state in raw.items():
+        try:
+            result[int(cid)] = (int(state["last_seq"]), str(state["epoch"]))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return result
+
+
+def _parse_frame(raw: str) -> Optional[dict]:
+    """Frame JSON của client; None nếu không phải JSON object."""
+    try:
+        payload = json.loads(raw)
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def _parse_ids(raw) -> Optional[set]:
+    """conversation_ids của subscribe / unsubscribe; None nếu không phải list số nguyên."""
+    if not isinstance(raw, list):
+        return None
+    try:
+        return {int(cid) for cid in raw if cid is not None}
+    except (TypeError, ValueError):
+        return None
+
+
+def _authorized(token: str, user_id: int):
+    payload = auth.decode_access_token(token) if token else None
+    return bool(payload) and str(payload.get("sub")) == str(user_id)
+
+
+async def ensure_member(websocket: WebSocket, conversation_id: int, user_id: int):
+    """
+    Kiểm tra thành viên trước mỗi frame (tra cache, không query khi hit).
+    User vừa bị xoá / rời nhóm → rút socket khỏi phòng, trả về False.
+    """
+    if await membership.async_is_member(conversation_id, user_id):
+        return True
+
+    if conversation_id in manager.rooms_of(websocket):
+        await leave_room(websocket, conversation_id, user_id)
+    return False
+
+
 # -------------------------------------------------------------
-# WEBSOCKET ENDPOINT – ANTI CRASH VERSION
+# WEBSOCKET ENDPOINT – ANTI CRASH VERSION (1 socket / 1 phòng)
 # -------------------------------------------------------------
 @app.websocket("/ws/{conversation_id}/{user_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     conversation_id: int,
     user_id: int,
-    token: str = Query(None)
+    token: str = Query(None),
+    last_seq: Optional[int] = Query(None),
+    epoch: Optional[str] = Query(None)
 ):
     # 1. Validate JWT
-    payload = auth.decode_access_token(token) if token else None
-    if not payload or str(payload.get("sub")) != str(user_id):
+    if not _authorized(token, user_id):
         await websocket.close(code=1008)
         return
 
-    # 2. Accept WS
-    await websocket.accept()
+    # 2. Chỉ thành viên mới được vào phòng
+    if not await membership.async_is_member(conversation_id, user_id):
+        await websocket.close(code=1008)
+        return
 
-    # 3. Register connection
-    await manager.connect(conversation_id, user_id, websocket)
+    # 3. Accept WS
+    await websocket.accept()
+    manager.attach(websocket)
 
-    # 4. Send list of online users to this user
-    try:
-        await websocket.send_json({
-            "type": "online_list",
-            "users": manager.get_online_users(conversation_id)
-        })
-    except:
-        pass  # user có thể disconnect ngay lập tức
-
-    # 5. Notify everyone that this user is online
-    await manager.broadcast_safe(
-        conversation_id,
-        {
-            "type": "presence",
-            "user_id": user_id,
-            "status": "online"
-        },
-        exclude_user=None
-    )
+    # 4. Register connection + resume + online list + presence
+    resume = (last_seq, epoch) if last_seq is not None else None
+    await join_room(websocket, conversation_id, user_id, resume)
 
     try:
         while True:
             # Nhận dữ liệu từ WS
             raw = await websocket.receive_text()
-            payload = json.loads(raw)
-
-            # ======================================================
-            # SEND MESSAGE
-            # ======================================================
-            if payload.get("type") == "message":
-                content = payload.get("content")
-                file_url = payload.get("file_url")
-
-                # save_message chạy trong threadpool
-                def save_msg():
-                    db_s = next(db.get_db())
-                    try:
-                        from .crud import save_message
-                        msg = save_message(
-                            db_s,
-                            int(conversation_id),
-                            int(user_id),
-                            content,
-                            file_url
-                        )
-                        return {
-                            "id": msg.id,
-                            "conversation_id": msg.conversation_id,
-                            "sender_id": msg.sender_id,
-                            "content": msg.content,
-                            "file_url": msg.file_url,
-                            "created_at": str(msg.created_at)
-                        }
-                    finally:
-                        db_s.close()
-
-                saved = await run_in_threadpool(save_msg)
-
-                await manager.broadcast_safe(
-                    conversation_id,
-                    {"type": "message", "message": saved}
-                )
-
-            # ======================================================
-            # TYPING
-            # ======================================================
-            elif payload.get("type") == "typing":
-                await manager.broadcast_safe(
-                    conversation_id,
-                    {
-                        "type": "typing",
-                        "user_id": user_id,
-                        "status": payload.get("status", True)
-                    },
-                    exclude_user=user_id
-                )
-
-            # ======================================================
-            # SEEN
-            # ======================================================
-            elif payload.get("type") == "seen":
-                message_ids = payload.get("message_ids", [])
-
-                def save_seen():
-                    db_s = next(db.get_db())
-                    try:
-                        from .models import MessageSeen
-                        for mid in message_ids:
-                            exists = (
-                                db_s.query(MessageSeen)
-                                .filter(MessageSeen.message_id == mid,
-                                        MessageSeen.user_id == user_id)
-                                .first()
-                            )
-                            if not exists:
-                                db_s.add(MessageSeen(
-                                    message_id=mid,
-                                    user_id=user_id
-                                ))
-                        db_s.commit()
-                    finally:
-                        db_s.close()
-
-                await run_in_threadpool(save_seen)
-
-                await manager.broadcast_safe(
-                    conversation_id,
-                    {
-                        "type": "seen",
-                        "user_id": user_id,
-                        "message_ids": message_ids
-                    }
-                )
-            # ======================================================
-            # MESSAGE REACTION
-            # ======================================================
-            elif payload.get("type") == "reaction":
-                message_id = payload.get("message_id")
-                emoji = payload.get("emoji")
-
-                def save_reaction():
-                    db_s = next(db.get_db())
-                    try:
-                        from .crud import add_or_update_reaction, get_message_reactions
-                        add_or_update_reaction(db_s, message_id, user_id, emoji)
-                        reactions = get_message_reactions(db_s, message_id)
-                        return reactions
-                    finally:
-                        db_s.close()
-
-                reactions = await run_in_threadpool(save_reaction)
-
-                await manager.broadcast_safe(
-                    conversation_id,
-                    {
-                        "type": "reaction_changed",
-                        "message_id": message_id,
-                        "reactions": reactions
-                    }
-                )
+            payload = _parse_frame(raw)
+            if payload is None:
+                await reject_event(websocket, conversation_id, "Frame must be a JSON object")
+                continue
 
+            # Bị xoá khỏi hội thoại khi đang kết nối → đóng socket
+            if not await ensure_member(websocket, conversation_id, user_id):
+                await websocket.close(code=1008, reason="Not a member of this conversation")
+                break
+
+            await handle_client_event(websocket, conversation_id, user_id, payload)
 
     except WebSocketDisconnect:
         pass
 
     finally:
-        manager.disconnect(conversation_id, user_id)
-        await manager.broadcast_safe(
-            conversation_id,
-            {
-                "type": "presence",
-                "user_id": user_id,
-                "status": "offline"
-            }
-        )
+        await leave_room(websocket, conversation_id, user_id)
+        manager.detach(websocket)
+
+
+# -------------------------------------------------------------
+# WEBSOCKET MULTIPLEX – 1 socket cho mọi hội thoại của user
+#
+# Client → server:
+#   {"type": "subscribe",   "conversation_ids": [...]}
+#   {"type": "unsubscribe", "conversation_ids": [...]}
+#   {"type": "message" | "typing" | "seen" | "reaction", "conversation_id": X, ...}
+# Server → client: mọi event đều kèm "conversation_id".
+#
+# Resume sau khi mất kết nối: ?resume={"<conversation_id>": {"last_seq": n, "epoch": "..."}}
+# (hoặc "resume" cùng format trong frame subscribe).
+# -------------------------------------------------------------
+@app.websocket("/ws/{user_id}")
+async def user_websocket_endpoint(
+    websocket: WebSocket,
+    user_id: int,
+    token: str = Query(None),
+    resume: Optional[str] = Query(None)
+):
+    if not _authorized(token, user_id):
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    websocket.multiplexed = True
+    manager.attach(websocket)
+
+    def member_conversation_ids():
+        db_s = next(db.get_db())
+        try:
+            from .crud import get_conversation_ids_for_user
+            return set(get_conversation_ids_for_user(db_s, user_id))
+        finally:
+            db_s.close()
+
+    # Mặc định subscribe mọi hội thoại user là thành viên
+    # (liệt kê theo user thì phải hỏi DB; cache chỉ tra theo hội thoại)
+    allowed = await run_in_threadpool(member_conversation_ids)
+    resume_states = _parse_resume(resume)
+    for cid in allowed:
+        await join_room(websocket, cid, user_id, resume_states.get(cid))
+
+    await manager.send_safe(websocket, {
+        "type": "subscribed",
+        "conversation_ids": sorted(manager.rooms_of(websocket))
+    })
+
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            payload = _parse_frame(raw)
+            if payload is None:
+                await reject_event(websocket, None, "Frame must be a JSON object")
+                continue
+            kind = payload.get("type")
+
+            if kind in ("subscribe", "unsubscribe"):
+                requested = payload.get("conversation_ids")
+                if requested is None:
+                    requested = [payload.get("conversation_id")]
+                requested = _parse_ids(requested)
+                if requested is None:
+                    await reject_event(websocket, None, "conversation_ids must be a list of integers")
+                    continue
+
+                if kind == "subscribe":
+                    resume_states = _parse_resume(payload.get("resume"))
+                    joined = manager.rooms_of(websocket)
+                    for cid in requested:
+                        if not await membership.async_is_member(cid, user_id):
+                            continue
+                        # Phòng đã join thì không phát lại lần nữa
+                        await join_room(websocket, cid, user_id, None if cid in joined else resume_states.get(cid))
+                else:
+                    for cid in requested & manager.rooms_of(websocket):
+                        await leave_room(websocket, cid, user_id)
+
+                await manager.send_safe(websocket, {
+                    "type": "subscribed",
+                    "conversation_ids": sorted(manager.rooms_of(websocket))
+                })
+                continue
+
+            try:
+                conversation_id = int(payload.get("conversation_id"))
+            except (TypeError, ValueError):
+                conversation_id = None
+            if conversation_id not in manager.rooms_of(websocket):
+                await manager.send_safe(websocket, {
+                    "type": "error",
+                    "conversation_id": payload.get("conversation_id"),
+                    "detail": "Not subscribed to this conversation"
+                })
+                continue
+
+            if not await ensure_member(websocket, conversation_id, user_id):
+                await manager.send_safe(websocket, {
+                    "type": "error",
+                    "conversation_id": conversation_id,
+                    "detail": "You are not a member of this conversation"
+                })
+                await manager.send_safe(websocket, {
+                    "type": "subscribed",
+                    "conversation_ids": sorted(manager.rooms_of(websocket))
+                })
+                continue
+
+            await handle_client_event(websocket, conversation_id, user_id, payload)
+
+    except WebSocketDisconnect:
+        pass
+
+    finally:
+        for cid in manager.rooms_of(websocket):
+            await leave_room(websocket, cid, user_id)
+        manager.detach(websocket)
 
 
 # -------------------------------------------------------------
@@ -0,0 +1,162 @@
+# app/membership.py
+"""
+Cache thành viên hội thoại: conversation_id → frozenset(user_id).
+
+Dùng cho mọi kiểm tra "user có thuộc hội thoại không" (REST + WebSocket)
+thay vì load conv.members rồi duyệt danh sách ORM.
+crud gọi invalidate(conversation_id) sau mỗi lần thay đổi thành viên
+(create_conversation, leave_group, remove_member, delete_conversation).
+
+Mỗi worker có cache riêng. Sau bind(manager, loop) (main.py lúc startup),
+invalidate được publish qua backend pub/sub của ConversationManager → worker
+khác xoá entry ngay khi nhận. MEMBERSHIP_CACHE_TTL vẫn là giới hạn trên nếu
+thông báo bị mất (Redis / Postgres đang kết nối lại, hàng đợi publish đầy).
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import db, models
+
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "50000"))
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", "30"))
+
+# Loại event điều khiển gửi qua pub/sub (không thuộc phòng nào)
+MEMBERSHIP_CHANGED = "membership_changed"
+
+
+def _members_stmt(conversation_id: int):
+    return select(models.ConversationMember.user_id).where(
+        models.ConversationMember.conversation_id == conversation_id
+    )
+
+
+class MembershipCache:
+    def __init__(self, maxsize: int = MEMBERSHIP_CACHE_SIZE, ttl: float = MEMBERSHIP_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()   # conversation_id -> (expires, frozenset)
+        self._lock = threading.Lock()
+        # Tăng mỗi lần invalidate: kết quả load song song với invalidate sẽ không được lưu
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.remote_invalidations = 0
+        # Gán bởi bind(): báo các worker khác, gọi được từ threadpool
+        self._publish: Optional[Callable[[int], None]] = None
+
+    # ============================================================
+    # CACHE
+    # ============================================================
+    def _lookup(self, conversation_id: int):
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None or entry[0] <= time.monotonic():
+                self._entries.pop(conversation_id, None)
+                self.misses += 1
+                return None, self._generation
+            self._entries.move_to_end(conversation_id)
+            self.hits += 1
+            return entry[1], self._generation
+
+    def _store(self, conversation_id: int, members, generation: int):
+        members = frozenset(members)
+        with self._lock:
+            if generation == self._generation:
+                self._entries[conversation_id] = (time.monotonic() + self.ttl, members)
+                self._entries.move_to_end(conversation_id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return members
+
+    def invalidate(self, conversation_id: int, propagate: bool = True):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(conversation_id, None)
+        if propagate and self._publish is not None:
+            self._publish(conversation_id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    # ============================================================
+    # SYNC (REST)
+    # ============================================================
+    def get_members(self, db_s: Session, conversation_id: int) -> frozenset:
+        members, generation = self._lookup(conversation_id)
+        if members is None:
+            rows = db_s.execute(_members_stmt(conversation_id)).scalars().all()
+            members = self._store(conversation_id, rows, generation)
+        return members
+
+    def is_member(self, db_s: Session, conversation_id: int, user_id: int) -> bool:
+        return user_id in self.get_members(db_s, conversation_id)
+
+    # ============================================================
+    # ASYNC (WebSocket)
+    # ============================================================
+    async def async_get_members(self, conversation_id: int) -> frozenset:
+        members, generation = self._lookup(conversation_id)
+        if members is not None:
+            return members
+
+        if db.AsyncSessionLocal is not None:
+            async with db.AsyncSessionLocal() as db_s:
+                rows = (await db_s.execute(_members_stmt(conversation_id))).scalars().all()
+        else:
+            def load():
+                db_s = db.SessionLocal()
+                try:
+                    return db_s.execute(_members_stmt(conversation_id)).scalars().all()
+                finally:
+                    db_s.close()
+
+            rows = await run_in_threadpool(load)
+
+        return self._store(conversation_id, rows, generation)
+
+    async def async_is_member(self, conversation_id: int, user_id: int) -> bool:
+        return user_id in await self.async_get_members(conversation_id)
+
+    # ============================================================
+    # NHIỀU WORKER
+    # ============================================================
+    def bind(self, manager, loop: asyncio.AbstractEventLoop):
+        """Gửi / nhận invalidate qua pub/sub của manager (ConversationManager)."""
+        def publish(conversation_id: int):
+            event = {"type": MEMBERSHIP_CHANGED, "conversation_id": conversation_id}
+            # crud chạy trong threadpool → đưa việc publish về event loop
+            try:
+                loop.call_soon_threadsafe(lambda: loop.create_task(manager.publish_control(event)))
+            except RuntimeError:
+                pass  # loop đã đóng (đang shutdown): chỉ còn TTL
+
+        def on_remote(event: dict):
+            self.remote_invalidations += 1
+            self.invalidate(int(event["conversation_id"]), propagate=False)
+
+        self._publish = publish
+        manager.control_handlers[MEMBERSHIP_CHANGED] = on_remote
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "remote_invalidations": self.remote_invalidations,
+            "hit_rate": round(self.hits / total, 4) if total else 0,
+        }
+
+
+# Singleton
+membership = MembershipCache()
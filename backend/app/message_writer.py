@@ -0,0 +1,225 @@
+# app/message_writer.py
+"""
+Group commit cho tin nhắn gửi qua WebSocket.
+
+Thay vì mỗi tin 1 lần INSERT + COMMIT (SQLite: 1 lần fsync / tin), các tin từ
+mọi kết nối được gom trong vài ms hoặc tới N dòng rồi ghi trong 1 transaction.
+Người gửi await future của mình, nhận lại id + created_at trước khi broadcast,
+nên thứ tự "lưu xong rồi mới broadcast" vẫn giữ nguyên.
+
+Bật bằng MESSAGE_BATCH_ENABLED=1. Các nút chỉnh:
+    MESSAGE_BATCH_MAX_ROWS      số tin tối đa / transaction (mặc định 200)
+    MESSAGE_BATCH_MAX_DELAY_MS  thời gian chờ gom tối đa (mặc định 5)
+    MESSAGE_BATCH_SQLITE_SYNC   PRAGMA synchronous cho SQLite: FULL (bền nhất,
+                                mặc định) hoặc NORMAL (nhanh hơn, với WAL có thể
+                                mất vài transaction cuối khi mất điện)
+    MESSAGE_BATCH_SUBMIT_TIMEOUT  số giây tối đa người gửi chờ batch được ghi (mặc định 10)
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from sqlalchemy import event
+
+from . import crud, db
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_BATCH_ENABLED = os.getenv("MESSAGE_BATCH_ENABLED", "0") == "1"
+MESSAGE_BATCH_MAX_ROWS = int(os.getenv("MESSAGE_BATCH_MAX_ROWS", "200"))
+MESSAGE_BATCH_MAX_DELAY_MS = float(os.getenv("MESSAGE_BATCH_MAX_DELAY_MS", "5"))
+MESSAGE_BATCH_SQLITE_SYNC = os.getenv("MESSAGE_BATCH_SQLITE_SYNC", "FULL").upper()
+MESSAGE_BATCH_SUBMIT_TIMEOUT = float(os.getenv("MESSAGE_BATCH_SUBMIT_TIMEOUT", "10"))
+
+
+def _resolve(future: asyncio.Future, result=None, error: BaseException = None):
+    """Người gửi có thể đã huỷ (socket rớt, hết timeout) → future đã done, bỏ qua."""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class MessageBatchWriter:
+    def __init__(self, max_rows: int = None, max_delay_ms: float = None, submit_timeout: float = None):
+        self.max_rows = max_rows or MESSAGE_BATCH_MAX_ROWS
+        self.max_delay = (max_delay_ms if max_delay_ms is not None else MESSAGE_BATCH_MAX_DELAY_MS) / 1000
+        self.submit_timeout = submit_timeout or MESSAGE_BATCH_SUBMIT_TIMEOUT
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.rows = 0
+        self.failed_batches = 0
+        self.direct_writes = 0
+
+    # ============================================================
+    # LIFECYCLE
+    # ============================================================
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Ghi nốt các tin còn trong hàng đợi rồi dừng."""
+        if self._task is None:
+            return
+        if not self._task.done():
+            await self._queue.put(None)
+        try:
+            await self._task
+        except Exception as e:
+            logger.warning("Message writer stopped with error: %s", e)
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    # ============================================================
+    # SUBMIT
+    # ============================================================
+    async def submit(self, conversation_id: int, sender_id: int, content=None, file_url=None):
+        """Xếp tin vào batch kế tiếp, trả về Message đã có id / created_at."""
+        row = {
+            "conversation_id": conversation_id,
+            "sender_id": sender_id,
+            "content": content,
+            "file_url": file_url,
+        }
+        # Writer task đã chết → ghi thẳng, không xếp vào hàng đợi không ai đọc
+        if not self.running:
+            self.direct_writes += 1
+            (msg,) = await self._write([row])
+            return msg
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        # Không bao giờ treo vô hạn: hết giờ → lỗi cho người gửi (tin có thể vẫn được ghi sau)
+        return await asyncio.wait_for(future, self.submit_timeout)
+
+    # ============================================================
+    # WRITER LOOP
+    # ============================================================
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = loop.time() + self.max_delay
+
+            # Gom thêm cho tới khi đủ N dòng hoặc hết thời gian chờ
+            while len(batch) < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    # vẫn lấy nốt những gì đã nằm sẵn trong hàng đợi
+                    if self._queue.empty():
+                        break
+                    item = self._queue.get_nowait()
+                else:
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush_safe(batch)
+
+        # Dừng: ghi nốt phần còn lại
+        rest = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                rest.append(item)
+        if rest:
+            await self._flush_safe(rest)
+
+    async def _flush_safe(self, batch):
+        """1 batch lỗi bất ngờ không được làm chết writer task."""
+        try:
+            await self._flush(batch)
+        except Exception as e:
+            self.failed_batches += 1
+            logger.exception("Message batch of %d failed", len(batch))
+            for _, future in batch:
+                _resolve(future, error=e)
+
+    async def _flush(self, batch):
+        rows = [row for row, _ in batch]
+        try:
+            msgs = await self._write(rows)
+        except Exception as e:
+            # 1 dòng lỗi (vd. FK sai) không được kéo cả batch → ghi lại từng dòng
+            logger.warning("Message batch of %d failed (%s), retrying row by row", len(rows), e)
+            for row, future in batch:
+                try:
+                    (msg,) = await self._write([row])
+                    _resolve(future, msg)
+                except Exception as row_error:
+                    _resolve(future, error=row_error)
+            return
+
+        self.batches += 1
+        self.rows += len(msgs)
+        for (_, future), msg in zip(batch, msgs):
+            _resolve(future, msg)
+
+    async def _write(self, rows):
+        if db.AsyncSessionLocal is not None:
+            async with db.AsyncSessionLocal() as db_s:
+                return await crud.async_save_messages_batch(db_s, rows)
+
+        def write_sync():
+            db_s = db.SessionLocal(expire_on_commit=False)
+            try:
+                return crud.save_messages_batch(db_s, rows)
+            finally:
+                db_s.close()
+
+        return await asyncio.get_running_loop().run_in_executor(None, write_sync)
+
+    def stats(self):
+        return {
+            "enabled": self.running,
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch": round(self.rows / self.batches, 2) if self.batches else 0,
+            "failed_batches": self.failed_batches,
+            "direct_writes": self.direct_writes,
+            "pending": self._queue.qsize() if self._queue else 0,
+        }
+
+
+# -------------------------------------------------------------
+# Độ bền SQLite: PRAGMA synchronous cho mọi kết nối mới
+# -------------------------------------------------------------
+def _apply_sqlite_sync(engine):
+    if engine is None or engine.dialect.name != "sqlite":
+        return
+    if MESSAGE_BATCH_SQLITE_SYNC not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_sync(dbapi_conn, _):
+        cursor = dbapi_conn.cursor()
+        cursor.execute(f"PRAGMA synchronous = {MESSAGE_BATCH_SQLITE_SYNC}")
+        cursor.close()
+
+
+if MESSAGE_BATCH_ENABLED:
+    _apply_sqlite_sync(db.engine)
+    _apply_sqlite_sync(db.async_engine.sync_engine if db.async_engine is not None else None)
+
+
+# Singleton
+writer = MessageBatchWriter()
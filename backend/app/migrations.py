@@ -0,0 +1,256 @@
+# app/migrations.py
+"""
+Migration đơn giản có đánh số version cho DB đã tồn tại.
+
+create_all() chỉ tạo bảng mới, không thêm index / cột vào bảng cũ,
+nên mọi thay đổi schema cho DB đang chạy phải thêm vào MIGRATIONS.
+Mỗi migration phải idempotent vì DB mới tạo bằng create_all đã có sẵn schema.
+
+Chạy tay: python -m app.migrations
+"""
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from . import activity, db, reactions, storage
+
+
+# ============================================================
+# HELPERS
+# ============================================================
+def _dedupe(conn, table: str, *columns: str):
+    """Xoá bản ghi trùng, giữ lại id nhỏ nhất — cần trước khi tạo unique index."""
+    cols = ", ".join(columns)
+    conn.execute(text(
+        f"DELETE FROM {table} WHERE id NOT IN "
+        f"(SELECT MIN(id) FROM {table} GROUP BY {cols})"
+    ))
+
+
+def _create_index(conn, name: str, table: str, *columns: str, unique: bool = False):
+    cols = ", ".join(columns)
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({cols})"))
+
+
+def _add_column(conn, table: str, column: str, ddl: str):
+    """ALTER TABLE ADD COLUMN nếu cột chưa có (SQLite không hỗ trợ IF NOT EXISTS)."""
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+# ============================================================
+# MIGRATIONS
+# ============================================================
+def _0001_hot_path_indexes(conn):
+    # Lịch sử tin nhắn: WHERE conversation_id = ? ORDER BY id / created_at
+    _create_index(conn, "ix_messages_conversation_id_id", "messages", "conversation_id", "id")
+    _create_index(conn, "ix_messages_conversation_created_at", "messages", "conversation_id", "created_at")
+
+    # Kiểm tra thành viên + danh sách hội thoại của user
+    _dedupe(conn, "conversation_members", "conversation_id", "user_id")
+    _create_index(conn, "uq_conversation_members_conv_user", "conversation_members",
+                  "conversation_id", "user_id", unique=True)
+    _create_index(conn, "ix_conversation_members_user_id", "conversation_members", "user_id")
+
+    # Upsert seen
+    _dedupe(conn, "message_seen", "message_id", "user_id")
+    _create_index(conn, "uq_message_seen_message_user", "message_seen",
+                  "message_id", "user_id", unique=True)
+
+    # Gom reaction theo tin nhắn / emoji
+    _create_index(conn, "ix_message_reactions_message_emoji", "message_reactions", "message_id", "emoji")
+
+
+def _0002_message_fulltext(conn):
+    # Xem app/search.py
+    if conn.dialect.name == "sqlite":
+        try:
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                "content, content='messages', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')"
+            ))
+        except OperationalError:
+            # SQLite build không có FTS5 → search dùng fallback LIKE
+            return
+        conn.execute(text("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')"))
+
+    elif conn.dialect.name == "postgresql":
+        conn.execute(text(
+            "ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_messages_content_tsv ON messages USING GIN (content_tsv)"
+        ))
+
+
+def _0003_read_watermarks(conn):
+    _add_column(conn, "conversation_members", "last_read_message_id", "INTEGER")
+    _add_column(conn, "conversation_members", "last_read_at", "TIMESTAMP")
+
+    # Backfill watermark từ message_seen rồi compact bảng cũ
+    seen_in_conv = (
+        "FROM message_seen s JOIN messages m ON m.id = s.message_id "
+        "WHERE m.conversation_id = conversation_members.conversation_id "
+        "AND s.user_id = conversation_members.user_id"
+    )
+    conn.execute(text(
+        "UPDATE conversation_members SET "
+        f"last_read_message_id = (SELECT MAX(s.message_id) {seen_in_conv}), "
+        f"last_read_at = (SELECT MAX(s.seen_at) {seen_in_conv}) "
+        "WHERE last_read_message_id IS NULL"
+    ))
+    conn.execute(text("DELETE FROM message_seen"))
+
+
+def _0004_image_metadata(conn):
+    # Bảng blobs được create_all tạo trước khi chạy migration
+    for table in ("media", "blobs"):
+        _add_column(conn, table, "width", "INTEGER")
+        _add_column(conn, table, "height", "INTEGER")
+        _add_column(conn, table, "blurhash", "VARCHAR(64)")
+
+
+def _0005_media_gallery(conn):
+    _add_column(conn, "media", "message_id", "INTEGER")
+    _add_column(conn, "media", "kind", "VARCHAR(16)")
+    _add_column(conn, "media", "mime", "VARCHAR(100)")
+    _add_column(conn, "media", "size", "INTEGER")
+    _create_index(conn, "ix_media_conversation_kind_id", "media", "conversation_id", "kind", "id")
+
+    # Media cũ chưa có kind / mime
+    rows = conn.execute(text("SELECT id, url FROM media WHERE kind IS NULL")).all()
+    if rows:
+        conn.execute(
+            text("UPDATE media SET kind = :kind, mime = :mime WHERE id = :id"),
+            [dict(zip(("kind", "mime"), storage.media_kind(url)), id=media_id) for media_id, url in rows]
+        )
+
+    # Tin có file nhưng chưa có dòng media (trước đây /media quét bảng messages)
+    rows = conn.execute(text(
+        "SELECT m.id, m.conversation_id, m.sender_id, m.content, m.file_url, m.created_at "
+        "FROM messages m WHERE m.file_url IS NOT NULL "
+        "AND NOT EXISTS (SELECT 1 FROM media WHERE media.message_id = m.id) "
+        "ORDER BY m.id"
+    )).all()
+    if not rows:
+        return
+
+    blobs = {
+        sha: (size, width, height, blurhash)
+        for sha, size, width, height, blurhash in conn.execute(text(
+            "SELECT sha256, size, width, height, blurhash FROM blobs"
+        ))
+    }
+
+    media = []
+    for msg_id, conv_id, sender_id, content, url, created_at in rows:
+        kind, mime = storage.media_kind(url)
+        size, width, height, blurhash = blobs.get(storage.blob_sha_from_url(url), (None,) * 4)
+        media.append({
+            "conversation_id": conv_id, "sender_id": sender_id, "message_id": msg_id,
+            "url": url, "filename": storage.media_filename(content, url),
+            "kind": kind, "mime": mime, "size": size,
+            "width": width, "height": height, "blurhash": blurhash,
+            "is_image": kind == "image", "uploaded_at": created_at,
+        })
+    conn.execute(text(
+        "INSERT INTO media (conversation_id, sender_id, message_id, url, filename, kind, mime, "
+        "size, width, height, blurhash, is_image, uploaded_at) VALUES (:conversation_id, "
+        ":sender_id, :message_id, :url, :filename, :kind, :mime, :size, :width, :height, "
+        ":blurhash, :is_image, :uploaded_at)"
+    ), media)
+
+    # Dòng media giữ tham chiếu blob riêng, như crud.add_message_media
+    shas = [storage.blob_sha_from_url(m["url"]) for m in media]
+    refs = [{"sha256": sha} for sha in shas if sha]
+    if refs:
+        conn.execute(text("UPDATE blobs SET ref_count = ref_count + 1 WHERE sha256 = :sha256"), refs)
+
+
+def _0006_activity_summary(conn):
+    _add_column(conn, "conversations", "last_message_id", "INTEGER")
+    _add_column(conn, "conversations", "last_message_at", "TIMESTAMP")
+    _add_column(conn, "conversations", "last_message_preview", "VARCHAR(255)")
+    _add_column(conn, "conversations", "message_count", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "conversation_members", "unread_count", "INTEGER NOT NULL DEFAULT 0")
+
+    # Backfill = chạy repair trên toàn bộ bảng
+    for stmt in activity.repair_stmts().values():
+        conn.execute(stmt)
+
+
+def _0007_reaction_counts(conn):
+    # Bảng reaction_counts do create_all tạo; đếm lại từ message_reactions
+    for stmt in reactions.rebuild_stmts():
+        conn.execute(stmt)
+
+
+MIGRATIONS = [
+    (1, "hot_path_indexes", _0001_hot_path_indexes),
+    (2, "message_fulltext", _0002_message_fulltext),
+    (3, "read_watermarks", _0003_read_watermarks),
+    (4, "image_metadata", _0004_image_metadata),
+    (5, "media_gallery", _0005_media_gallery),
+    (6, "activity_summary", _0006_activity_summary),
+    (7, "reaction_counts", _0007_reaction_counts),
+]
+
+
+# ============================================================
+# RUNNER
+# ============================================================
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(255) NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def run_migrations(engine=None):
+    """
+    Chạy các migration chưa áp dụng theo thứ tự version.
+    Mỗi migration chạy trong 1 transaction riêng cùng với dòng ghi version,
+    nên nếu lỗi giữa chừng thì lần khởi động sau sẽ chạy lại.
+    """
+    engine = engine or db.engine
+    done = applied_versions(engine)
+    applied = []
+
+    for version, name, fn in MIGRATIONS:
+        if version in done:
+            continue
+        try:
+            with engine.begin() as conn:
+                fn(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, name, applied_at) "
+                         "VALUES (:v, :n, :t)"),
+                    {"v": version, "n": name, "t": datetime.utcnow()}
+                )
+        except IntegrityError:
+            # Worker khác vừa áp dụng cùng version → bỏ qua
+            if version in applied_versions(engine):
+                continue
+            raise
+        applied.append(version)
+
+    return applied
+
+
+if __name__ == "__main__":
+    from . import models  # noqa: F401 — đăng ký bảng vào metadata
+
+    models.Base.metadata.create_all(bind=db.engine)
+    print("Applied:", run_migrations(db.engine) or "nothing to do")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .db import Base
@@ -44,6 +44,13 @@ class Conversation(Base):
     media_items = relationship("Media", back_populates="conversation")
     theme = Column(String, default="default")
 
+    # Tóm tắt hoạt động, cập nhật cùng transaction với crud.save_message
+    # (sửa lệch bằng: python -m app.activity)
+    last_message_id = Column(Integer, nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+    last_message_preview = Column(String(255), nullable=True)
+    message_count = Column(Integer, default=0, server_default="0", nullable=False)
+
 
 # ============================================================
 # CONVERSATION MEMBER
@@ -57,9 +64,20 @@ class ConversationMember(Base):
 
     nickname = Column(String(100), nullable=True)
 
+    # Watermark đã xem: mọi tin có id <= last_read_message_id coi như đã xem
+    last_read_message_id = Column(Integer, nullable=True)
+    last_read_at = Column(DateTime, nullable=True)
+    # Số tin của người khác sau watermark: +1 khi có tin mới, tính lại khi đọc
+    unread_count = Column(Integer, default=0, server_default="0", nullable=False)
+
     conversation = relationship("Conversation", back_populates="members")
     user = relationship("User", back_populates="conversations")
 
+    __table_args__ = (
+        Index("uq_conversation_members_conv_user", "conversation_id", "user_id", unique=True),
+        Index("ix_conversation_members_user_id", "user_id"),
+    )
+
 
 # ============================================================
 # MESSAGE
@@ -79,6 +97,11 @@ class Message(Base):
 
     seen_by = relationship("MessageSeen", back_populates="message")
 
+    __table_args__ = (
+        Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+        Index("ix_messages_conversation_created_at", "conversation_id", "created_at"),
+    )
+
 
 # ============================================================
 # MESSAGE SEEN
@@ -94,6 +117,10 @@ class MessageSeen(Base):
 
     message = relationship("Message", back_populates="seen_by")
 
+    __table_args__ = (
+        Index("uq_message_seen_message_user", "message_id", "user_id", unique=True),
+    )
+
 
 # ============================================================
 # MEDIA — ảnh & file
@@ -104,15 +131,58 @@ class Media(Base):
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"))
     sender_id = Column(Integer, ForeignKey("users.id"))
+    # Tin nhắn đính kèm file (None với media cũ tạo qua save_media)
+    message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
 
     url = Column(String(255), nullable=False)
     filename = Column(String(255), nullable=True)
 
+    # image / video / audio / file (storage.MEDIA_KINDS)
+    kind = Column(String(16), nullable=True)
+    mime = Column(String(100), nullable=True)
+    size = Column(Integer, nullable=True)
+
     is_image = Column(Boolean, default=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
 
+    # Kích thước ảnh gốc + blurhash làm placeholder (app/thumbnails.py)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    blurhash = Column(String(64), nullable=True)
+
     conversation = relationship("Conversation", back_populates="media_items")
 
+    __table_args__ = (
+        # Thư viện media: WHERE conversation_id = ? AND kind = ? ORDER BY id DESC
+        Index("ix_media_conversation_kind_id", "conversation_id", "kind", "id"),
+    )
+
+
+# ============================================================
+# BLOB — file upload lưu theo SHA-256 (xem app/storage.py)
+# ============================================================
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), unique=True, nullable=False)
+    size = Column(Integer, nullable=False)
+    ext = Column(String(16), default="")
+
+    # Số messages.file_url / media.url / users.avatar_url trỏ tới blob
+    ref_count = Column(Integer, default=0, nullable=False)
+    # Lần upload gần nhất — blob chưa ai dùng được giữ BLOB_GC_GRACE giây sau mốc này
+    uploaded_at = Column(DateTime, default=datetime.utcnow)
+
+    # Chỉ có với ảnh, điền sau khi sinh thumbnail
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    blurhash = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        Index("ix_blobs_ref_count_uploaded_at", "ref_count", "uploaded_at"),
+    )
+
 # ============================================================
 # MESSAGE REACTION
 # ============================================================
@@ -128,4 +198,38 @@ class MessageReaction(Base):
 
     __table_args__ = (
         UniqueConstraint("message_id", "user_id", name="unique_user_reaction"),
+        Index("ix_message_reactions_message_emoji", "message_id", "emoji"),
+    )
+
+
+class ReactionCount(Base):
+    """Số người thả mỗi emoji cho 1 tin nhắn, giữ sẵn bởi app/reactions.py."""
+    __tablename__ = "reaction_counts"
+
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True)
+    emoji = Column(String(10), primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+
+
+# ============================================================
+# CHANGE LOG — nguồn cho GET /sync (xem app/sync.py)
+# ============================================================
+class Change(Base):
+    __tablename__ = "changes"
+
+    # id tăng dần là số thứ tự thay đổi; AUTOINCREMENT để SQLite không dùng lại id sau khi prune
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, nullable=False)
+    # message / reaction / read / member_added / member_removed / theme / nickname
+    kind = Column(String(20), nullable=False)
+    # message_id với message / reaction / read, None với thay đổi của hội thoại
+    entity_id = Column(Integer, nullable=True)
+    # Người được thay đổi: người đọc, thành viên được thêm / bớt / đổi biệt danh
+    user_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_changes_conversation_id_id", "conversation_id", "id"),
+        Index("ix_changes_created_at", "created_at"),
+        {"sqlite_autoincrement": True},
     )
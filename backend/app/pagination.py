@@ -0,0 +1,39 @@
+# app/pagination.py
+import base64
+import json
+from typing import Optional
+
+
+# ============================================================
+# OPAQUE CURSOR
+# ============================================================
+def encode_cursor(data: dict) -> str:
+    """
+    Đóng gói vị trí phân trang thành chuỗi opaque cho client.
+    Client chỉ cần gửi lại nguyên chuỗi, không cần hiểu nội dung.
+    """
+    raw = json.dumps(data, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], fields: Optional[dict] = None) -> Optional[dict]:
+    """
+    Giải mã cursor do encode_cursor tạo ra.
+    fields: {tên: kiểu} — trường có mặt phải đúng kiểu (cursor base64 hợp lệ
+    nhưng bị sửa tay kiểu {"before": "x"} → 400 thay vì 500 ở route).
+    Raise ValueError nếu cursor hỏng / bị sửa tay.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(data, dict):
+        raise ValueError("Invalid cursor")
+    for name, type_ in (fields or {}).items():
+        value = data.get(name)
+        if value is not None and (not isinstance(value, type_) or isinstance(value, bool)):
+            raise ValueError("Invalid cursor")
+    return data
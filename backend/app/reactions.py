@@ -0,0 +1,160 @@
+# app/reactions.py
+"""
+Reaction ghi theo kiểu tăng dần, không đọc lại cả danh sách:
+
+- message_reactions: 1 dòng / (message, user), ghi bằng INSERT ... ON CONFLICT DO UPDATE
+- reaction_counts: số người theo (message, emoji), cộng / trừ cùng transaction
+
+apply() trả về delta (emoji thêm / bỏ + số đếm mới) để broadcast "reaction_delta";
+danh sách đầy đủ (kèm username) đọc khi cần qua crud.get_message_reactions.
+Nếu reaction_counts bị lệch thì dựng lại từ message_reactions:
+    python -m app.reactions
+"""
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import models, sync
+
+
+def _insert_for(session):
+    """INSERT có ON CONFLICT theo dialect của session (Session hoặc AsyncSession)."""
+    return postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+
+
+# ============================================================
+# CÂU LỆNH
+# ============================================================
+def _release_stmt(message_id: int, user_id: int, emoji: str):
+    """Trừ 1 ở emoji cũ của user (nếu khác emoji mới) → RETURNING emoji cũ + số còn lại."""
+    reaction = models.MessageReaction
+    counts = models.ReactionCount
+    previous = (
+        select(reaction.emoji)
+        .where(
+            reaction.message_id == message_id,
+            reaction.user_id == user_id,
+            reaction.emoji.is_distinct_from(emoji)
+        )
+        .scalar_subquery()
+    )
+    return (
+        update(counts)
+        .where(counts.message_id == message_id, counts.emoji == previous)
+        .values(count=counts.count - 1)
+        .returning(counts.emoji, counts.count)
+    )
+
+
+def _upsert_stmt(insert_, message_id: int, user_id: int, emoji: str):
+    """Thêm / đổi reaction; cùng emoji → không ghi gì, không có dòng RETURNING."""
+    reaction = models.MessageReaction
+    stmt = insert_(reaction).values(
+        message_id=message_id, user_id=user_id, emoji=emoji, created_at=datetime.utcnow()
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[reaction.message_id, reaction.user_id],
+        set_={"emoji": stmt.excluded.emoji, "created_at": stmt.excluded.created_at},
+        where=reaction.emoji.is_distinct_from(stmt.excluded.emoji)
+    ).returning(reaction.id)
+
+
+def _increment_stmt(insert_, message_id: int, emoji: str):
+    counts = models.ReactionCount
+    stmt = insert_(counts).values(message_id=message_id, emoji=emoji, count=1)
+    return stmt.on_conflict_do_update(
+        index_elements=[counts.message_id, counts.emoji],
+        set_={"count": counts.count + 1}
+    ).returning(counts.count)
+
+
+def _drop_empty_stmt(message_id: int, emoji: str):
+    counts = models.ReactionCount
+    return delete(counts).where(counts.message_id == message_id, counts.emoji == emoji, counts.count <= 0)
+
+
+def _username_stmt(user_id: int):
+    return select(models.User.username).where(models.User.id == user_id)
+
+
+def _delta(message_id: int, user_id: int, username, added, removed) -> dict:
+    return {
+        "message_id": message_id,
+        "user_id": user_id,
+        "username": username,
+        "added": {"emoji": added[0], "count": added[1]},
+        "removed": {"emoji": removed[0], "count": removed[1]} if removed else None,
+    }
+
+
+# ============================================================
+# GHI
+# ============================================================
+def apply(db: Session, message_id: int, user_id: int, emoji: str):
+    """Đặt reaction của user cho tin nhắn và commit. Trả về delta, None nếu không đổi."""
+    insert_ = _insert_for(db)
+    removed = db.execute(_release_stmt(message_id, user_id, emoji)).first()
+    if db.execute(_upsert_stmt(insert_, message_id, user_id, emoji)).first() is None:
+        db.rollback()
+        return None
+
+    added = (emoji, db.execute(_increment_stmt(insert_, message_id, emoji)).scalar_one())
+    if removed:
+        db.execute(_drop_empty_stmt(message_id, removed.emoji))
+    db.execute(sync.reaction_change_stmt(message_id, user_id))
+    username = db.execute(_username_stmt(user_id)).scalar_one_or_none()
+    db.commit()
+    return _delta(message_id, user_id, username, added, removed)
+
+
+async def async_apply(db, message_id: int, user_id: int, emoji: str):
+    """Bản async của apply (db là AsyncSession)."""
+    insert_ = _insert_for(db)
+    removed = (await db.execute(_release_stmt(message_id, user_id, emoji))).first()
+    if (await db.execute(_upsert_stmt(insert_, message_id, user_id, emoji))).first() is None:
+        await db.rollback()
+        return None
+
+    added = (emoji, (await db.execute(_increment_stmt(insert_, message_id, emoji))).scalar_one())
+    if removed:
+        await db.execute(_drop_empty_stmt(message_id, removed.emoji))
+    await db.execute(sync.reaction_change_stmt(message_id, user_id))
+    username = (await db.execute(_username_stmt(user_id))).scalar_one_or_none()
+    await db.commit()
+    return _delta(message_id, user_id, username, added, removed)
+
+
+# ============================================================
+# REBUILD — dựng lại reaction_counts từ message_reactions
+# ============================================================
+def rebuild_stmts():
+    reaction = models.MessageReaction
+    return [
+        delete(models.ReactionCount),
+        insert(models.ReactionCount).from_select(
+            ["message_id", "emoji", "count"],
+            select(reaction.message_id, reaction.emoji, func.count())
+            .where(reaction.emoji.isnot(None))
+            .group_by(reaction.message_id, reaction.emoji)
+        ),
+    ]
+
+
+def rebuild(db: Session) -> int:
+    """Trả về số dòng (message, emoji) sau khi dựng lại."""
+    for stmt in rebuild_stmts():
+        db.execute(stmt)
+    db.commit()
+    return db.query(func.count()).select_from(models.ReactionCount).scalar()
+
+
+if __name__ == "__main__":
+    from . import db as database
+
+    session = database.SessionLocal()
+    try:
+        print("Rebuilt:", rebuild(session))
+    finally:
+        session.close()
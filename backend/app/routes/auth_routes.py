@@ -13,8 +13,16 @@ def register(user: schemas.UserCreate, db_s: Session = Depends(db.get_db)):
 @router.post("/login")
 def login(payload: schemas.LoginRequest, db_s: Session = Depends(db.get_db)):
     user = crud.get_user_by_username(db_s, payload.username)
-    if not user or not auth.verify_password(payload.password, user.password_hash):
+    if not user:
         raise HTTPException(401, "Invalid credentials")
-    
+
+    ok, new_hash = auth.verify_and_update_password(payload.password, user.password_hash)
+    if not ok:
+        raise HTTPException(401, "Invalid credentials")
+
+    # Cost bcrypt đã đổi → lưu hash mới, người dùng không cần làm gì
+    if new_hash:
+        crud.update_password_hash(db_s, user.id, new_hash)
+
     token = auth.create_access_token({"sub": str(user.id)})
     return {"access_token": token, "token_type": "bearer", "user": {"id": user.id, "username": user.username}}
@@ -1,55 +1,75 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Optional
 from .. import db, crud, schemas, auth, models
+from ..pagination import encode_cursor, decode_cursor
+from ..membership import membership
 
 router = APIRouter(prefix="/conversations", tags=["conversations"])
 
+
+def _require_member(db_s: Session, conversation_id: int, user_id: int):
+    if membership.is_member(db_s, conversation_id, user_id):
+        return
+    if crud.get_conversation(db_s, conversation_id) is None:
+        raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
+    raise HTTPException(status_code=403, detail="You are not a member of this conversation")
+
+
 @router.post("/")
 def create_conv(
     payload: schemas.ConversationCreate,
     db_s: Session = Depends(db.get_db),
-    current_user = Depends(auth.get_current_user)
+    current_user_id: int = Depends(auth.get_current_user_id)
 ):
     conv = crud.create_conversation(
         db_s,
         payload.name,
         payload.is_group,
         payload.member_ids,
-        current_user.id
+        current_user_id
     )
     return {"id": conv.id, "name": conv.name, "is_group": conv.is_group}
 
 
 @router.get("/mine")
 def my_convs(
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước"),
+    limit: int = Query(50, ge=1, le=200),
     db_s: Session = Depends(db.get_db),
-    current_user = Depends(auth.get_current_user)
+    current_user_id: int = Depends(auth.get_current_user_id)
 ):
-    convs = crud.get_conversations_by_user(db_s, current_user.id)
-    
-    results = []
-    for c in convs:
-        members = []
-        for m in c.members:
-            # m là ConversationMember instance; m.user là User
-            members.append({
-                "id": m.user.id,
-                "username": m.user.username,
-                "avatar_url": m.user.avatar_url,
-                "display_name": m.user.display_name,
-                # Trả nickname nếu có trên ConversationMember
-                "nickname": getattr(m, "nickname", None)
-            })
+    """Hộp thư: hội thoại mới hoạt động nhất trước, kèm tin cuối + số tin chưa đọc"""
+    try:
+        decoded = decode_cursor(cursor, {"at": str, "id": int})
+        before = (datetime.fromisoformat(decoded["at"]), decoded["id"]) if decoded else None
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
+    rows, has_more = crud.get_inbox(db_s, current_user_id, before, limit)
+
+    results = []
+    for c, last, unread_count, activity_at in rows:
         results.append({
-            "id": c.id,
-            "name": c.name,
-            "is_group": c.is_group,
-            "theme": c.theme,
-            "members": members
+            **crud.conversation_state(c),
+            "last_message": {
+                "id": last.id,
+                "sender_id": last.sender_id,
+                "content": last.content,
+                "file_url": last.file_url,
+                "created_at": last.created_at
+            } if last else None,
+            "unread_count": unread_count,
+            "last_activity_at": activity_at
         })
 
-    return results
+    next_cursor = None
+    if has_more:
+        c, _, _, activity_at = rows[-1]
+        next_cursor = encode_cursor({"at": activity_at.isoformat(), "id": c.id})
+
+    return {"items": results, "next_cursor": next_cursor}
 
 
 @router.put("/nickname")
@@ -58,19 +78,13 @@ def update_nickname(
     user_id: int,
     nickname: str,
     db_s: Session = Depends(db.get_db),
-    current_user = Depends(auth.get_current_user)
+    current_user_id: int = Depends(auth.get_current_user_id)
 ):
     # Chỉ cập nhật nếu bạn là thành viên conversation
-    member = db_s.query(models.ConversationMember).filter(
-        models.ConversationMember.conversation_id == conversation_id,
-        models.ConversationMember.user_id == user_id
-    ).first()
+    _require_member(db_s, conversation_id, current_user_id)
+    member = crud.update_nickname(db_s, conversation_id, user_id, nickname)
 
     if not member:
         raise HTTPException(status_code=404, detail="Member not found")
 
-    member.nickname = nickname
-    db_s.commit()
-    db_s.refresh(member)
-
-    return {"message": "Nickname updated", "nickname": nickname}
\ No newline at end of file
+    return {"message": "Nickname updated", "nickname": nickname}
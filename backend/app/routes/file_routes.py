@@ -1,20 +1,60 @@
 # app/routes/file_routes.py
-from fastapi import APIRouter, UploadFile, File, HTTPException
-import os, shutil, uuid
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, HTTPException
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+import os
+from .. import db, crud, storage, thumbnails
+from ..storage import UPLOAD_DIR, MAX_UPLOAD_SIZE, store_blob
 
 router = APIRouter(prefix="/files", tags=["files"])
 
-UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-MAX_SIZE = 64 * 1024 * 1024  # 64MB limit
+MAX_SIZE = MAX_UPLOAD_SIZE  # 64MB limit (MAX_UPLOAD_SIZE)
 
 @router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    filename = f"{uuid.uuid4().hex}_{file.filename}"
-    save_path = os.path.join(UPLOAD_DIR, filename)
+async def upload_file(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    db_s: Session = Depends(db.get_db)
+):
+    # Ghi theo chunk ngoài event loop, vượt MAX_SIZE → 413.
+    # Lưu theo SHA-256: cùng 1 file gửi nhiều lần chỉ tốn 1 bản trên đĩa
+    blob = await store_blob(file, db_s, max_size=MAX_SIZE)
 
-    with open(save_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Ảnh → sinh thumbnail / preview sau khi đã trả response
+    ext = os.path.splitext(blob.url)[1]
+    if thumbnails.is_image_ext(ext):
+        background_tasks.add_task(thumbnails.generator.process_upload, blob.sha256, ext)
 
-    # LUÔN trả về URL chuẩn có format /uploads/tenfile
-    return {"file_url": f"/uploads/{filename}"}
+    # LUÔN trả về URL chuẩn có format /uploads/...
+    return {"file_url": blob.url, "size": blob.size, "sha256": blob.sha256}
+
+
+@router.get("/derivatives/{sha256}/{kind}")
+async def get_derivative(sha256: str, kind: str, db_s: Session = Depends(db.get_db)):
+    """Thumbnail / preview của ảnh; chưa có (hoặc bị mất) → sinh lại ngay."""
+    if kind not in thumbnails.KINDS:
+        raise HTTPException(status_code=404, detail="Unknown derivative")
+
+    blob = await run_in_threadpool(crud.get_blob, db_s, sha256)
+    if not blob or not thumbnails.is_image_ext(blob.ext):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    path = thumbnails.derivative_path(blob.sha256, kind)
+    if not os.path.exists(path):
+        meta = await thumbnails.generator.ensure(blob.sha256, blob.ext)
+        if meta is None:
+            # Không có Pillow / ảnh lỗi → trả ảnh gốc
+            return FileResponse(storage.blob_path(blob.sha256, blob.ext))
+        if blob.width is None:
+            await run_in_threadpool(crud.set_image_meta, db_s, blob.sha256, **meta)
+
+    return FileResponse(
+        path,
+        media_type="image/jpeg",
+        headers={
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "ETag": f'"{blob.sha256}-{kind}"'
+        }
+    )
@@ -1,41 +1,61 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from .. import db, models, auth
+from typing import Optional
+from .. import db, auth, crud, storage, thumbnails
+from ..pagination import encode_cursor, decode_cursor
+from ..membership import membership
 
 router = APIRouter(prefix="/media", tags=["media"])
 
+
+def _require_member(db_s: Session, conversation_id: int, user_id: int):
+    if membership.is_member(db_s, conversation_id, user_id):
+        return
+    if crud.get_conversation(db_s, conversation_id) is None:
+        raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
+    raise HTTPException(status_code=403, detail="You are not a member of this conversation")
+
+
+def _media_out(media):
+    return {
+        "id": media.id,
+        "message_id": media.message_id,
+        "sender_id": media.sender_id,
+        "kind": media.kind,
+        "mime": media.mime,
+        "url": media.url,
+        "filename": media.filename,
+        "size": media.size,
+        "width": media.width,
+        "height": media.height,
+        "blurhash": media.blurhash,
+        "created_at": media.uploaded_at,
+        **thumbnails.derivative_urls(media.url)
+    }
+
+
 @router.get("/{conversation_id}")
 def get_media(conversation_id: int,
+              kind: Optional[str] = Query(None, description="image, video, audio, file; nhiều loại cách nhau bởi dấu phẩy"),
+              cursor: Optional[str] = Query(None, description="next_cursor của trang trước"),
+              limit: int = Query(50, ge=1, le=200),
               db_s: Session = Depends(db.get_db),
-              current_user = Depends(auth.get_current_user)):
-
-    # Lấy toàn bộ tin nhắn có file
-    files = db_s.query(models.Message).filter(
-        models.Message.conversation_id == conversation_id,
-        models.Message.file_url.isnot(None)
-    ).all()
-
-    images = []
-    documents = []
-
-    for m in files:
-        url = m.file_url.lower()
-
-        if url.endswith((".jpg", ".png", ".jpeg", ".gif", ".webp")):
-            images.append({
-                "id": m.id,
-                "url": m.file_url,
-                "created_at": m.created_at
-            })
-        else:
-            documents.append({
-                "id": m.id,
-                "url": m.file_url,
-                "created_at": m.created_at,
-                "filename": url.split("/")[-1]
-            })
+              current_user_id: int = Depends(auth.get_current_user_id)):
+    _require_member(db_s, conversation_id, current_user_id)
+
+    kinds = [k.strip() for k in kind.split(",") if k.strip()] if kind else None
+    if kinds and not set(kinds) <= set(storage.MEDIA_KINDS):
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(storage.MEDIA_KINDS)}")
+
+    try:
+        before_id = (decode_cursor(cursor, {"before": int}) or {}).get("before")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    items, has_more = crud.get_media_page(db_s, conversation_id, kinds, before_id, limit)
 
     return {
-        "images": images,
-        "files": documents
+        "items": [_media_out(m) for m in items],
+        "next_cursor": encode_cursor({"before": items[-1].id}) if has_more else None,
+        "counts": crud.get_media_counts(db_s, conversation_id)
     }
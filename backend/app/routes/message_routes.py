@@ -1,128 +1,136 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from .. import db, crud, schemas, auth, models
-from ..crud import get_message_reactions
+from typing import Optional
+from .. import db, crud, schemas, auth, models, search
+from ..membership import membership
+from ..pagination import encode_cursor, decode_cursor
 
 router = APIRouter(prefix="/messages", tags=["messages"])
 
+
+def _require_member(db_s: Session, conversation_id: int, user_id: int):
+    if membership.is_member(db_s, conversation_id, user_id):
+        return
+    # Chỉ query hội thoại khi bị từ chối, để phân biệt 404 / 403
+    if crud.get_conversation(db_s, conversation_id) is None:
+        raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
+    raise HTTPException(status_code=403, detail="You are not a member of this conversation")
+
+
 @router.post("/", response_model=schemas.MessageOut)
 def send_message(
     payload: schemas.MessageCreate,
     db_s: Session = Depends(db.get_db),
-    current_user = Depends(auth.get_current_user)
+    current_user_id: int = Depends(auth.get_current_user_id)
 ):
-    conv = db_s.query(models.Conversation).filter(models.Conversation.id == payload.conversation_id).first()
-    if not conv:
-        raise HTTPException(status_code=404, detail=f"Conversation {payload.conversation_id} not found")
-
-    member_ids = [m.user_id for m in conv.members]
-    if current_user.id not in member_ids:
-        raise HTTPException(status_code=403, detail="You are not a member of this conversation")
+    _require_member(db_s, payload.conversation_id, current_user_id)
 
     msg = crud.save_message(
         db=db_s,
         conversation_id=payload.conversation_id,
-        sender_id=current_user.id,
+        sender_id=current_user_id,
         content=payload.content,
         file_url=payload.file_url
     )
     return msg
 
 
+@router.get("/search")
+def search_all_messages(
+    q: str = Query(..., min_length=1, description="Search query"),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước"),
+    limit: int = Query(20, ge=1, le=100),
+    db_s: Session = Depends(db.get_db),
+    current_user_id: int = Depends(auth.get_current_user_id)
+):
+    """Search messages across every conversation the caller belongs to"""
+    return _search(db_s, current_user_id, q, None, cursor, limit)
+
+
+@router.get("/reactions/{message_id}")
+def get_message_reactions(
+    message_id: int,
+    db_s: Session = Depends(db.get_db),
+    current_user_id: int = Depends(auth.get_current_user_id)
+):
+    """Danh sách reaction đầy đủ (kèm username) — WS chỉ gửi reaction_delta"""
+    conversation_id = db_s.query(models.Message.conversation_id).filter(models.Message.id == message_id).scalar()
+    if conversation_id is None:
+        raise HTTPException(status_code=404, detail=f"Message {message_id} not found")
+    _require_member(db_s, conversation_id, current_user_id)
+
+    return {"message_id": message_id, "reactions": crud.get_message_reactions(db_s, message_id)}
+
+
 @router.get("/{conversation_id}")
 def get_messages(
     conversation_id: int,
+    before_id: Optional[int] = Query(None, description="Lấy các tin cũ hơn id này"),
+    after_id: Optional[int] = Query(None, description="Lấy các tin mới hơn id này"),
+    cursor: Optional[str] = Query(None, description="Cursor opaque từ next_cursor / prev_cursor"),
+    limit: int = Query(50, ge=1, le=200),
     db_s: Session = Depends(db.get_db),
-    current_user = Depends(auth.get_current_user)
+    current_user_id: int = Depends(auth.get_current_user_id)
 ):
-    conv = (
-        db_s.query(models.Conversation)
-        .filter(models.Conversation.id == conversation_id)
-        .first()
-    )
-    if not conv:
-        raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
-
-    member_ids = [m.user_id for m in conv.members]
-    if current_user.id not in member_ids:
-        raise HTTPException(status_code=403, detail="You are not a member of this conversation")
-
-    messages = (
-        db_s.query(models.Message)
-        .filter(models.Message.conversation_id == conversation_id)
-        .order_by(models.Message.created_at)
-        .all()
+    _require_member(db_s, conversation_id, current_user_id)
+
+    # Cursor opaque ưu tiên hơn before_id / after_id
+    try:
+        decoded = decode_cursor(cursor, {"before": int, "after": int})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if decoded:
+        before_id = decoded.get("before")
+        after_id = decoded.get("after")
+
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="Use either before_id or after_id, not both")
+
+    messages, has_older, has_newer = crud.get_messages_page(
+        db_s, conversation_id, before_id=before_id, after_id=after_id, limit=limit
     )
 
-    result = []
-    for msg in messages:
-        seen = (
-            db_s.query(models.MessageSeen)
-            .filter(models.MessageSeen.message_id == msg.id)
-            .all()
-        )
+    result = crud.hydrate_messages(db_s, messages)
 
-        result.append({
-            "id": msg.id,
-            "conversation_id": msg.conversation_id,
-            "sender_id": msg.sender_id,
-            "content": msg.content,
-            "file_url": msg.file_url,
-            "created_at": msg.created_at,
-            "reactions": get_message_reactions(db_s, msg.id),
-            "seen_by": [{"user_id": s.user_id, "seen_at": s.seen_at} for s in seen]
-        })
+    # prev_cursor → trang cũ hơn, next_cursor → trang mới hơn
+    prev_cursor = encode_cursor({"before": messages[0].id}) if messages and has_older else None
+    next_cursor = encode_cursor({"after": messages[-1].id}) if messages and has_newer else None
 
-    return result
+    return {
+        "items": result,
+        "prev_cursor": prev_cursor,
+        "next_cursor": next_cursor
+    }
 
 
 @router.get("/{conversation_id}/search")
 def search_messages(
     conversation_id: int,
     q: str = Query(..., min_length=1, description="Search query"),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước"),
+    limit: int = Query(20, ge=1, le=100),
     db_s: Session = Depends(db.get_db),
-    current_user = Depends(auth.get_current_user)
+    current_user_id: int = Depends(auth.get_current_user_id)
 ):
     """Search messages in a conversation by content"""
-    # Check if conversation exists
-    conv = (
-        db_s.query(models.Conversation)
-        .filter(models.Conversation.id == conversation_id)
-        .first()
-    )
-    if not conv:
-        raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
+    _require_member(db_s, conversation_id, current_user_id)
+
+    return _search(db_s, current_user_id, q, conversation_id, cursor, limit)
 
-    # Check if user is a member
-    member_ids = [m.user_id for m in conv.members]
-    if current_user.id not in member_ids:
-        raise HTTPException(status_code=403, detail="You are not a member of this conversation")
-
-    # Search messages
-    messages = (
-        db_s.query(models.Message)
-        .filter(
-            models.Message.conversation_id == conversation_id,
-            models.Message.content.ilike(f"%{q}%")
-        )
-        .order_by(models.Message.created_at.desc())
-        .all()
-    )
 
-    result = []
-    for msg in messages:
-        # Get sender info
-        sender = db_s.query(models.User).filter(models.User.id == msg.sender_id).first()
-        
-        result.append({
-            "id": msg.id,
-            "conversation_id": msg.conversation_id,
-            "sender_id": msg.sender_id,
-            "sender_name": sender.username if sender else "Unknown",
-            "content": msg.content,
-            "file_url": msg.file_url,
-            "created_at": msg.created_at
-        })
-
-    return result
+def _search(db_s: Session, user_id: int, q: str, conversation_id: Optional[int],
+            cursor: Optional[str], limit: int):
+    try:
+        offset = (decode_cursor(cursor, {"offset": int}) or {}).get("offset", 0)
+        if offset < 0:
+            raise ValueError("Invalid cursor")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
+    items, has_more = search.search_messages(
+        db_s, user_id, q, conversation_id=conversation_id, limit=limit, offset=offset
+    )
+    return {
+        "items": items,
+        "next_cursor": encode_cursor({"offset": offset + limit}) if has_more else None
+    }
@@ -1,12 +1,25 @@
 # settings_routes.py
 from fastapi import APIRouter, Depends, UploadFile, HTTPException
 from sqlalchemy.orm import Session
-from app import db, auth, crud, models
+from app import db, auth, crud
 from app.schemas import UserProfileUpdate, NicknameUpdate, ThemeUpdate
+from app.storage import store_blob
+from app.membership import membership
+from starlette.concurrency import run_in_threadpool
 import os
 
 router = APIRouter(prefix="/settings", tags=["Settings"])
 
+AVATAR_MAX_SIZE = int(os.getenv("AVATAR_MAX_SIZE", str(5 * 1024 * 1024)))  # 5MB
+
+
+def _require_member(db_s: Session, conversation_id: int, user_id: int):
+    if membership.is_member(db_s, conversation_id, user_id):
+        return
+    if crud.get_conversation(db_s, conversation_id) is None:
+        raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
+    raise HTTPException(status_code=403, detail="You are not a member of this conversation")
+
 
 # ============================================================
 # 1. Cập nhật hồ sơ người dùng
@@ -15,11 +28,11 @@ router = APIRouter(prefix="/settings", tags=["Settings"])
 def update_profile(
     data: UserProfileUpdate,
     db_s: Session = Depends(db.get_db),
-    current_user=Depends(auth.get_current_user)
+    current_user_id: int = Depends(auth.get_current_user_id)
 ):
     updated = crud.update_user_profile(
         db_s,
-        current_user.id,
+        current_user_id,
         **data.dict(exclude_unset=True)
     )
     return updated
@@ -29,22 +42,16 @@ def update_profile(
 # 2. Upload avatar
 # ============================================================
 @router.post("/avatar")
-def upload_avatar(
+async def upload_avatar(
     file: UploadFile,
     db_s: Session = Depends(db.get_db),
-    current_user=Depends(auth.get_current_user)
+    current_user_id: int = Depends(auth.get_current_user_id)
 ):
-    folder = "app/uploads/avatars"
-    os.makedirs(folder, exist_ok=True)
-
-    file_path = f"{folder}/{current_user.id}_{file.filename}"
-
-    with open(file_path, "wb") as f:
-        f.write(file.file.read())
-
-    db_path = file_path.replace("app", "")
+    # URL theo SHA-256 → đổi ảnh là đổi URL, cache phía client không bị cũ
+    blob = await store_blob(file, db_s, max_size=AVATAR_MAX_SIZE)
+    db_path = blob.url
 
-    crud.update_user_avatar(db_s, current_user.id, db_path)
+    await run_in_threadpool(crud.update_user_avatar, db_s, current_user_id, db_path)
 
     return {"avatar_url": db_path}
 
@@ -73,7 +80,7 @@ def change_password(
 def set_nickname(
     data: NicknameUpdate,
     db_s: Session = Depends(db.get_db),
-    current_user=Depends(auth.get_current_user)
+    current_user_id: int = Depends(auth.get_current_user_id)
 ):
 
     # USER KHÁC KHÔNG ĐƯỢC ĐỔI BIỆT DANH CHO NGƯỜI KHÁC TRONG CHAT 1-1
@@ -82,7 +89,7 @@ def set_nickname(
     if not conv:
         raise HTTPException(status_code=404, detail="Hội thoại không tồn tại")
 
-    if not conv.is_group and data.user_id != current_user.id:
+    if not conv.is_group and data.user_id != current_user_id:
         raise HTTPException(status_code=403, detail="Không thể đổi biệt danh cho người khác trong chat 1-1")
 
     updated = crud.update_nickname(
@@ -105,14 +112,14 @@ def set_nickname(
 def leave_group(
     data: dict,
     db_s: Session = Depends(db.get_db),
-    current_user=Depends(auth.get_current_user)
+    current_user_id: int = Depends(auth.get_current_user_id)
 ):
 
     conversation_id = data.get("conversation_id")
     if not conversation_id:
         raise HTTPException(status_code=400, detail="Thiếu conversation_id")
 
-    ok = crud.leave_group(db_s, conversation_id, current_user.id)
+    ok = crud.leave_group(db_s, conversation_id, current_user_id)
 
     if not ok:
         raise HTTPException(status_code=400, detail="Bạn không thuộc nhóm này")
@@ -127,8 +134,9 @@ def leave_group(
 def delete_conversation(
     conversation_id: int,
     db_s: Session = Depends(db.get_db),
-    current_user=Depends(auth.get_current_user)
+    current_user_id: int = Depends(auth.get_current_user_id)
 ):
+    _require_member(db_s, conversation_id, current_user_id)
 
     ok = crud.delete_conversation(db_s, conversation_id)
 
@@ -141,26 +149,11 @@ def delete_conversation(
 def set_theme(
     data: ThemeUpdate,
     db_s: Session = Depends(db.get_db),
-    current_user=Depends(auth.get_current_user)
+    current_user_id: int = Depends(auth.get_current_user_id)
 ):
-    conv = db_s.query(models.Conversation).filter(
-        models.Conversation.id == data.conversation_id
-    ).first()
-
-    if not conv:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-
-    member = db_s.query(models.ConversationMember).filter(
-        models.ConversationMember.conversation_id == data.conversation_id,
-        models.ConversationMember.user_id == current_user.id
-    ).first()
-
-    if not member:
-        raise HTTPException(status_code=403, detail="Bạn không thuộc nhóm này")
+    _require_member(db_s, data.conversation_id, current_user_id)
 
-    conv.theme = data.theme
-    db_s.commit()
-    db_s.refresh(conv)
+    crud.update_theme(db_s, data.conversation_id, data.theme)
 
     return {
         "message": "Theme updated",
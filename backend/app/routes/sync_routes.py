@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import Optional
+from .. import db, auth, sync
+from ..pagination import encode_cursor, decode_cursor
+
+router = APIRouter(prefix="/sync", tags=["sync"])
+
+
+@router.get("")
+def get_sync(
+    since: Optional[str] = Query(None, description="cursor của lần /sync trước; bỏ trống để lấy cursor hiện tại"),
+    limit: int = Query(500, ge=1, le=2000, description="Số thay đổi tối đa mỗi trang"),
+    db_s: Session = Depends(db.get_db),
+    current_user_id: int = Depends(auth.get_current_user_id)
+):
+    """
+    Mọi thay đổi user thấy được kể từ cursor: tin mới, reaction, watermark đã xem,
+    thành viên, theme, biệt danh. has_more=true → gọi tiếp với cursor trả về.
+    """
+    try:
+        decoded = decode_cursor(since, {"seq": int, "at": int, "gaps": list})
+        if decoded is not None:
+            seq, at = int(decoded["seq"]), int(decoded["at"])
+            gaps = [[int(gid), int(seen)] for gid, seen in decoded.get("gaps", [])]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # Lần đầu / cursor hết hạn: client tải dữ liệu đầy đủ sau khi lấy cursor → không bỏ sót gì
+    if decoded is None or sync.cursor_expired(decoded):
+        latest = sync.latest_seq(db_s)
+        gaps = sync.next_gaps(db_s, 0, latest) if sync.tracks_gaps(db_s) else None
+        cursor = encode_cursor(sync.make_cursor(latest, gaps=gaps))
+        if decoded is None:
+            return {"cursor": cursor, "has_more": False}
+        return {"reset": True, "cursor": cursor, "has_more": False}
+
+    changes, has_more = sync.get_changes(db_s, current_user_id, seq, limit, [gid for gid, _ in gaps])
+    next_seq = max((ch.id for ch in changes if ch.id > seq), default=seq)
+    if sync.tracks_gaps(db_s):
+        gaps = sync.next_gaps(db_s, seq, next_seq, gaps)
+
+    return {
+        **sync.build_delta(db_s, current_user_id, changes),
+        # seq không tiến → giữ mốc at cũ, cursor vẫn hết hạn đúng hạn
+        "cursor": encode_cursor(sync.make_cursor(next_seq, at if next_seq == seq else None, gaps)),
+        "has_more": has_more
+    }
@@ -0,0 +1,111 @@
+# app/routes/upload_routes.py
+"""
+Phục vụ file trong uploads/ (thay cho StaticFiles).
+
+- Blob (uploads/blobs/..., uploads/derived/...): tên file chính là SHA-256 nên
+  nội dung không bao giờ đổi → Cache-Control immutable 1 năm, ETag = SHA-256.
+- File kiểu cũ (uploads/<uuid>_name): tên duy nhất, cũng immutable; ETag là
+  SHA-256 tính 1 lần rồi nhớ theo (mtime, size).
+- Avatar kiểu cũ (uploads/avatars/<user_id>_name) bị ghi đè tại chỗ → no-cache,
+  client revalidate bằng ETag. Avatar mới nằm trong blob store nên URL đổi theo nội dung.
+- If-None-Match → 304; Range / If-Range → 206 (FileResponse của Starlette);
+  server ASGI hỗ trợ "http.response.pathsend" sẽ gửi file bằng sendfile.
+"""
+import hashlib
+import os
+import stat
+import threading
+from collections import OrderedDict
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+
+from .. import storage
+
+router = APIRouter(tags=["uploads"])
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_ROOT = os.path.realpath(storage.UPLOAD_DIR)
+_PRIVATE_DIRS = (os.path.realpath(storage.BLOB_TMP_DIR),)
+_MUTABLE_DIRS = (os.path.realpath(os.path.join(storage.UPLOAD_DIR, "avatars")),)
+
+
+# -------------------------------------------------------------
+# ETag cho file không nằm trong blob store: hash 1 lần, nhớ theo (mtime, size)
+# -------------------------------------------------------------
+_ETAG_CACHE_SIZE = 4096
+_etag_cache = OrderedDict()
+_etag_lock = threading.Lock()
+
+
+def _hash_file(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(storage.UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _content_etag(path: str, stat_result: os.stat_result):
+    key = (stat_result.st_mtime_ns, stat_result.st_size)
+    with _etag_lock:
+        cached = _etag_cache.get(path)
+        if cached and cached[0] == key:
+            _etag_cache.move_to_end(path)
+            return cached[1]
+
+    etag = f'"{_hash_file(path)}"'
+    with _etag_lock:
+        _etag_cache[path] = (key, etag)
+        _etag_cache.move_to_end(path)
+        while len(_etag_cache) > _ETAG_CACHE_SIZE:
+            _etag_cache.popitem(last=False)
+    return etag
+
+
+def _under(path: str, dirs):
+    return any(path == d or path.startswith(d + os.sep) for d in dirs)
+
+
+def _not_modified(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return etag in tags
+
+
+@router.api_route("/uploads/{file_path:path}", methods=["GET", "HEAD"])
+async def serve_upload(file_path: str, request: Request):
+    path = os.path.realpath(os.path.join(_ROOT, file_path))
+    if not _under(path, (_ROOT,)) or _under(path, _PRIVATE_DIRS):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    try:
+        stat_result = await run_in_threadpool(os.stat, path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=404, detail="Not found")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    sha256 = storage.blob_sha_from_url("/uploads/" + file_path)
+    if sha256 is not None:
+        etag = f'"{sha256}"'
+    else:
+        etag = await run_in_threadpool(_content_etag, path, stat_result)
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": REVALIDATE if _under(path, _MUTABLE_DIRS) else IMMUTABLE,
+        "Accept-Ranges": "bytes",
+    }
+
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(path, headers=headers, stat_result=stat_result)
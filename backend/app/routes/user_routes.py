@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from datetime import datetime
-from .. import db, models, auth, schemas
+from .. import db, models, auth, schemas, crud
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -26,12 +26,8 @@ def update_me(
     data = payload.dict(exclude_unset=True)
 
     # Vì birthday là string → không cần convert
-    for field, value in data.items():
-        setattr(current_user, field, value)
-
-    db_s.commit()
-    db_s.refresh(current_user)
-    return current_user
+    # Ghi qua crud để cache principal được xoá
+    return crud.update_user_profile(db_s, current_user.id, **data)
 
 
 # ---------------------------------------------------------
@@ -39,10 +35,10 @@ def update_me(
 # ---------------------------------------------------------
 @router.get("/all")
 def get_all_users(
-    current_user = Depends(auth.get_current_user),
+    current_user_id: int = Depends(auth.get_current_user_id),
     db_s: Session = Depends(db.get_db)
 ):
-    users = db_s.query(models.User).filter(models.User.id != current_user.id).all()
+    users = db_s.query(models.User).filter(models.User.id != current_user_id).all()
     return [
         {
             "id": u.id,
@@ -0,0 +1,193 @@
+# app/search.py
+"""
+Full-text search cho nội dung tin nhắn.
+
+- SQLite  : bảng FTS5 external-content `messages_fts` (rowid = messages.id),
+            đồng bộ trong crud.save_message / crud.delete_conversation.
+- Postgres: cột generated `messages.content_tsv` + GIN index, Postgres tự đồng bộ.
+- Dialect khác (hoặc SQLite build không có FTS5): fallback LIKE.
+
+Schema được tạo bởi migration 2 trong app/migrations.py.
+"""
+from sqlalchemy import DateTime, text
+from sqlalchemy.orm import Session
+
+SNIPPET_TOKENS = 12
+_fts5_available = {}
+
+
+# ============================================================
+# BACKEND DETECTION
+# ============================================================
+def _dialect(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+
+def _has_fts5(db: Session) -> bool:
+    bind = db.get_bind()
+    key = str(bind.url)
+    if key not in _fts5_available:
+        row = db.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        )).first()
+        _fts5_available[key] = row is not None
+    return _fts5_available[key]
+
+
+def backend(db: Session) -> str:
+    dialect = _dialect(db)
+    if dialect == "sqlite" and _has_fts5(db):
+        return "fts5"
+    if dialect == "postgresql":
+        return "tsvector"
+    return "like"
+
+
+# ============================================================
+# INDEX MAINTENANCE (chỉ SQLite cần làm tay)
+# ============================================================
+def index_message(db: Session, message_id: int, content: str):
+    """Gọi trong cùng transaction với INSERT messages."""
+    index_messages(db, [(message_id, content)])
+
+
+def index_messages(db: Session, rows):
+    """rows: [(message_id, content)] — 1 executemany cho cả batch."""
+    params = [{"id": mid, "content": content} for mid, content in rows if content]
+    if not params or backend(db) != "fts5":
+        return
+    db.execute(text("INSERT INTO messages_fts (rowid, content) VALUES (:id, :content)"), params)
+
+
+async def async_index_message(db, message_id: int, content: str):
+    """Bản async của index_message (db là AsyncSession)."""
+    await async_index_messages(db, [(message_id, content)])
+
+
+async def async_index_messages(db, rows):
+    params = [{"id": mid, "content": content} for mid, content in rows if content]
+    if not params or db.get_bind().dialect.name != "sqlite":
+        return
+    key = str(db.get_bind().url)
+    if key not in _fts5_available:
+        row = (await db.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ))).first()
+        _fts5_available[key] = row is not None
+    if not _fts5_available[key]:
+        return
+    await db.execute(text("INSERT INTO messages_fts (rowid, content) VALUES (:id, :content)"), params)
+
+
+def unindex_conversation(db: Session, conversation_id: int):
+    """Gọi trước khi xoá messages của hội thoại (external-content cần nội dung cũ)."""
+    if backend(db) != "fts5":
+        return
+    db.execute(
+        text(
+            "INSERT INTO messages_fts (messages_fts, rowid, content) "
+            "SELECT 'delete', id, content FROM messages "
+            "WHERE conversation_id = :cid AND content IS NOT NULL"
+        ),
+        {"cid": conversation_id}
+    )
+
+
+# ============================================================
+# QUERY
+# ============================================================
+def _fts5_query(q: str) -> str:
+    """
+    Biến input người dùng thành biểu thức FTS5 an toàn:
+    mỗi từ được quote (không dính cú pháp AND/OR/NEAR, dấu ngoặc...),
+    từ cuối match theo prefix để gõ dở vẫn ra kết quả.
+    """
+    terms = ['"%s"' % t.replace('"', '""') for t in q.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search_messages(db: Session, user_id: int, q: str, conversation_id: int = None,
+                    limit: int = 20, offset: int = 0):
+    """
+    Tìm tin nhắn trong các hội thoại mà user là thành viên
+    (hoặc chỉ 1 hội thoại nếu truyền conversation_id).
+    Kết quả xếp theo độ liên quan, kèm sender_name + snippet, 1 query duy nhất.
+    Trả về (rows, has_more).
+    """
+    # Chỉ có khoảng trắng → MATCH '' là lỗi cú pháp FTS5, không có gì để tìm
+    q = (q or "").strip()
+    if not q:
+        return [], False
+
+    params = {"uid": user_id, "limit": limit + 1, "offset": offset}
+    conv_filter = ""
+    if conversation_id is not None:
+        conv_filter = "AND m.conversation_id = :cid"
+        params["cid"] = conversation_id
+
+    kind = backend(db)
+    if kind == "fts5":
+        params["q"] = _fts5_query(q)
+        sql = f"""
+            SELECT m.id, m.conversation_id, m.sender_id, u.username AS sender_name,
+                   m.content, m.file_url, m.created_at,
+                   snippet(messages_fts, 0, '<mark>', '</mark>', '…', {SNIPPET_TOKENS}) AS snippet,
+                   bm25(messages_fts) AS rank
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            JOIN conversation_members cm
+              ON cm.conversation_id = m.conversation_id AND cm.user_id = :uid
+            LEFT JOIN users u ON u.id = m.sender_id
+            WHERE messages_fts MATCH :q {conv_filter}
+            ORDER BY rank, m.id DESC
+            LIMIT :limit OFFSET :offset
+        """
+    elif kind == "tsvector":
+        params["q"] = q
+        sql = f"""
+            SELECT m.id, m.conversation_id, m.sender_id, u.username AS sender_name,
+                   m.content, m.file_url, m.created_at,
+                   ts_headline('simple', m.content, query,
+                               'StartSel=<mark>, StopSel=</mark>, MaxWords={SNIPPET_TOKENS}, MinWords=3') AS snippet,
+                   ts_rank(m.content_tsv, query) AS rank
+            FROM messages m
+            CROSS JOIN websearch_to_tsquery('simple', :q) AS query
+            JOIN conversation_members cm
+              ON cm.conversation_id = m.conversation_id AND cm.user_id = :uid
+            LEFT JOIN users u ON u.id = m.sender_id
+            WHERE m.content_tsv @@ query {conv_filter}
+            ORDER BY rank DESC, m.id DESC
+            LIMIT :limit OFFSET :offset
+        """
+    else:
+        params["q"] = f"%{q}%"
+        sql = f"""
+            SELECT m.id, m.conversation_id, m.sender_id, u.username AS sender_name,
+                   m.content, m.file_url, m.created_at,
+                   m.content AS snippet, 0 AS rank
+            FROM messages m
+            JOIN conversation_members cm
+              ON cm.conversation_id = m.conversation_id AND cm.user_id = :uid
+            LEFT JOIN users u ON u.id = m.sender_id
+            WHERE LOWER(m.content) LIKE LOWER(:q) {conv_filter}
+            ORDER BY m.id DESC
+            LIMIT :limit OFFSET :offset
+        """
+
+    rows = db.execute(text(sql).columns(created_at=DateTime), params).mappings().all()
+    has_more = len(rows) > limit
+    return [
+        {
+            "id": r["id"],
+            "conversation_id": r["conversation_id"],
+            "sender_id": r["sender_id"],
+            "sender_name": r["sender_name"] or "Unknown",
+            "content": r["content"],
+            "file_url": r["file_url"],
+            "created_at": r["created_at"],
+            "snippet": r["snippet"],
+        }
+        for r in rows[:limit]
+    ], has_more
@@ -0,0 +1,295 @@
+# app/storage.py
+"""
+Pipeline upload dùng chung cho /files/upload và /settings/avatar.
+
+- Đọc UploadFile theo từng chunk, ghi xuống đĩa trong threadpool
+  → event loop (và mọi WebSocket) không bị chặn khi ghi file lớn.
+- Vượt giới hạn kích thước → dừng ngay, xoá file tạm, trả 413.
+- Tính SHA-256 trong lúc ghi, không phải đọc lại file.
+- Ghi vào file tạm ".part" rồi os.replace → không bao giờ phục vụ file ghi dở.
+
+Blob store (content-addressed): file được lưu 1 lần theo SHA-256 tại
+    uploads/blobs/ab/cd/<sha256><ext>
+bảng blobs đếm số messages / media / avatar trỏ tới; blob không ai dùng
+quá BLOB_GC_GRACE giây sẽ bị BlobGarbageCollector xoá.
+"""
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = "uploads"
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+BLOB_TMP_DIR = os.path.join(UPLOAD_DIR, "tmp")
+# Dọn blob không còn tham chiếu: chạy mỗi BLOB_GC_INTERVAL giây,
+# chỉ xoá blob đã không ai dùng ít nhất BLOB_GC_GRACE giây kể từ lần upload cuối
+BLOB_GC_ENABLED = os.getenv("BLOB_GC_ENABLED", "1") == "1"
+BLOB_GC_INTERVAL = float(os.getenv("BLOB_GC_INTERVAL", "600"))
+BLOB_GC_GRACE = float(os.getenv("BLOB_GC_GRACE", "3600"))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(64 * 1024 * 1024)))  # 64MB
+
+
+class StoredFile(NamedTuple):
+    path: str       # đường dẫn trên đĩa
+    size: int
+    sha256: str
+
+
+def safe_filename(filename: str) -> str:
+    """Bỏ phần thư mục ("../", "C:\\...") khỏi tên file client gửi lên."""
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    return name or "file"
+
+
+def _too_large(max_size: int):
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large (max {max_size} bytes)"
+    )
+
+
+async def save_upload(file: UploadFile, directory: str, filename: str,
+                      max_size: int = MAX_UPLOAD_SIZE) -> StoredFile:
+    # Client đã khai báo kích thước → từ chối trước khi ghi byte nào
+    if file.size is not None and file.size > max_size:
+        raise _too_large(max_size)
+
+    await run_in_threadpool(os.makedirs, directory, exist_ok=True)
+    final_path = os.path.join(directory, filename)
+    tmp_path = f"{final_path}.{uuid.uuid4().hex}.part"
+
+    digest = hashlib.sha256()
+    size = 0
+    out = await run_in_threadpool(open, tmp_path, "wb")
+
+    def write_chunk(chunk: bytes):
+        # hashlib nhả GIL với chunk lớn → hash + ghi cùng 1 lượt trong thread
+        digest.update(chunk)
+        out.write(chunk)
+
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise _too_large(max_size)
+            await run_in_threadpool(write_chunk, chunk)
+
+        await run_in_threadpool(out.close)
+        await run_in_threadpool(os.replace, tmp_path, final_path)
+    except BaseException:
+        out.close()
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return StoredFile(path=final_path, size=size, sha256=digest.hexdigest())
+
+
+# ============================================================
+# BLOB STORE
+# ============================================================
+_BLOB_URL_RE = re.compile(r"^/uploads/blobs/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[a-z0-9]+)?$")
+_EXT_RE = re.compile(r"^\.[a-z0-9]{1,10}$")
+
+
+class StoredBlob(NamedTuple):
+    url: str
+    sha256: str
+    size: int
+
+
+def blob_ext(filename: str) -> str:
+    """Giữ đuôi file để StaticFiles trả đúng Content-Type."""
+    ext = os.path.splitext(safe_filename(filename))[1].lower()
+    return ext if _EXT_RE.match(ext) else ""
+
+
+def blob_relpath(sha256: str, ext: str = "") -> str:
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def blob_url(sha256: str, ext: str = "") -> str:
+    return f"/uploads/blobs/{blob_relpath(sha256, ext)}"
+
+
+def blob_path(sha256: str, ext: str = "") -> str:
+    return os.path.join(BLOB_DIR, blob_relpath(sha256, ext))
+
+
+def blob_sha_from_url(url: Optional[str]) -> Optional[str]:
+    """SHA-256 nếu url là blob, None với URL kiểu cũ (uploads/<uuid>_name)."""
+    match = _BLOB_URL_RE.match(url or "")
+    return match.group(1) if match else None
+
+
+# Loại media cho thư viện ảnh / file của hội thoại
+MEDIA_KINDS = ("image", "video", "audio", "file")
+_FILE_MESSAGE_RE = re.compile(r"^\[File: (.+)\]$")
+
+
+def media_kind(url: str):
+    """(kind, mime) đoán từ đuôi file của url."""
+    mime, _ = mimetypes.guess_type(url or "")
+    major = (mime or "").split("/")[0]
+    kind = major if major in ("image", "video", "audio") else "file"
+    return kind, mime or "application/octet-stream"
+
+
+def media_filename(content: Optional[str], url: str) -> str:
+    """Tên hiển thị: client gửi kèm "[File: name]", URL blob không còn tên gốc."""
+    match = _FILE_MESSAGE_RE.match((content or "").strip())
+    if match:
+        return match.group(1)
+    return (url or "").rsplit("/", 1)[-1]
+
+
+def _place_blob(tmp_path: str, final_path: str):
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    # Nội dung giống hệt nên ghi đè file đã có cũng an toàn (os.replace là atomic)
+    os.replace(tmp_path, final_path)
+
+
+async def store_blob(file: UploadFile, db_s, max_size: int = MAX_UPLOAD_SIZE) -> StoredBlob:
+    """
+    Lưu upload vào blob store: stream ra file tạm, hash, ghi nhận vào bảng blobs,
+    rồi chuyển vào đường dẫn theo SHA-256. Trùng nội dung → dùng lại blob cũ.
+    ref_count chỉ tăng khi message / media / avatar thực sự trỏ tới URL.
+    """
+    from . import crud
+
+    stored = await save_upload(file, BLOB_TMP_DIR, f"{uuid.uuid4().hex}.upload", max_size)
+    try:
+        # Ghi DB trước rồi mới đặt file: GC thấy uploaded_at mới sẽ không xoá
+        blob = await run_in_threadpool(
+            crud.register_blob, db_s, stored.sha256, stored.size, blob_ext(file.filename)
+        )
+        await run_in_threadpool(_place_blob, stored.path, blob_path(blob.sha256, blob.ext))
+    except BaseException:
+        if os.path.exists(stored.path):
+            os.remove(stored.path)
+        raise
+
+    return StoredBlob(url=blob_url(blob.sha256, blob.ext), sha256=blob.sha256, size=stored.size)
+
+
+# ============================================================
+# GARBAGE COLLECTOR
+# ============================================================
+class BlobGarbageCollector:
+    def __init__(self, interval: float = BLOB_GC_INTERVAL, grace: float = BLOB_GC_GRACE):
+        self.interval = interval
+        self.grace = grace
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.removed = 0
+        self.restored = 0
+        self.freed_bytes = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await run_in_threadpool(self.collect)
+            except Exception as e:
+                logger.warning("Blob GC failed: %s", e)
+
+    def collect(self):
+        """1 lượt dọn (sync, chạy trong threadpool). Trả về số blob đã xoá."""
+        from . import crud, db, thumbnails
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.grace)
+        removed = 0
+        db_s = db.SessionLocal()
+        try:
+            while True:
+                blobs = crud.get_unreferenced_blobs(db_s, cutoff)
+                if not blobs:
+                    break
+                for blob in blobs:
+                    sha256, ext, size = blob.sha256, blob.ext, blob.size
+                    if not crud.delete_blob_if_unreferenced(db_s, blob.id, cutoff):
+                        continue
+                    if not self._unlink(db_s, sha256, ext):
+                        self.restored += 1
+                        continue
+                    thumbnails.remove_derivatives(sha256)
+                    removed += 1
+                    self.freed_bytes += size
+                db_s.expire_all()
+        finally:
+            db_s.close()
+
+        self.runs += 1
+        self.removed += removed
+        return removed
+
+    @staticmethod
+    def _unlink(db_s, sha256: str, ext: str) -> bool:
+        """
+        Xoá file sau khi đã xoá dòng blob. store_blob cùng nội dung có thể đã
+        register lại giữa 2 bước (process khác cũng vậy) → đổi tên file sang
+        tên tạm trước, đọc lại dòng: có dòng thì trả file về, không thì mới xoá.
+        False nếu blob đã được upload lại.
+        """
+        from . import crud
+
+        path = blob_path(sha256, ext)
+        claimed = f"{path}.gc-{uuid.uuid4().hex}"
+        try:
+            os.replace(path, claimed)
+        except FileNotFoundError:
+            claimed = None
+
+        db_s.expire_all()
+        if crud.get_blob(db_s, sha256) is not None:
+            # Cùng nội dung: ghi đè file uploader vừa đặt (nếu có) cũng an toàn
+            if claimed:
+                os.replace(claimed, path)
+            return False
+
+        if claimed:
+            os.remove(claimed)
+        return True
+
+    def stats(self):
+        return {
+            "running": self._task is not None,
+            "runs": self.runs,
+            "removed": self.removed,
+            "restored": self.restored,
+            "freed_bytes": self.freed_bytes,
+        }
+
+
+# Singleton
+blob_gc = BlobGarbageCollector()
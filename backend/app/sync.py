@@ -0,0 +1,281 @@
+# app/sync.py
+"""
+Delta sync cho client kết nối lại: GET /sync?since=<cursor>.
+
+Mọi thay đổi người dùng nhìn thấy được ghi 1 dòng vào bảng changes (cùng
+transaction với thay đổi đó, trong crud). changes.id là số thứ tự toàn cục;
+cursor = id cuối client đã nhận + thời điểm cấp cursor.
+
+Dòng log chỉ là con trỏ (kind + id), /sync gom theo trang rồi đọc trạng thái
+hiện tại: 50 reaction trên cùng 1 tin → 1 danh sách reaction, đọc 20 lần → 1 watermark.
+
+Log cũ hơn CHANGE_LOG_RETENTION giây bị ChangeLogPruner xoá; cursor cấp trước mốc đó
+→ {"reset": true}, client tải lại từ đầu.
+
+Postgres cấp id lúc INSERT nhưng các transaction commit không theo thứ tự id: đọc thấy
+id 11 khi id 10 chưa commit thì cursor đã vượt qua 10. Cursor vì vậy mang theo các id
+còn thiếu gần đầu log ("gaps"), /sync đọc lại chúng tới khi thấy hoặc quá SYNC_GAP_WINDOW giây.
+SQLite ghi tuần tự nên không cần.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, delete, func, insert, literal, or_, select
+from sqlalchemy.orm import Session, selectinload
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+CHANGE_LOG_RETENTION = float(os.getenv("CHANGE_LOG_RETENTION", str(7 * 24 * 3600)))
+CHANGE_LOG_PRUNE_INTERVAL = float(os.getenv("CHANGE_LOG_PRUNE_INTERVAL", "3600"))
+# Id thiếu được đọc lại trong SYNC_GAP_WINDOW giây (transaction chậm / rollback),
+# chỉ xét SYNC_GAP_SCAN id cuối của mỗi trang, giữ tối đa SYNC_GAP_MAX id trong cursor
+SYNC_GAP_WINDOW = float(os.getenv("SYNC_GAP_WINDOW", "60"))
+SYNC_GAP_SCAN = int(os.getenv("SYNC_GAP_SCAN", "1000"))
+SYNC_GAP_MAX = int(os.getenv("SYNC_GAP_MAX", "100"))
+
+MESSAGE = "message"
+REACTION = "reaction"
+READ = "read"
+MEMBER_ADDED = "member_added"
+MEMBER_REMOVED = "member_removed"
+THEME = "theme"
+NICKNAME = "nickname"
+
+
+# ============================================================
+# GHI LOG (gọi từ crud, chưa commit)
+# ============================================================
+def change(conversation_id: int, kind: str, entity_id: int = None, user_id: int = None) -> dict:
+    return {"conversation_id": conversation_id, "kind": kind, "entity_id": entity_id, "user_id": user_id}
+
+
+def log(db: Session, rows):
+    """rows: [change(...)] — 1 executemany."""
+    if rows:
+        db.execute(insert(models.Change), rows)
+
+
+async def async_log(db, rows):
+    if rows:
+        await db.execute(insert(models.Change), rows)
+
+
+def reaction_change_stmt(message_id: int, user_id: int):
+    """Reaction chỉ biết message_id → lấy conversation_id ngay trong câu INSERT."""
+    return insert(models.Change).from_select(
+        ["conversation_id", "kind", "entity_id", "user_id"],
+        select(
+            models.Message.conversation_id, literal(REACTION), literal(message_id), literal(user_id)
+        ).where(models.Message.id == message_id)
+    )
+
+
+# ============================================================
+# CURSOR
+# ============================================================
+def make_cursor(seq: int, at: Optional[int] = None, gaps=None) -> dict:
+    """at: giữ mốc cũ khi seq không tiến, để cursor_expired vẫn tính từ lần nhận log cuối."""
+    cursor = {"seq": seq, "at": int(time.time()) if at is None else at}
+    if gaps:
+        cursor["gaps"] = gaps
+    return cursor
+
+
+def cursor_expired(cursor: dict) -> bool:
+    """Cursor cấp trước mốc prune → có thể đã mất log, client phải tải lại."""
+    return time.time() - cursor["at"] >= CHANGE_LOG_RETENTION
+
+
+def latest_seq(db: Session) -> int:
+    return db.query(func.max(models.Change.id)).scalar() or 0
+
+
+def tracks_gaps(db: Session) -> bool:
+    return db.bind.dialect.name == "postgresql"
+
+
+def next_gaps(db: Session, since: int, seq: int, gaps=()) -> list:
+    """
+    [[id, lúc phát hiện]] chưa commit (hoặc đã rollback) trong khoảng (since, seq],
+    cộng các gap cũ vẫn chưa thấy và chưa quá SYNC_GAP_WINDOW. 1 query.
+    """
+    change_ = models.Change
+    now = int(time.time())
+    known = {gid: at for gid, at in gaps if now - at < SYNC_GAP_WINDOW}
+    low = max(since, seq - SYNC_GAP_SCAN)
+    if not known and low >= seq:
+        return []
+
+    present = set(db.scalars(
+        select(change_.id).where(or_(
+            change_.id.in_(list(known)),
+            and_(change_.id > low, change_.id <= seq)
+        ))
+    ))
+    for gid in range(low + 1, seq + 1):
+        if gid not in present:
+            known.setdefault(gid, now)
+    missing = sorted([gid, at] for gid, at in known.items() if gid not in present)
+    return missing[-SYNC_GAP_MAX:]
+
+
+# ============================================================
+# ĐỌC DELTA
+# ============================================================
+def get_changes(db: Session, user_id: int, since: int, limit: int, gaps=()):
+    """
+    Log sau since mà user thấy được: mọi thay đổi trong hội thoại user đang là thành viên,
+    cộng việc chính user bị xoá khỏi hội thoại. Các id trong gaps (≤ since) đã commit
+    được trả kèm, không tính vào limit. Trả về (changes tăng dần, has_more).
+    """
+    member = models.ConversationMember
+    change_ = models.Change
+    visible = or_(
+        change_.conversation_id.in_(select(member.conversation_id).where(member.user_id == user_id)),
+        and_(change_.kind == MEMBER_REMOVED, change_.user_id == user_id)
+    )
+    rows = (
+        db.query(change_)
+        .filter(change_.id > since, visible)
+        .order_by(change_.id)
+        .limit(limit + 1)
+        .all()
+    )
+    late = []
+    if gaps:
+        late = db.query(change_).filter(change_.id.in_(list(gaps)), visible).order_by(change_.id).all()
+    return late + rows[:limit], len(rows) > limit
+
+
+def build_delta(db: Session, user_id: int, changes) -> dict:
+    """Gom 1 trang log thành trạng thái hiện tại, số query cố định."""
+    from . import crud
+
+    message_ids, reaction_ids, conversation_ids, removed = set(), set(), set(), set()
+    reads = {}
+    for ch in changes:
+        if ch.kind == MESSAGE:
+            message_ids.add(ch.entity_id)
+        elif ch.kind == REACTION:
+            reaction_ids.add(ch.entity_id)
+        elif ch.kind == READ:
+            key = (ch.conversation_id, ch.user_id)
+            reads[key] = max(reads.get(key, 0), ch.entity_id)
+        elif ch.kind == MEMBER_REMOVED and ch.user_id == user_id:
+            removed.add(ch.conversation_id)
+        else:
+            if ch.kind == MEMBER_ADDED and ch.user_id == user_id:
+                removed.discard(ch.conversation_id)
+            conversation_ids.add(ch.conversation_id)
+
+    messages = []
+    if message_ids:
+        rows = (
+            db.query(models.Message)
+            .filter(models.Message.id.in_(message_ids))
+            .order_by(models.Message.id)
+            .all()
+        )
+        messages = crud.hydrate_messages(db, rows)
+
+    # Tin mới đã kèm reaction đầy đủ
+    reaction_ids -= message_ids
+    reactions = crud.get_reactions_map(db, list(reaction_ids)) if reaction_ids else {}
+
+    conversations = []
+    if conversation_ids - removed:
+        rows = (
+            db.query(models.Conversation)
+            .filter(models.Conversation.id.in_(conversation_ids - removed))
+            .options(selectinload(models.Conversation.members).selectinload(models.ConversationMember.user))
+            .all()
+        )
+        conversations = [crud.conversation_state(c) for c in rows]
+
+    return {
+        "messages": messages,
+        "reactions": [{"message_id": mid, "reactions": reactions[mid]} for mid in sorted(reaction_ids)],
+        "reads": [
+            {"conversation_id": cid, "user_id": uid, "last_read_message_id": watermark}
+            for (cid, uid), watermark in reads.items()
+        ],
+        "conversations": conversations,
+        "removed_conversation_ids": sorted(removed),
+    }
+
+
+# ============================================================
+# PRUNE
+# ============================================================
+def prune(db: Session, cutoff: datetime, batch: int = 5000) -> int:
+    removed = 0
+    while True:
+        ids = select(models.Change.id).where(models.Change.created_at < cutoff).limit(batch)
+        n = db.execute(delete(models.Change).where(models.Change.id.in_(ids))).rowcount
+        db.commit()
+        removed += n
+        if n < batch:
+            return removed
+
+
+class ChangeLogPruner:
+    def __init__(self, interval: float = CHANGE_LOG_PRUNE_INTERVAL, retention: float = CHANGE_LOG_RETENTION):
+        self.interval = interval
+        self.retention = retention
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.removed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await run_in_threadpool(self.collect)
+            except Exception as e:
+                logger.warning("Change log prune failed: %s", e)
+
+    def collect(self):
+        from . import db
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        db_s = db.SessionLocal()
+        try:
+            removed = prune(db_s, cutoff)
+        finally:
+            db_s.close()
+        self.runs += 1
+        self.removed += removed
+        return removed
+
+    def stats(self):
+        return {
+            "running": self._task is not None,
+            "retention": self.retention,
+            "runs": self.runs,
+            "removed": self.removed,
+        }
+
+
+# Singleton
+pruner = ChangeLogPruner()
@@ -0,0 +1,275 @@
+# app/thumbnails.py
+"""
+Ảnh thu nhỏ cho ảnh upload (blob store, xem app/storage.py).
+
+Mỗi blob ảnh có 2 bản phái sinh, lưu theo SHA-256 của ảnh gốc:
+    uploads/derived/ab/cd/<sha256>_thumb.jpg     cạnh dài tối đa THUMB_SIZE
+    uploads/derived/ab/cd/<sha256>_preview.jpg   cạnh dài tối đa PREVIEW_SIZE
+cùng width / height / blurhash của ảnh gốc (lưu trên blobs + media).
+
+- Sinh trong process pool riêng (THUMBNAIL_POOL_SIZE), chạy sau khi
+  /files/upload đã trả response (BackgroundTasks).
+- Thiếu file phái sinh (xoá tay, chuyển máy...) → /files/derivatives/... sinh lại lúc được gọi.
+- Pillow là tuỳ chọn: không có Pillow thì bỏ qua, client dùng ảnh gốc.
+"""
+import asyncio
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from . import storage
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow không bắt buộc
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+DERIVED_DIR = os.path.join(storage.UPLOAD_DIR, "derived")
+THUMB_SIZE = int(os.getenv("THUMB_SIZE", "320"))
+PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE", "1280"))
+THUMBNAIL_POOL_SIZE = int(os.getenv("THUMBNAIL_POOL_SIZE", "2"))
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp"}
+KINDS = {"thumb": (THUMB_SIZE, 75), "preview": (PREVIEW_SIZE, 82)}
+
+
+def available():
+    return Image is not None
+
+
+def is_image_ext(ext: str):
+    return (ext or "").lower() in IMAGE_EXTS
+
+
+def derivative_path(sha256: str, kind: str) -> str:
+    return os.path.join(DERIVED_DIR, sha256[:2], sha256[2:4], f"{sha256}_{kind}.jpg")
+
+
+def derivative_urls(file_url: Optional[str]) -> dict:
+    """thumb_url / preview_url cho file_url là ảnh trong blob store, {} nếu không phải."""
+    sha256 = storage.blob_sha_from_url(file_url)
+    if sha256 is None or not is_image_ext(os.path.splitext(file_url)[1]):
+        return {}
+    return {
+        "thumb_url": f"/files/derivatives/{sha256}/thumb",
+        "preview_url": f"/files/derivatives/{sha256}/preview",
+    }
+
+
+# ============================================================
+# BLURHASH (https://blurha.sh) — mã hoá trên ảnh đã thu về ~32px
+# ============================================================
+_B83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def _b83(value: int, length: int) -> str:
+    return "".join(_B83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _srgb_to_linear(v: int) -> float:
+    v = v / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(v: float) -> int:
+    v = max(0.0, min(1.0, v))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(v: float, exp: float) -> float:
+    return math.copysign(abs(v) ** exp, v)
+
+
+def blurhash(img, components_x: int = 4, components_y: int = 3) -> str:
+    small = img.convert("RGB")
+    small.thumbnail((32, 32))
+    w, h = small.size
+    pixels = [tuple(_srgb_to_linear(c) for c in px) for px in small.getdata()]
+
+    factors = []
+    for j in range(components_y):
+        cos_y = [math.cos(math.pi * j * y / h) for y in range(h)]
+        for i in range(components_x):
+            cos_x = [math.cos(math.pi * i * x / w) for x in range(w)]
+            norm = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(h):
+                for x in range(w):
+                    basis = cos_x[x] * cos_y[y]
+                    pr, pg, pb = pixels[y * w + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = norm / (w * h)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _b83((components_x - 1) + (components_y - 1) * 9, 1)
+
+    if ac:
+        actual_max = max(abs(v) for f in ac for v in f)
+        quantised_max = max(0, min(82, int(actual_max * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+    else:
+        quantised_max, max_value = 0, 1
+    result += _b83(quantised_max, 1)
+
+    result += _b83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+
+    for f in ac:
+        q = [max(0, min(18, int(_sign_pow(v / max_value, 0.5) * 9 + 9.5))) for v in f]
+        result += _b83(q[0] * 19 * 19 + q[1] * 19 + q[2], 2)
+    return result
+
+
+# ============================================================
+# WORKER (chạy trong process con)
+# ============================================================
+def _flatten(img):
+    """JPEG không có alpha → nền trắng cho PNG / GIF trong suốt."""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def _generate(src_path: str, sha256: str, kinds=tuple(KINDS)):
+    with Image.open(src_path) as img:
+        img.seek(0)  # GIF động → khung đầu
+        img = ImageOps.exif_transpose(img)
+        width, height = img.size
+        rgb = _flatten(img)
+
+        for kind in kinds:
+            max_side, quality = KINDS[kind]
+            out = rgb.copy()
+            out.thumbnail((max_side, max_side))
+            path = derivative_path(sha256, kind)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.part"
+            out.save(tmp, "JPEG", quality=quality, optimize=True, progressive=True)
+            os.replace(tmp, path)
+
+        return {"width": width, "height": height, "blurhash": blurhash(rgb)}
+
+
+# ============================================================
+# POOL + API async
+# ============================================================
+class ThumbnailGenerator:
+    def __init__(self, size: int = THUMBNAIL_POOL_SIZE):
+        self.size = size
+        self._executor = None
+        # sha256 → future đang chạy, tránh 2 request cùng sinh 1 ảnh
+        self._inflight = {}
+        self.generated = 0
+        self.failed = 0
+        self.restarts = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.size)
+        return self._executor
+
+    async def ensure(self, sha256: str, ext: str):
+        """Sinh (lại) thumb + preview; trả về metadata hoặc None nếu không sinh được."""
+        if not available() or not is_image_ext(ext):
+            return None
+
+        task = self._inflight.get(sha256)
+        if task is None:
+            task = asyncio.ensure_future(self._run(sha256, ext))
+            self._inflight[sha256] = task
+            task.add_done_callback(lambda _: self._inflight.pop(sha256, None))
+        # shield: client huỷ request không làm huỷ việc sinh ảnh của người khác
+        return await asyncio.shield(task)
+
+    async def _run(self, sha256: str, ext: str):
+        loop = asyncio.get_running_loop()
+        try:
+            for attempt in (1, 2):
+                executor = self._get_executor()
+                try:
+                    meta = await loop.run_in_executor(
+                        executor, _generate, storage.blob_path(sha256, ext), sha256
+                    )
+                    break
+                except BrokenProcessPool:
+                    # Worker chết (OOM, bị kill...) → tạo pool mới, thử lại 1 lần (như auth.PasswordPool)
+                    if self._executor is executor:
+                        self._executor = None
+                        self.restarts += 1
+                    if attempt == 2:
+                        raise
+        except Exception as e:
+            self.failed += 1
+            logger.warning("Thumbnail generation failed for %s: %s", sha256, e)
+            return None
+        self.generated += 1
+        return meta
+
+    async def process_upload(self, sha256: str, ext: str):
+        """BackgroundTask sau /files/upload: sinh ảnh phái sinh rồi lưu metadata."""
+        from . import crud, db
+
+        def has_meta():
+            db_s = db.SessionLocal()
+            try:
+                return crud.get_image_meta_map(db_s, [storage.blob_url(sha256, ext)]) != {}
+            finally:
+                db_s.close()
+
+        # Ảnh trùng nội dung đã xử lý trước đó → khỏi sinh lại
+        if not available() or await run_in_threadpool(has_meta):
+            return
+
+        meta = await self.ensure(sha256, ext)
+        if meta is None:
+            return
+
+        def save():
+            db_s = db.SessionLocal()
+            try:
+                crud.set_image_meta(db_s, sha256, **meta)
+            finally:
+                db_s.close()
+
+        await run_in_threadpool(save)
+
+    def shutdown(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "available": available(),
+            "generated": self.generated,
+            "failed": self.failed,
+            "restarts": self.restarts,
+            "inflight": len(self._inflight),
+        }
+
+
+def remove_derivatives(sha256: str):
+    """Gọi bởi GC khi xoá blob."""
+    for kind in KINDS:
+        try:
+            os.remove(derivative_path(sha256, kind))
+        except FileNotFoundError:
+            pass
+
+
+# Singleton
+generator = ThumbnailGenerator()
@@ -1,8 +1,311 @@
 # app/websocket_manager.py
 
 import asyncio
+import json
+import os
+import uuid
+from collections import OrderedDict, deque
 from fastapi import WebSocket
-from typing import Dict, Optional
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from .pubsub import NODE_ID, PubSubBackend, create_backend
+
+try:
+    import orjson
+except ImportError:  # orjson không bắt buộc, chỉ nhanh hơn
+    orjson = None
+
+# Số event tối đa chờ gửi cho 1 socket
+WS_QUEUE_MAX = int(os.getenv("WS_QUEUE_MAX", "256"))
+# Thời gian tối đa cho 1 lần send; quá hạn → coi là client chậm
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+# Close code cho client bị loại vì đọc quá chậm (1013 = Try Again Later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Event có thể bỏ khi hàng đợi đầy
+DROPPABLE_TYPES = {"typing", "typing_digest"}
+
+# Typing: tự dừng sau TTL giây không nhận frame typing mới
+TYPING_TTL = float(os.getenv("TYPING_TTL", "6"))
+# Typing: chờ bấy nhiêu giây mới báo "đang nhập" (gõ 1 phím rồi gửi ngay → không báo)
+TYPING_START_DELAY = float(os.getenv("TYPING_START_DELAY", "0.3"))
+# Phòng có từ bấy nhiêu người online trở lên → gửi digest định kỳ thay vì event từng người
+TYPING_DIGEST_THRESHOLD = int(os.getenv("TYPING_DIGEST_THRESHOLD", "50"))
+TYPING_DIGEST_INTERVAL = float(os.getenv("TYPING_DIGEST_INTERVAL", "1"))
+
+# Resume: mỗi phòng giữ WS_REPLAY_BUFFER event gần nhất để phát lại khi client kết nối lại
+WS_REPLAY_BUFFER = int(os.getenv("WS_REPLAY_BUFFER", "256"))
+# Số phòng tối đa giữ lịch sử (phòng còn socket local không bao giờ bị bỏ)
+WS_REPLAY_ROOMS = int(os.getenv("WS_REPLAY_ROOMS", "10000"))
+# Event không đánh số / không phát lại: chỉ có ý nghĩa ở thời điểm gửi
+EPHEMERAL_TYPES = DROPPABLE_TYPES | {"presence"}
+
+
+# ============================================================
+# ENCODE — mỗi event chỉ encode 1 lần cho cả phòng
+# ============================================================
+def encode_frame(message: dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(message, default=str).decode()
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+class Frame:
+    """Event đã encode sẵn, gửi nguyên văn cho mọi socket."""
+    __slots__ = ("type", "text")
+
+    def __init__(self, message: dict):
+        self.type = message.get("type")
+        self.text = encode_frame(message)
+
+
+# ============================================================
+# ROOM HISTORY — số thứ tự event + ring buffer để resume
+# ============================================================
+class RoomHistory:
+    """
+    seq tăng dần theo từng phòng, do node này đánh khi fan-out (kể cả event từ node khác).
+    epoch đổi khi lịch sử được tạo lại (restart, bị bỏ khỏi LRU) → seq cũ vô nghĩa.
+    """
+    __slots__ = ("epoch", "seq", "events")
+
+    def __init__(self, size: int = WS_REPLAY_BUFFER):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.events = deque(maxlen=size)
+
+    def append(self, message: dict) -> dict:
+        self.seq += 1
+        message = {**message, "seq": self.seq}
+        self.events.append(message)
+        return message
+
+    def since(self, last_seq: int):
+        """Các event sau last_seq, None nếu khoảng hở đã trôi khỏi buffer."""
+        if last_seq > self.seq:
+            return None
+        oldest = self.events[0]["seq"] if self.events else self.seq + 1
+        if last_seq < oldest - 1:
+            return None
+        return [m for m in self.events if m["seq"] > last_seq]
+
+
+# ============================================================
+# OUTBOUND QUEUE — mỗi socket 1 hàng đợi + 1 writer task
+# ============================================================
+class OutboundQueue:
+    """
+    Broadcast chỉ đẩy event vào hàng đợi rồi đi tiếp, writer task của từng
+    socket tự gửi. Client chậm chỉ làm đầy hàng đợi của chính nó:
+    - đầy → bỏ event typing trước, không còn gì để bỏ → đóng socket
+    - 1 lần send quá WS_SEND_TIMEOUT → đóng socket
+    """
+
+    def __init__(self, websocket: WebSocket, maxsize: int = None, send_timeout: float = None):
+        self.websocket = websocket
+        self.maxsize = maxsize or WS_QUEUE_MAX
+        self.send_timeout = send_timeout or WS_SEND_TIMEOUT
+        self.items = deque()
+        self.closed = False
+        self.dropped = 0
+        self.evicted = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, frame: Frame):
+        if self.closed:
+            return
+
+        if len(self.items) >= self.maxsize:
+            if frame.type in DROPPABLE_TYPES:
+                self.dropped += 1
+                return
+            victim = next((f for f in self.items if f.type in DROPPABLE_TYPES), None)
+            if victim is None:
+                self.evict()
+                return
+            self.items.remove(victim)
+            self.dropped += 1
+
+        self.items.append(frame)
+        self._wakeup.set()
+
+    async def _run(self):
+        while not self.closed:
+            if not self.items:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            frame = self.items.popleft()
+            try:
+                await self._send(frame.text)
+            except asyncio.TimeoutError:
+                self.evict()
+            except Exception:
+                # socket chết → dừng gửi, endpoint sẽ tự dọn
+                self.closed = True
+
+    async def _send(self, text: str):
+        if hasattr(asyncio, "timeout"):
+            # Python 3.11+: không phải tạo thêm task cho mỗi lần gửi như wait_for
+            async with asyncio.timeout(self.send_timeout):
+                await self.websocket.send_text(text)
+        else:
+            await asyncio.wait_for(self.websocket.send_text(text), self.send_timeout)
+
+    def evict(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.evicted = True
+        self.items.clear()
+        asyncio.get_running_loop().create_task(self._close())
+
+    async def _close(self):
+        try:
+            await asyncio.wait_for(
+                self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE), self.send_timeout
+            )
+        except Exception:
+            pass
+
+    def stop(self):
+        self.closed = True
+        self.items.clear()
+        self._wakeup.set()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+
+
+# ============================================================
+# TYPING — chỉ phát khi trạng thái đổi
+# ============================================================
+class TypingTracker:
+    """
+    Giữ trạng thái typing theo (phòng, user) thay vì chuyển tiếp mọi frame:
+    - start được debounce TYPING_START_DELAY giây, frame lặp lại chỉ gia hạn TTL
+    - stop phát khi client gửi status=false, rời phòng, hoặc hết TTL
+    - phòng lớn: không phát từng người, gửi "typing_digest" mỗi
+      TYPING_DIGEST_INTERVAL giây khi danh sách người đang nhập thay đổi
+    Trạng thái chỉ tính trên node nhận frame typing.
+    """
+
+    def __init__(self, manager: "ConversationManager"):
+        self.manager = manager
+        # room -> user -> {"expires", "announced", "pending"}
+        self.rooms: Dict[int, Dict[int, dict]] = {}
+        # room -> danh sách user trong digest gần nhất
+        self.digests: Dict[int, list] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _is_large(self, conversation_id: int):
+        return len(self.manager.get_online_users(conversation_id)) >= TYPING_DIGEST_THRESHOLD
+
+    async def update(self, conversation_id: int, user_id: int, status: bool):
+        if not status:
+            await self.forget(conversation_id, user_id)
+            return
+
+        loop = asyncio.get_running_loop()
+        room = self.rooms.setdefault(conversation_id, {})
+        state = room.get(user_id)
+        if state is not None:
+            state["expires"] = loop.time() + TYPING_TTL
+            return
+
+        state = room[user_id] = {
+            "expires": loop.time() + TYPING_TTL,
+            "announced": False,
+            "pending": None,
+        }
+        if not self._is_large(conversation_id):
+            state["pending"] = loop.call_later(
+                TYPING_START_DELAY, self._announce_start, conversation_id, user_id
+            )
+        self._ensure_sweeper()
+
+    def _announce_start(self, conversation_id: int, user_id: int):
+        state = self.rooms.get(conversation_id, {}).get(user_id)
+        if state is None:
+            return
+        state["pending"] = None
+        state["announced"] = True
+        asyncio.get_running_loop().create_task(self._emit(conversation_id, user_id, True))
+
+    async def forget(self, conversation_id: int, user_id: int):
+        """User dừng gõ / rời phòng → phát stop nếu đã từng phát start."""
+        room = self.rooms.get(conversation_id)
+        if room is None:
+            return
+        state = room.pop(user_id, None)
+        if not room:
+            del self.rooms[conversation_id]
+        if state is None:
+            return
+        if state["pending"] is not None:
+            state["pending"].cancel()
+        if state["announced"]:
+            await self._emit(conversation_id, user_id, False)
+
+    async def _emit(self, conversation_id: int, user_id: int, status: bool):
+        await self.manager.broadcast_safe(
+            conversation_id,
+            {
+                "type": "typing",
+                "user_id": user_id,
+                "status": status
+            },
+            exclude_user=user_id
+        )
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for room in self.rooms.values():
+            for state in room.values():
+                if state["pending"] is not None:
+                    state["pending"].cancel()
+        self.rooms.clear()
+        self.digests.clear()
+
+    def _ensure_sweeper(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._sweep())
+
+    async def _sweep(self):
+        while self.rooms or self.digests:
+            await asyncio.sleep(TYPING_DIGEST_INTERVAL)
+            now = asyncio.get_running_loop().time()
+
+            for conversation_id, room in list(self.rooms.items()):
+                for user_id, state in list(room.items()):
+                    if state["expires"] <= now:
+                        await self.forget(conversation_id, user_id)
+
+            await self._send_digests()
+
+    async def _send_digests(self):
+        for conversation_id in set(self.rooms) | set(self.digests):
+            if conversation_id not in self.digests and not self._is_large(conversation_id):
+                continue
+
+            typers = sorted(self.rooms.get(conversation_id, {}))
+            if self.digests.get(conversation_id) == typers:
+                continue
+
+            if typers:
+                self.digests[conversation_id] = typers
+            else:
+                self.digests.pop(conversation_id, None)
+
+            await self.manager.broadcast_safe(
+                conversation_id,
+                {"type": "typing_digest", "user_ids": typers}
+            )
 
 
 class ConversationManager:
@@ -10,60 +313,220 @@ class ConversationManager:
     Lưu WebSocket theo dạng:
     rooms = {
         conversation_id: {
-            user_id: websocket
+            user_id: {websocket, ...}
         }
     }
+    users = {user_id: {websocket, ...}}
+
+    1 socket có thể nằm trong nhiều phòng (socket multiplex /ws/{user_id}),
+    1 user có thể có nhiều socket (nhiều tab / thiết bị).
+    Chỉ chứa socket của node (process) hiện tại; sự kiện phòng được
+    publish qua backend pub/sub để các node khác fan-out cho socket của chúng.
     """
 
-    def __init__(self):
-        self.rooms: Dict[int, Dict[int, WebSocket]] = {}
+    def __init__(self, backend: Optional[PubSubBackend] = None):
+        self.rooms: Dict[int, Dict[int, Set[WebSocket]]] = {}
+        self.users: Dict[int, Set[WebSocket]] = {}
         self._lock = asyncio.Lock()
+        self.backend = backend or create_backend()
+        self.node_id = NODE_ID
+        self.dropped_total = 0
+        self.evicted_total = 0
+        self.typing = TypingTracker(self)
+        # user online ở node khác, suy ra từ sự kiện presence
+        self.remote_online: Dict[int, Set[int]] = {}
+        # conversation_id → RoomHistory, LRU
+        self.history: "OrderedDict[int, RoomHistory]" = OrderedDict()
+        self.replayed_total = 0
+        self.catch_up_total = 0
+        # Event quá lớn cho backend pub/sub tới dưới dạng {"type": "refetch"} →
+        # hàm này (main.py gán) dựng lại event đầy đủ từ DB, None nếu không được
+        self.refetch: Optional[Callable[[dict], Awaitable[Optional[dict]]]] = None
+        # Event điều khiển giữa các node (room = None): type → handler, vd. membership.bind
+        self.control_handlers: Dict[str, Callable[[dict], None]] = {}
+
+    # ============================================================
+    # PUB/SUB LIFECYCLE
+    # ============================================================
+    async def start(self):
+        await self.backend.start(self._on_remote_event)
+
+    async def stop(self):
+        self.typing.stop()
+        await self.backend.stop()
+
+    async def _on_remote_event(self, envelope: dict):
+        if envelope.get("node") == self.node_id:
+            return
+
+        conversation_id = envelope["room"]
+        message = envelope["event"]
+
+        if conversation_id is None:
+            handler = self.control_handlers.get(message.get("type"))
+            if handler is not None:
+                handler(message)
+            return
+
+        if message.get("type") == "refetch":
+            message = await self.refetch(message) if self.refetch else None
+            if message is None:
+                return
+
+        if message.get("type") == "presence":
+            online = self.remote_online.setdefault(conversation_id, set())
+            if message.get("status") == "online":
+                online.add(message["user_id"])
+            else:
+                online.discard(message["user_id"])
+                if not online:
+                    del self.remote_online[conversation_id]
+
+        await self._broadcast_local(conversation_id, message, envelope.get("exclude_user"))
+
+    # ============================================================
+    # ATTACH / DETACH (hàng đợi gửi của socket)
+    # ============================================================
+    def attach(self, websocket: WebSocket):
+        if getattr(websocket, "outbox", None) is None:
+            websocket.outbox = OutboundQueue(websocket)
+        if not hasattr(websocket, "conversations"):
+            websocket.conversations = set()
+
+    def detach(self, websocket: WebSocket):
+        outbox = getattr(websocket, "outbox", None)
+        if outbox is None:
+            return
+        self.dropped_total += outbox.dropped
+        self.evicted_total += int(outbox.evicted)
+        outbox.stop()
+        websocket.outbox = None
 
     # ============================================================
     # CONNECT
     # ============================================================
-    async def connect(self, conversation_id: int, user_id: int, websocket: WebSocket):
+    async def connect(self, conversation_id: int, user_id: int, websocket: WebSocket,
+                      last_seq: Optional[int] = None, epoch: Optional[str] = None):
+        """
+        Thêm socket vào phòng. Trả về True nếu đây là socket đầu tiên
+        của user trong phòng (→ cần báo presence online).
+
+        Handshake resume: gửi {"type": "resumed", "epoch", "seq", "replayed"} rồi các event
+        có seq > last_seq còn trong buffer; khoảng hở cũ hơn buffer (hoặc epoch khác)
+        → {"type": "catch_up", "epoch", "seq"}, client tự lấy phần thiếu qua GET /sync.
+        """
         websocket.user_id = user_id  # cần cho disconnect()
+        self.attach(websocket)
+
         async with self._lock:
-            if conversation_id not in self.rooms:
-                self.rooms[conversation_id] = {}
+            room = self.rooms.setdefault(conversation_id, {})
+            first = user_id not in room
+            room.setdefault(user_id, set()).add(websocket)
+            self.users.setdefault(user_id, set()).add(websocket)
+            websocket.conversations.add(conversation_id)
+            # Xếp hàng ngay trong lock: broadcast đánh seq cũng trong lock
+            # → event phát lại luôn đứng trước event mới, không trùng không sót
+            for message in self._resume_frames(conversation_id, last_seq, epoch):
+                self._enqueue(websocket, conversation_id, message)
+        return first
+
+    def _history(self, conversation_id: int, create: bool) -> Optional[RoomHistory]:
+        history = self.history.get(conversation_id)
+        if history is not None:
+            self.history.move_to_end(conversation_id)
+            return history
+        if not create:
+            return None
+
+        history = self.history[conversation_id] = RoomHistory()
+        if len(self.history) > WS_REPLAY_ROOMS:
+            idle = [cid for cid in self.history if cid not in self.rooms]
+            for cid in idle[:len(self.history) - WS_REPLAY_ROOMS]:
+                del self.history[cid]
+        return history
 
-            self.rooms[conversation_id][user_id] = websocket
+    def _resume_frames(self, conversation_id: int, last_seq: Optional[int], epoch: Optional[str]):
+        history = self._history(conversation_id, create=True)
+        state = {"epoch": history.epoch, "seq": history.seq}
+        if last_seq is None:
+            return [{"type": "resumed", **state, "replayed": 0}]
+
+        missed = history.since(last_seq) if epoch == history.epoch else None
+        # Phát lại không được làm đầy hàng đợi gửi (đầy → socket bị đóng)
+        if missed is None or len(missed) >= WS_QUEUE_MAX:
+            self.catch_up_total += 1
+            return [{"type": "catch_up", **state}]
+
+        self.replayed_total += len(missed)
+        return [{"type": "resumed", **state, "replayed": len(missed)}, *missed]
+
+    def _enqueue(self, websocket: WebSocket, conversation_id: int, message: dict):
+        if getattr(websocket, "multiplexed", False):
+            message = {**message, "conversation_id": conversation_id}
+        websocket.outbox.put(Frame(message))
 
     # ============================================================
     # DISCONNECT
     # ============================================================
-    def disconnect(self, conversation_id: int, user_id: Optional[int]):
+    def disconnect(self, conversation_id: int, user_id: Optional[int], websocket: Optional[WebSocket] = None):
+        """
+        Gỡ socket khỏi phòng (websocket=None → gỡ mọi socket của user trong phòng).
+        Trả về True nếu user không còn socket nào trong phòng (→ báo offline).
+        """
         try:
-            if conversation_id in self.rooms:
+            room = self.rooms.get(conversation_id)
+            if room is None or user_id not in room:
+                return False
+
+            sockets = room[user_id]
+            removed = [websocket] if websocket is not None else list(sockets)
+            for ws in removed:
+                sockets.discard(ws)
+                getattr(ws, "conversations", set()).discard(conversation_id)
+                # Socket không còn ở phòng nào → bỏ khỏi index theo user
+                if not getattr(ws, "conversations", None):
+                    self.users.get(user_id, set()).discard(ws)
 
-                if user_id in self.rooms[conversation_id]:
-                    del self.rooms[conversation_id][user_id]
+            if self.users.get(user_id) == set():
+                del self.users[user_id]
 
-                # Nếu phòng không còn ai → xoá phòng
-                if not self.rooms[conversation_id]:
-                    del self.rooms[conversation_id]
+            if sockets:
+                return False
+            del room[user_id]
+
+            # Nếu phòng không còn ai → xoá phòng
+            if not room:
+                del self.rooms[conversation_id]
+            return True
 
         except Exception:
-            pass
+            return False
+
+    def rooms_of(self, websocket: WebSocket):
+        return set(getattr(websocket, "conversations", set()))
 
     # ============================================================
     # GET ONLINE USERS
     # ============================================================
     def get_online_users(self, conversation_id: int):
-        if conversation_id in self.rooms:
-            return list(self.rooms[conversation_id].keys())
-        return []
+        local = set(self.rooms.get(conversation_id, {}).keys())
+        return list(local | self.remote_online.get(conversation_id, set()))
 
     # ============================================================
     # SEND PERSONAL
     # ============================================================
-    async def send_safe(self, websocket: WebSocket, message: dict):
+    async def send_safe(self, websocket: WebSocket, message):
         """
-        Gửi message nhưng không để lỗi socket làm crash server.
+        Gửi message (dict hoặc Frame đã encode) nhưng không để lỗi socket làm crash server.
+        Socket đã attach → chỉ xếp vào hàng đợi, không chờ client nhận.
         """
+        frame = message if isinstance(message, Frame) else Frame(message)
+        outbox = getattr(websocket, "outbox", None)
+        if outbox is not None:
+            outbox.put(frame)
+            return
         try:
-            await websocket.send_json(message)
+            await websocket.send_text(frame.text)
         except:
             pass  # socket chết → bỏ qua
 
@@ -72,36 +535,97 @@ class ConversationManager:
     # ============================================================
     async def broadcast_safe(self, conversation_id: int, message: dict, exclude_user: int = None):
         """
-        Gửi tới tất cả trong phòng nhưng bỏ socket chết.
+        Gửi tới tất cả trong phòng (mọi node) nhưng bỏ socket chết.
         exclude_user: user không nhận message (thường dùng cho typing)
         """
+        await self._broadcast_local(conversation_id, message, exclude_user)
+        await self.backend.publish({
+            "node": self.node_id,
+            "room": conversation_id,
+            "event": message,
+            "exclude_user": exclude_user
+        })
+
+    async def publish_control(self, event: dict):
+        """Event cho các node khác, không gửi tới socket nào (xem control_handlers)."""
+        await self.backend.publish({"node": self.node_id, "room": None, "event": event, "exclude_user": None})
+
+    async def _broadcast_local(self, conversation_id: int, message: dict, exclude_user: int = None):
         async with self._lock:
+            # Đánh seq + lưu buffer cho phòng đang / vừa có socket ở node này
+            if message.get("type") not in EPHEMERAL_TYPES:
+                history = self._history(conversation_id, create=conversation_id in self.rooms)
+                if history is not None:
+                    message = history.append(message)
+
             if conversation_id not in self.rooms:
                 return
 
-            to_remove = []
-            sockets = list(self.rooms[conversation_id].items())  # (user_id, websocket)
+            sockets = [
+                (uid, ws)
+                for uid, user_sockets in self.rooms[conversation_id].items()
+                for ws in user_sockets
+            ]
 
-        tasks = []
+        # Encode 1 lần cho cả phòng; socket multiplex (/ws/{user_id})
+        # cần thêm conversation_id nên có bản riêng, cũng chỉ encode 1 lần
+        plain = tagged = None
 
         for uid, ws in sockets:
             if exclude_user and uid == exclude_user:
                 continue
 
-            tasks.append(self.send_safe(ws, message))
+            if getattr(ws, "multiplexed", False):
+                if tagged is None:
+                    tagged = Frame({**message, "conversation_id": conversation_id})
+                frame = tagged
+            else:
+                if plain is None:
+                    plain = Frame(message)
+                frame = plain
 
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+            outbox = getattr(ws, "outbox", None)
+            if outbox is not None:
+                outbox.put(frame)  # đường nhanh: không tạo coroutine cho từng socket
+            else:
+                await self.send_safe(ws, frame)
 
     # ============================================================
     # SEND TO ONE
     # ============================================================
+    async def send_to_socket(self, websocket: WebSocket, conversation_id: int, message: dict):
+        """Gửi event của 1 phòng cho 1 socket (gắn conversation_id nếu là socket multiplex)."""
+        if getattr(websocket, "multiplexed", False):
+            message = {**message, "conversation_id": conversation_id}
+        await self.send_safe(websocket, message)
+
     async def send_to_user(self, conversation_id: int, user_id: int, message: dict):
         async with self._lock:
-            ws = self.rooms.get(conversation_id, {}).get(user_id)
+            sockets = list(self.rooms.get(conversation_id, {}).get(user_id, ()))
+
+        for ws in sockets:
+            await self.send_to_socket(ws, conversation_id, message)
+
 
-        if ws:
-            await self.send_safe(ws, message)
+    # ============================================================
+    # METRICS
+    # ============================================================
+    def stats(self):
+        sockets = {ws for user_sockets in self.users.values() for ws in user_sockets}
+        live = [ws.outbox for ws in sockets if getattr(ws, "outbox", None) is not None]
+        depths = [len(q) for q in live]
+        return {
+            "connections": len(sockets),
+            "rooms": len(self.rooms),
+            "queue_depth_max": max(depths, default=0),
+            "queue_depth_total": sum(depths),
+            "queue_limit": WS_QUEUE_MAX,
+            "dropped_events": self.dropped_total + sum(q.dropped for q in live),
+            "evicted_connections": self.evicted_total + sum(int(q.evicted) for q in live),
+            "replay_rooms": len(self.history),
+            "replayed_events": self.replayed_total,
+            "catch_ups": self.catch_up_total,
+        }
 
 
 # Singleton
@@ -0,0 +1,95 @@
+# scripts/bench_broadcast.py
+"""
+CPU cho 1 broadcast theo kích thước phòng:
+- per-recipient: send_json cho từng người nhận (encode N lần, cách cũ)
+- encode-once  : encode 1 Frame rồi send_text cho từng người nhận
+- manager      : đường đi thật qua ConversationManager (encode-once + hàng đợi + writer task)
+
+Chạy từ thư mục backend:
+    python scripts/bench_broadcast.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app import websocket_manager  # noqa: E402
+from app.pubsub import InMemoryBackend  # noqa: E402
+from app.websocket_manager import ConversationManager, Frame  # noqa: E402
+
+ROOM_SIZES = [10, 100, 1000, 5000]
+ROUNDS = 50
+
+EVENT = {
+    "type": "message",
+    "message": {
+        "id": 123456,
+        "conversation_id": 1,
+        "sender_id": 42,
+        "content": "Xin chào mọi người, đây là tin nhắn thử nghiệm có độ dài vừa phải 🚀" * 3,
+        "file_url": None,
+        "created_at": "2025-11-25 15:55:00.643428",
+    },
+}
+
+
+class NullSocket:
+    """Socket giả: không I/O, chỉ đo phần CPU phía server."""
+
+    async def send_text(self, text):
+        pass
+
+    async def send_json(self, data):
+        # Giống Starlette: encode mỗi lần gọi
+        json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+async def per_recipient(sockets):
+    await asyncio.gather(*(ws.send_json(EVENT) for ws in sockets))
+
+
+async def encode_once(sockets):
+    frame = Frame(EVENT)
+    await asyncio.gather(*(ws.send_text(frame.text) for ws in sockets))
+
+
+async def via_manager(manager, sockets):
+    await manager.broadcast_safe(1, EVENT)
+    # chờ writer task của từng socket gửi hết
+    while any(len(ws.outbox) for ws in sockets):
+        await asyncio.sleep(0)
+
+
+async def measure(fn, *args):
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        await fn(*args)
+    return (time.process_time() - start) / ROUNDS * 1e6
+
+
+async def main():
+    encoder = "orjson" if websocket_manager.orjson is not None else "json"
+    print(f"encoder: {encoder}, {ROUNDS} rounds, CPU µs per broadcast")
+    print(f"{'room':>6} {'per-recipient':>15} {'encode-once':>13} {'manager':>9}")
+
+    for size in ROOM_SIZES:
+        manager = ConversationManager(InMemoryBackend())
+        sockets = [NullSocket() for _ in range(size)]
+        for uid, ws in enumerate(sockets):
+            await manager.connect(1, uid, ws)
+
+        naive = await measure(per_recipient, sockets)
+        once = await measure(encode_once, sockets)
+        full = await measure(via_manager, manager, sockets)
+        print(f"{size:>6} {naive:>15.0f} {once:>13.0f} {full:>9.0f}")
+
+        for ws in sockets:
+            manager.detach(ws)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+# scripts/bench_login_storm.py
+"""
+Login storm: nhiều request /auth/login cùng lúc, trong khi 1 client khác
+gọi liên tục một route sync rẻ (/users/{id}) để đo độ trễ của phần còn lại.
+
+So sánh bcrypt chạy trong thread request (PASSWORD_POOL_SIZE=0, cách cũ)
+với process pool có giới hạn hàng đợi. Mỗi chế độ chạy trong 1 process riêng
+vì cấu hình pool được đọc lúc import.
+
+Chạy từ thư mục backend:
+    python scripts/bench_login_storm.py [--logins 200] [--rounds 12]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+async def storm(n_logins):
+    sys.path.insert(0, os.path.join(HERE, ".."))
+    import httpx
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        r = await client.post("/auth/register", json={"username": "bench", "email": "b@x", "password": "pw"})
+        user_id = r.json()["id"]
+
+        done = asyncio.Event()
+        probe_latencies = []
+
+        async def probe():
+            while not done.is_set():
+                t0 = time.perf_counter()
+                await client.get(f"/users/{user_id}")
+                probe_latencies.append(time.perf_counter() - t0)
+                await asyncio.sleep(0.01)
+
+        async def login():
+            r = await client.post("/auth/login", json={"username": "bench", "password": "pw"})
+            return r.status_code
+
+        probe_task = asyncio.create_task(probe())
+        t0 = time.perf_counter()
+        codes = await asyncio.gather(*(login() for _ in range(n_logins)))
+        elapsed = time.perf_counter() - t0
+        done.set()
+        await probe_task
+
+    probe_latencies.sort()
+    return {
+        "ok": codes.count(200),
+        "busy": codes.count(503),
+        "elapsed": elapsed,
+        "probe_p50_ms": statistics.median(probe_latencies) * 1000,
+        "probe_max_ms": probe_latencies[-1] * 1000,
+        "probes": len(probe_latencies),
+    }
+
+
+def run_mode(label, env, args):
+    env = {
+        **os.environ,
+        **env,
+        "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/bench.db",
+        "BCRYPT_ROUNDS": str(args.rounds),
+    }
+    out = subprocess.run(
+        [sys.executable, __file__, "--child", "--logins", str(args.logins)],
+        env=env, cwd=os.path.join(HERE, ".."), capture_output=True, text=True, check=True
+    ).stdout.strip().splitlines()[-1]
+    r = json.loads(out)
+    print(f"{label:<28} {r['ok']:>5} {r['busy']:>5} {r['elapsed']:>8.2f}s "
+          f"{r['probe_p50_ms']:>9.1f} {r['probe_max_ms']:>9.1f} {r['probes']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--child", action="store_true")
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(storm(args.logins))))
+        return
+
+    print(f"{args.logins} concurrent logins, bcrypt rounds={args.rounds}, {os.cpu_count()} CPU")
+    print(f"{'mode':<28} {'200':>5} {'503':>5} {'elapsed':>9} {'probe p50':>9} {'probe max':>9} {'probes':>7}")
+    run_mode("inline (request thread)", {"PASSWORD_POOL_SIZE": "0"}, args)
+    run_mode("process pool (default)", {}, args)
+
+
+if __name__ == "__main__":
+    main()
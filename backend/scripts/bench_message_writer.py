@@ -0,0 +1,87 @@
+# scripts/bench_message_writer.py
+"""
+So sánh số tin / giây: commit từng tin (cách hiện tại) với group commit
+của MessageBatchWriter, trên 1 file SQLite tạm.
+
+Chạy từ thư mục backend:
+    python scripts/bench_message_writer.py [--senders 50] [--messages 40]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+from sqlalchemy import text  # noqa: E402
+from app import crud, db, migrations, models  # noqa: E402
+from app.message_writer import MessageBatchWriter  # noqa: E402
+
+
+def setup(n_senders):
+    models.Base.metadata.create_all(bind=db.engine)
+    migrations.run_migrations(db.engine)
+    with db.engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, username, email, password_hash) VALUES (:i, :u, :e, 'x')"),
+                     [{"i": i, "u": f"u{i}", "e": f"u{i}@x"} for i in range(1, n_senders + 1)])
+        conn.execute(text("INSERT INTO conversations (id, name) VALUES (1, 'bench')"))
+
+
+async def per_message(sender_id, n):
+    for i in range(n):
+        if db.AsyncSessionLocal is not None:
+            async with db.AsyncSessionLocal() as s:
+                await crud.async_save_message(s, 1, sender_id, f"msg {i}")
+        else:
+            def save():
+                s = db.SessionLocal()
+                try:
+                    crud.save_message(s, 1, sender_id, f"msg {i}")
+                finally:
+                    s.close()
+            await asyncio.get_running_loop().run_in_executor(None, save)
+
+
+async def batched(writer, sender_id, n):
+    for i in range(n):
+        await writer.submit(1, sender_id, f"msg {i}")
+
+
+async def run(label, make_tasks, total):
+    start = time.perf_counter()
+    await asyncio.gather(*make_tasks())
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {total / elapsed:10.0f} msg/s  ({elapsed:.2f}s)")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=40)
+    args = parser.parse_args()
+
+    setup(args.senders)
+    total = args.senders * args.messages
+    print(f"{args.senders} concurrent senders x {args.messages} messages, "
+          f"async engine: {db.AsyncSessionLocal is not None}")
+
+    await run("commit per message",
+              lambda: [per_message(u, args.messages) for u in range(1, args.senders + 1)], total)
+
+    for delay_ms in (2, 5, 10):
+        writer = MessageBatchWriter(max_delay_ms=delay_ms)
+        writer.start()
+        await run(f"group commit ({delay_ms} ms)",
+                  lambda: [batched(writer, u, args.messages) for u in range(1, args.senders + 1)], total)
+        await writer.stop()
+        print(f"{'':<28} avg batch {writer.stats()['avg_batch']}")
+
+    if db.async_engine is not None:
+        await db.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+# scripts/bench_query_plans.py
+"""
+So sánh query plan + thời gian của các truy vấn nóng trước / sau migration index.
+
+Chạy từ thư mục backend:
+    python scripts/bench_query_plans.py [--messages 200000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+from sqlalchemy import text  # noqa: E402
+from app import db, models, migrations  # noqa: E402
+
+HOT_QUERIES = {
+    "history page": (
+        "SELECT id FROM messages WHERE conversation_id = :cid ORDER BY id DESC LIMIT 50",
+        {"cid": 7},
+    ),
+    "membership check": (
+        "SELECT 1 FROM conversation_members WHERE conversation_id = :cid AND user_id = :uid",
+        {"cid": 7, "uid": 3},
+    ),
+    "seen lookup": (
+        "SELECT id FROM message_seen WHERE message_id = :mid AND user_id = :uid",
+        {"mid": 1234, "uid": 3},
+    ),
+    "reactions for page": (
+        "SELECT emoji, COUNT(*) FROM message_reactions WHERE message_id = :mid GROUP BY emoji",
+        {"mid": 1234},
+    ),
+}
+
+NEW_INDEXES = [
+    "ix_messages_conversation_id_id",
+    "ix_messages_conversation_created_at",
+    "uq_conversation_members_conv_user",
+    "ix_conversation_members_user_id",
+    "uq_message_seen_message_user",
+    "ix_message_reactions_message_emoji",
+]
+
+
+def seed(conn, n_messages, n_convs=100, n_users=50):
+    rnd = random.Random(0)
+    conn.execute(text("INSERT INTO users (id, username, email, password_hash) VALUES (:i, :u, :e, 'x')"),
+                 [{"i": i, "u": f"u{i}", "e": f"u{i}@x"} for i in range(1, n_users + 1)])
+    conn.execute(text("INSERT INTO conversations (id, name) VALUES (:i, :n)"),
+                 [{"i": i, "n": f"c{i}"} for i in range(1, n_convs + 1)])
+    conn.execute(text("INSERT INTO conversation_members (conversation_id, user_id) VALUES (:c, :u)"),
+                 [{"c": c, "u": u} for c in range(1, n_convs + 1) for u in rnd.sample(range(1, n_users + 1), 10)])
+    conn.execute(text("INSERT INTO messages (conversation_id, sender_id, content) VALUES (:c, :s, 'hi')"),
+                 [{"c": rnd.randint(1, n_convs), "s": rnd.randint(1, n_users)} for _ in range(n_messages)])
+    conn.execute(text("INSERT INTO message_seen (message_id, user_id) VALUES (:m, :u)"),
+                 [{"m": m, "u": u} for m in range(1, n_messages + 1, 2) for u in (3, 4)])
+    conn.execute(text("INSERT INTO message_reactions (message_id, user_id, emoji) VALUES (:m, :u, '👍')"),
+                 [{"m": m, "u": 5} for m in range(1, n_messages + 1, 3)])
+
+
+def report(label):
+    print(f"\n== {label} ==")
+    with db.engine.connect() as conn:
+        for name, (sql, params) in HOT_QUERIES.items():
+            plan = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).fetchall()
+            start = time.perf_counter()
+            for _ in range(50):
+                conn.execute(text(sql), params).fetchall()
+            avg_ms = (time.perf_counter() - start) / 50 * 1000
+            print(f"{name:<20} {avg_ms:8.3f} ms  | " + " / ".join(row[-1] for row in plan))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200_000)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=db.engine)
+    with db.engine.begin() as conn:
+        # Giả lập DB cũ: bỏ các index mà migration sẽ thêm
+        for name in NEW_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        seed(conn, args.messages)
+        conn.execute(text("ANALYZE"))
+
+    report("before migrations")
+    migrations.run_migrations(db.engine)
+    with db.engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    report("after migrations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# tests/conftest.py
+"""
+Chạy từ thư mục backend:
+    python -m pytest -q tests
+
+Mỗi lần chạy dùng 1 DB SQLite + thư mục uploads tạm riêng.
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP_DIR = tempfile.mkdtemp(prefix="chat-tests-")
+
+# Phải đặt trước khi import app (db.py đọc DATABASE_URL lúc import)
+os.environ["DATABASE_URL"] = f"sqlite:///{TMP_DIR}/test.db"
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.chdir(TMP_DIR)  # uploads/ là đường dẫn tương đối
+sys.path.insert(0, BACKEND_DIR)
+
+_names = itertools.count()
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    return TestClient(app)
+
+
+@pytest.fixture
+def make_user(client):
+    """make_user() → (user_id, headers); tên user không trùng giữa các test."""
+    def make(prefix="user"):
+        name = f"{prefix}{next(_names)}"
+        client.post("/auth/register", json={"username": name, "email": f"{name}@test", "password": "pw"})
+        data = client.post("/auth/login", json={"username": name, "password": "pw"}).json()
+        return data["user"]["id"], {"Authorization": "Bearer " + data["access_token"]}
+
+    return make
+
+
+@pytest.fixture
+def make_conversation(client):
+    def make(headers, member_ids=()):
+        response = client.post("/conversations/", headers=headers, json={
+            "name": "test", "is_group": True, "member_ids": list(member_ids)
+        })
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+
+    return make
@@ -0,0 +1,18 @@
+# tests/test_auth.py
+from app import auth
+
+
+def test_login_gets_503_when_password_pool_is_full(client, monkeypatch):
+    client.post("/auth/register", json={"username": "busy", "email": "busy@test", "password": "pw"})
+    monkeypatch.setattr(auth.password_pool, "size", 1)
+    monkeypatch.setattr(auth.password_pool, "queue_max", 0)
+    rejected = auth.password_pool.rejected
+
+    response = client.post("/auth/login", json={"username": "busy", "password": "pw"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert auth.password_pool.rejected == rejected + 1
+
+    monkeypatch.undo()
+    assert client.post("/auth/login", json={"username": "busy", "password": "pw"}).status_code == 200
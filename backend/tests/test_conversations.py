@@ -0,0 +1,101 @@
+# tests/test_conversations.py
+def test_non_member_cannot_change_conversation(client, make_user, make_conversation):
+    owner, headers = make_user()
+    _, outsider = make_user()
+    cid = make_conversation(headers)
+
+    assert client.delete(f"/settings/delete/{cid}", headers=outsider).status_code == 403
+    assert client.put("/settings/theme", headers=outsider, json={"conversation_id": cid, "theme": "dark"}).status_code == 403
+    response = client.put("/conversations/nickname", headers=outsider,
+                          params={"conversation_id": cid, "user_id": owner, "nickname": "x"})
+    assert response.status_code == 403
+
+    assert client.delete("/settings/delete/999999", headers=outsider).status_code == 404
+    assert client.delete(f"/settings/delete/{cid}", headers=headers).status_code == 200
+
+
+def _inbox(client, headers, limit, cursor=None):
+    params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+    response = client.get("/conversations/mine", headers=headers, params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_inbox_pages_by_latest_activity(client, make_user, make_conversation):
+    _, headers = make_user()
+    cids = [make_conversation(headers) for _ in range(5)]
+    # Hoạt động gần nhất: cids[1], cids[3], rồi các hội thoại chưa có tin (mới tạo trước)
+    for cid in (cids[3], cids[1]):
+        client.post("/messages/", headers=headers, json={"conversation_id": cid, "content": f"tin {cid}"})
+
+    seen, cursor = [], None
+    while True:
+        page = _inbox(client, headers, 2, cursor)
+        assert len(page["items"]) <= 2
+        seen += page["items"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert [c["id"] for c in seen] == [cids[1], cids[3], cids[4], cids[2], cids[0]]
+    assert seen[0]["last_message"]["content"] == f"tin {cids[1]}"
+    assert seen[2]["last_message"] is None
+    assert [c["id"] for c in _inbox(client, headers, 50)["items"]] == [c["id"] for c in seen]
+
+
+def test_unread_count_follows_new_messages_and_reads(client, make_user, make_conversation):
+    from app import activity, crud, db
+
+    alice, alice_headers = make_user()
+    bob, bob_headers = make_user()
+    cid = make_conversation(alice_headers, [bob])
+
+    def unread(headers):
+        return next(c["unread_count"] for c in _inbox(client, headers, 50)["items"] if c["id"] == cid)
+
+    def mark_read(user_id, message_id):
+        db_s = db.SessionLocal()
+        try:
+            crud.mark_read(db_s, cid, user_id, message_id)
+        finally:
+            db_s.close()
+
+    ids = [
+        client.post("/messages/", headers=alice_headers, json={"conversation_id": cid, "content": f"tin {i}"}).json()["id"]
+        for i in range(3)
+    ]
+    assert (unread(alice_headers), unread(bob_headers)) == (0, 3)
+
+    mark_read(bob, ids[1])
+    assert unread(bob_headers) == 1
+
+    # Tin của chính mình không tính; watermark không lùi
+    client.post("/messages/", headers=bob_headers, json={"conversation_id": cid, "content": "trả lời"})
+    mark_read(bob, ids[0])
+    assert unread(bob_headers) == 1
+    assert unread(alice_headers) == 1
+
+    mark_read(bob, ids[2])
+    assert unread(bob_headers) == 0
+
+    # Dựng lại từ messages cho kết quả y hệt số đang giữ
+    db_s = db.SessionLocal()
+    try:
+        activity.repair(db_s)
+    finally:
+        db_s.close()
+    assert (unread(alice_headers), unread(bob_headers)) == (1, 0)
+
+
+def test_counters_default_to_zero_on_raw_insert(client):
+    from sqlalchemy import text
+
+    from app import db
+
+    with db.engine.begin() as conn:
+        cid = conn.execute(text("INSERT INTO conversations (name, is_group) VALUES ('raw', 1) RETURNING id")).scalar_one()
+        conn.execute(text("INSERT INTO conversation_members (conversation_id, user_id) VALUES (:cid, 1)"), {"cid": cid})
+        assert conn.execute(text("SELECT message_count FROM conversations WHERE id = :cid"), {"cid": cid}).scalar_one() == 0
+        assert conn.execute(
+            text("SELECT unread_count FROM conversation_members WHERE conversation_id = :cid"), {"cid": cid}
+        ).scalar_one() == 0
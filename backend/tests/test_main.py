@@ -0,0 +1,18 @@
+# tests/test_main.py
+def test_lifespan_starts_and_stops_background_components():
+    from fastapi.testclient import TestClient
+
+    from app import storage, sync
+    from app.main import app
+    from app.membership import membership
+
+    with TestClient(app) as started:
+        assert started.get("/server-info").status_code == 200
+        assert sync.pruner.stats()["running"]
+        assert storage.blob_gc.stats()["running"] == storage.BLOB_GC_ENABLED
+        assert membership._publish is not None
+
+    assert not sync.pruner.stats()["running"]
+    assert not storage.blob_gc.stats()["running"]
+    # Loop đã đóng: invalidate vẫn chạy, chỉ không publish được
+    membership.invalidate(123456)
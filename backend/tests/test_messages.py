@@ -0,0 +1,103 @@
+# tests/test_messages.py
+from sqlalchemy import event
+
+from app import crud, db
+
+
+def _fill(client, headers, cid, n):
+    ids = []
+    for i in range(n):
+        body = {"conversation_id": cid, "content": f"tin {i}"}
+        if i % 3 == 0:
+            body["file_url"] = f"/uploads/blobs/ab/cd/{'%064x' % i}.png"
+        ids.append(client.post("/messages/", headers=headers, json=body).json()["id"])
+    return ids
+
+
+def _count_queries(fn):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        fn()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    return len(statements)
+
+
+def test_hydrate_query_count_is_constant(client, make_user, make_conversation):
+    uid, headers = make_user()
+    friend, friend_headers = make_user()
+    cid = make_conversation(headers, [friend])
+    ids = _fill(client, headers, cid, 120)
+
+    db_s = db.SessionLocal()
+    try:
+        for mid in ids[::7]:
+            crud.add_or_update_reaction(db_s, mid, friend, "👍")
+        crud.mark_read(db_s, cid, friend, ids[-1])
+    finally:
+        db_s.close()
+
+    def page(limit):
+        response = client.get(f"/messages/{cid}", headers=headers, params={"limit": limit})
+        assert len(response.json()["items"]) == limit
+
+    small = _count_queries(lambda: page(10))
+    large = _count_queries(lambda: page(100))
+    assert small == large
+
+    def hydrate():
+        db_s = db.SessionLocal()
+        try:
+            messages, _, _ = crud.get_messages_page(db_s, cid, limit=100)
+            load = _count_queries(lambda: crud.hydrate_messages(db_s, messages))
+        finally:
+            db_s.close()
+        return load
+
+    # watermark + reactions + metadata ảnh
+    assert hydrate() == 3
+
+
+def test_after_id_page_reports_older_from_data(client, make_user, make_conversation):
+    _, headers = make_user()
+    cid = make_conversation(headers)
+    ids = _fill(client, headers, cid, 5)
+
+    def page(after_id):
+        return client.get(f"/messages/{cid}", headers=headers, params={"after_id": after_id, "limit": 2}).json()
+
+    # Không có tin nào ≤ after_id → không còn trang cũ hơn
+    first = page(ids[0] - 1)
+    assert [m["id"] for m in first["items"]] == ids[:2]
+    assert first["prev_cursor"] is None and first["next_cursor"] is not None
+
+    middle = page(ids[1])
+    assert [m["id"] for m in middle["items"]] == ids[2:4]
+    assert middle["prev_cursor"] is not None
+
+
+def test_tampered_cursor_is_rejected(client, make_user, make_conversation):
+    from app.pagination import encode_cursor
+
+    _, headers = make_user()
+    cid = make_conversation(headers)
+    cases = [
+        (f"/messages/{cid}", "cursor", {"before": "x"}),
+        (f"/messages/{cid}", "cursor", {"after": [1]}),
+        (f"/messages/{cid}/search", "cursor", {"offset": "a"}),
+        (f"/messages/{cid}/search", "cursor", {"offset": -5}),
+        ("/conversations/mine", "cursor", {"at": 1, "id": 1}),
+        ("/conversations/mine", "cursor", {"at": "2024-01-01T00:00:00", "id": "1"}),
+        (f"/media/{cid}", "cursor", {"before": {"a": 1}}),
+        ("/sync", "since", {"seq": 1, "at": "now"}),
+        ("/sync", "since", {"seq": 1, "at": 1, "gaps": [[1]]}),
+    ]
+    for url, param, data in cases:
+        response = client.get(url, headers=headers, params={"q": "a", param: encode_cursor(data)})
+        assert response.status_code == 400, (url, data, response.text)
+        assert response.json()["detail"] == "Invalid cursor"
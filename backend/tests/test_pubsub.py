@@ -0,0 +1,269 @@
+# tests/test_pubsub.py
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import pytest
+
+from app import pubsub
+from app.websocket_manager import ConversationManager
+
+from conftest import BACKEND_DIR
+
+
+# ============================================================
+# BROKER REDIS GIẢ (khi không có REDIS_URL)
+# ============================================================
+def _bulk(data: bytes) -> bytes:
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class FakeRedis:
+    """Broker RESP tối thiểu: AUTH / SELECT / PING / SUBSCRIBE / PUBLISH."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.subscribers = set()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(asyncio.start_server(self._client, "127.0.0.1", 0))
+            self.port = self.server.sockets[0].getsockname()[1]
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                command = await pubsub._read_reply(reader)
+                name = command[0].decode().upper()
+                if name == "SUBSCRIBE":
+                    self.subscribers.add(writer)
+                    writer.write(b"*3\r\n" + _bulk(b"subscribe") + _bulk(command[1]) + b":1\r\n")
+                elif name == "PUBLISH":
+                    for sub in list(self.subscribers):
+                        sub.write(b"*3\r\n" + _bulk(b"message") + _bulk(command[1]) + _bulk(command[2]))
+                    writer.write(b":%d\r\n" % len(self.subscribers))
+                else:
+                    writer.write(b"+OK\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.subscribers.discard(writer)
+            writer.close()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ============================================================
+# 2 PROCESS UVICORN DÙNG CHUNG DB + REDIS
+# ============================================================
+@pytest.fixture(scope="module")
+def cluster():
+    pytest.importorskip("uvicorn")
+    pytest.importorskip("websockets.sync.client")
+
+    redis_url = os.getenv("REDIS_URL") or FakeRedis().url
+    workdir = tempfile.mkdtemp(prefix="chat-cluster-")
+    env = {
+        **os.environ,
+        "PYTHONPATH": BACKEND_DIR,
+        "DATABASE_URL": f"sqlite:///{workdir}/cluster.db",
+        "PUBSUB_URL": redis_url,
+    }
+
+    nodes, procs = [], []
+    try:
+        # Lần lượt: node đầu tạo schema + migration trước khi node sau import app
+        for _ in range(2):
+            port = _free_port()
+            procs.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+                cwd=workdir, env=env
+            ))
+            base = f"http://127.0.0.1:{port}"
+            deadline = time.time() + 30
+            while True:
+                try:
+                    if httpx.get(f"{base}/server-info").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                assert time.time() < deadline, "node did not start"
+                time.sleep(0.2)
+            nodes.append(base)
+        yield nodes
+    finally:
+        for proc in procs:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def _login(base, name):
+    httpx.post(f"{base}/auth/register", json={"username": name, "email": f"{name}@test", "password": "pw"})
+    data = httpx.post(f"{base}/auth/login", json={"username": name, "password": "pw"}).json()
+    return data["user"]["id"], data["access_token"]
+
+
+def _receive(ws, kind, timeout=10, **match):
+    deadline = time.time() + timeout
+    while True:
+        frame = json.loads(ws.recv(timeout=max(deadline - time.time(), 0.01)))
+        if frame["type"] == kind and all(frame.get(k) == v for k, v in match.items()):
+            return frame
+
+
+def _receive_message(ws, content):
+    while True:
+        frame = _receive(ws, "message")
+        if frame["message"]["content"] == content:
+            return frame
+
+
+def test_events_cross_processes(cluster):
+    from websockets.sync.client import connect
+
+    node_a, node_b = cluster
+    alice, alice_token = _login(node_a, "alice")
+    bob, bob_token = _login(node_b, "bob")
+    cid = httpx.post(f"{node_a}/conversations/", headers={"Authorization": f"Bearer {alice_token}"},
+                     json={"name": "g", "is_group": True, "member_ids": [bob]}).json()["id"]
+
+    ws_base_a = node_a.replace("http", "ws")
+    ws_base_b = node_b.replace("http", "ws")
+    with connect(f"{ws_base_a}/ws/{cid}/{alice}?token={alice_token}") as ws_a, \
+            connect(f"{ws_base_b}/ws/{cid}/{bob}?token={bob_token}") as ws_b:
+        _receive(ws_a, "resumed")
+        _receive(ws_b, "resumed")
+
+        # presence của bob (node B) tới alice (node A)
+        _receive(ws_a, "presence", user_id=bob, status="online")
+
+        ws_b.send(json.dumps({"type": "message", "content": "from B"}))
+        assert _receive_message(ws_a, "from B")["message"]["sender_id"] == bob
+
+        ws_a.send(json.dumps({"type": "message", "content": "from A"}))
+        assert _receive_message(ws_b, "from A")["message"]["sender_id"] == alice
+
+
+# ============================================================
+# BACKEND (trong 1 process)
+# ============================================================
+def test_memory_hub_delivers_to_other_managers_only():
+    async def scenario():
+        hub = pubsub.InMemoryHub()
+        node_a = ConversationManager(pubsub.InMemoryBackend(hub))
+        node_b = ConversationManager(pubsub.InMemoryBackend(hub))
+        node_b.node_id = "node-b"
+        received = {"a": [], "b": []}
+
+        async def record(name, conversation_id, message, exclude_user=None):
+            received[name].append((conversation_id, message["type"]))
+
+        node_a._broadcast_local = lambda *args: record("a", *args)
+        node_b._broadcast_local = lambda *args: record("b", *args)
+        await node_a.start()
+        await node_b.start()
+
+        await node_a.broadcast_safe(7, {"type": "message", "message": {"id": 1}})
+        assert received == {"a": [(7, "message")], "b": [(7, "message")]}
+
+    asyncio.run(scenario())
+
+
+def test_refetch_notice_is_resolved_on_receiving_node():
+    envelope = {"node": "other", "room": 3, "exclude_user": None,
+                "event": {"type": "message", "message": {"id": 42, "content": "x" * 10000}}}
+    ref = pubsub.refetch_envelope(envelope)
+    assert ref["event"] == {"type": "refetch", "event_type": "message", "message_id": 42}
+    assert pubsub.refetch_envelope({**envelope, "event": {"type": "typing"}}) is None
+
+    async def scenario():
+        manager = ConversationManager(pubsub.InMemoryBackend())
+        delivered = []
+
+        async def local(conversation_id, message, exclude_user=None):
+            delivered.append(message)
+
+        async def refetch(message):
+            return {"type": "message", "message": {"id": message["message_id"], "content": "full"}}
+
+        manager._broadcast_local = local
+        manager.refetch = refetch
+        await manager._on_remote_event(ref)
+        assert delivered == [{"type": "message", "message": {"id": 42, "content": "full"}}]
+
+    asyncio.run(scenario())
+
+
+def test_redis_publish_never_blocks_when_unreachable():
+    async def scenario():
+        backend = pubsub.RedisBackend(f"redis://127.0.0.1:{_free_port()}", connect_timeout=0.2)
+        started = time.monotonic()
+        for i in range(100):
+            await backend.publish({"node": "n", "room": 1, "event": {"type": "message", "i": i}})
+        assert time.monotonic() - started < 0.5
+        await backend.stop()
+
+    asyncio.run(scenario())
+
+
+def test_backend_without_publish_cannot_be_created():
+    class Incomplete(pubsub.PubSubBackend):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_membership_invalidation_reaches_other_workers():
+    from app.membership import MembershipCache
+
+    async def scenario():
+        hub = pubsub.InMemoryHub()
+        node_a = ConversationManager(pubsub.InMemoryBackend(hub))
+        node_b = ConversationManager(pubsub.InMemoryBackend(hub))
+        node_b.node_id = "node-b"
+        await node_a.start()
+        await node_b.start()
+
+        loop = asyncio.get_running_loop()
+        cache_a, cache_b = MembershipCache(), MembershipCache()
+        cache_a.bind(node_a, loop)
+        cache_b.bind(node_b, loop)
+        cache_b._store(5, {1, 2}, cache_b._generation)
+
+        # crud gọi invalidate trong threadpool
+        await asyncio.to_thread(cache_a.invalidate, 5)
+        for _ in range(50):
+            if cache_b.remote_invalidations:
+                break
+            await asyncio.sleep(0.01)
+
+        assert cache_b._lookup(5)[0] is None
+        assert (cache_a.remote_invalidations, cache_b.remote_invalidations) == (0, 1)
+
+    asyncio.run(scenario())
@@ -0,0 +1,23 @@
+# tests/test_search.py
+import pytest
+
+
+@pytest.mark.parametrize("q", [" ", "   ", "\t"])
+def test_blank_query_returns_empty_page(client, make_user, make_conversation, q):
+    _, headers = make_user()
+    cid = make_conversation(headers)
+    client.post("/messages/", headers=headers, json={"conversation_id": cid, "content": "xin chào"})
+
+    for url in ("/messages/search", f"/messages/{cid}/search"):
+        response = client.get(url, headers=headers, params={"q": q})
+        assert response.status_code == 200, response.text
+        assert response.json() == {"items": [], "next_cursor": None}
+
+
+def test_search_finds_message(client, make_user, make_conversation):
+    _, headers = make_user()
+    cid = make_conversation(headers)
+    client.post("/messages/", headers=headers, json={"conversation_id": cid, "content": "hẹn gặp lúc tám giờ"})
+
+    items = client.get(f"/messages/{cid}/search", headers=headers, params={"q": " gặp "}).json()["items"]
+    assert [item["content"] for item in items] == ["hẹn gặp lúc tám giờ"]
@@ -0,0 +1,108 @@
+# tests/test_storage.py
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import crud, db, models, storage
+
+
+def _old_blob(sha256, ext=".bin"):
+    """Blob không ai dùng, upload đã quá grace; file nằm sẵn trên đĩa."""
+    path = storage.blob_path(sha256, ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"data")
+
+    db_s = db.SessionLocal()
+    try:
+        db_s.add(models.Blob(sha256=sha256, size=4, ext=ext, uploaded_at=datetime.utcnow() - timedelta(days=1)))
+        db_s.commit()
+    finally:
+        db_s.close()
+    return path
+
+
+def test_gc_removes_unreferenced_blob(client):
+    path = _old_blob("a" * 64)
+    assert storage.BlobGarbageCollector(grace=60).collect() >= 1
+    assert not os.path.exists(path)
+
+
+def test_gc_keeps_file_reuploaded_during_collect(client, monkeypatch):
+    sha256 = "b" * 64
+    path = _old_blob(sha256)
+    delete = crud.delete_blob_if_unreferenced
+
+    def delete_then_reupload(db_s, blob_id, cutoff):
+        deleted = delete(db_s, blob_id, cutoff)
+        # store_blob song song: register lại ngay sau khi GC xoá dòng, trước khi xoá file
+        other = db.SessionLocal()
+        try:
+            crud.register_blob(other, sha256, 4, ".bin")
+        finally:
+            other.close()
+        return deleted
+
+    monkeypatch.setattr(crud, "delete_blob_if_unreferenced", delete_then_reupload)
+    gc = storage.BlobGarbageCollector(grace=60)
+    gc.collect()
+
+    assert os.path.exists(path)
+    assert gc.restored == 1
+
+
+def test_register_blob_retries_when_gc_deletes_row(client):
+    sha256 = "c" * 64
+    _old_blob(sha256)
+    db_s = db.SessionLocal()
+
+    @event.listens_for(db_s, "before_flush", once=True)
+    def gc_deletes_row(session, flush_context, instances):
+        other = db.SessionLocal()
+        try:
+            other.query(models.Blob).filter(models.Blob.sha256 == sha256).delete()
+            other.commit()
+        finally:
+            other.close()
+
+    try:
+        blob = crud.register_blob(db_s, sha256, 4, ".bin")
+        assert crud.get_blob(db_s, sha256).id == blob.id
+    finally:
+        db_s.close()
+
+
+def test_oversized_upload_gets_413(client, make_user, monkeypatch):
+    from app.routes import file_routes
+
+    _, headers = make_user()
+    monkeypatch.setattr(file_routes, "MAX_SIZE", 10)
+    def leftovers():
+        return sorted(os.listdir(storage.BLOB_TMP_DIR)) if os.path.isdir(storage.BLOB_TMP_DIR) else []
+
+    before = leftovers()
+
+    response = client.post("/files/upload", headers=headers, files={"file": ("big.bin", b"x" * 11)})
+
+    assert response.status_code == 413
+    assert leftovers() == before
+
+
+def test_upload_without_declared_size_stops_and_removes_partial_file(client, monkeypatch, tmp_path):
+    import asyncio
+    import io
+
+    import pytest
+    from fastapi import HTTPException
+    from starlette.datastructures import UploadFile
+
+    monkeypatch.setattr(storage, "UPLOAD_CHUNK_SIZE", 4)
+    # Client không khai báo kích thước → chỉ biết vượt khi đang ghi
+    upload = UploadFile(io.BytesIO(b"x" * 20), filename="big.bin")
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(storage.save_upload(upload, str(tmp_path), "big.bin", max_size=10))
+
+    assert error.value.status_code == 413
+    assert os.listdir(tmp_path) == []
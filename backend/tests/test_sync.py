@@ -0,0 +1,62 @@
+# tests/test_sync.py
+import time
+
+from app import db, models, sync
+from app.pagination import decode_cursor, encode_cursor
+
+
+def _sync(client, headers, cursor=None):
+    response = client.get("/sync", headers=headers, params={"since": cursor} if cursor else {})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _post(client, headers, cid, content):
+    return client.post("/messages/", headers=headers, json={"conversation_id": cid, "content": content}).json()
+
+
+def test_empty_page_keeps_cursor_age(client, make_user, make_conversation):
+    _, headers = make_user()
+    make_conversation(headers)
+    cursor = decode_cursor(_sync(client, headers)["cursor"])
+    cursor["at"] -= 100
+
+    returned = decode_cursor(_sync(client, headers, encode_cursor(cursor))["cursor"])
+    assert returned == cursor
+
+    cursor["at"] = int(time.time() - sync.CHANGE_LOG_RETENTION - 1)
+    assert _sync(client, headers, encode_cursor(cursor))["reset"] is True
+
+
+def test_late_commit_behind_cursor_is_delivered(client, make_user, make_conversation, monkeypatch):
+    monkeypatch.setattr(sync, "tracks_gaps", lambda db_s: True)
+    _, headers = make_user()
+    cid = make_conversation(headers)
+    cursor = _sync(client, headers)["cursor"]
+    first = _post(client, headers, cid, "commit muộn")
+    _post(client, headers, cid, "commit trước")
+
+    # Giả lập transaction của tin đầu chưa commit: dòng log của nó chưa nhìn thấy được
+    db_s = db.SessionLocal()
+    try:
+        row = db_s.query(models.Change).filter_by(kind=sync.MESSAGE, entity_id=first["id"]).one()
+        pending = {c.name: getattr(row, c.name) for c in models.Change.__table__.columns}
+        db_s.delete(row)
+        db_s.commit()
+    finally:
+        db_s.close()
+
+    page = _sync(client, headers, cursor)
+    assert [m["content"] for m in page["messages"]] == ["commit trước"]
+    assert pending["id"] in [gid for gid, _ in decode_cursor(page["cursor"])["gaps"]]
+
+    db_s = db.SessionLocal()
+    try:
+        db_s.add(models.Change(**pending))
+        db_s.commit()
+    finally:
+        db_s.close()
+
+    page = _sync(client, headers, page["cursor"])
+    assert [m["content"] for m in page["messages"]] == ["commit muộn"]
+    assert pending["id"] not in [gid for gid, _ in decode_cursor(page["cursor"]).get("gaps", [])]
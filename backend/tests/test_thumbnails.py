@@ -0,0 +1,29 @@
+# tests/test_thumbnails.py
+import asyncio
+import os
+
+import pytest
+
+from app import storage, thumbnails
+
+
+def test_generator_rebuilds_broken_pool(client):
+    Image = pytest.importorskip("PIL.Image")
+    sha256 = "d" * 64
+    path = storage.blob_path(sha256, ".png")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new("RGB", (40, 30), "red").save(path)
+
+    generator = thumbnails.ThumbnailGenerator(size=1)
+    try:
+        # Worker chết giữa chừng → pool hỏng, mọi submit sau đều BrokenProcessPool
+        broken = generator._get_executor()
+        with pytest.raises(Exception):
+            broken.submit(os._exit, 1).result()
+
+        meta = asyncio.run(generator.ensure(sha256, ".png"))
+        assert (meta["width"], meta["height"]) == (40, 30)
+        assert generator.restarts == 1
+        assert generator._executor is not broken
+    finally:
+        generator.shutdown()
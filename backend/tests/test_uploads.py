@@ -0,0 +1,53 @@
+# tests/test_uploads.py
+import hashlib
+import os
+
+from app import storage
+
+DATA = b"0123456789abcdef"
+
+
+def _upload(client, headers):
+    response = client.post("/files/upload", headers=headers, files={"file": ("notes.txt", DATA)})
+    assert response.status_code == 200, response.text
+    return response.json()["file_url"]
+
+
+def test_blob_has_immutable_etag_and_304(client, make_user):
+    _, headers = make_user()
+    url = _upload(client, headers)
+
+    response = client.get(url)
+    assert response.status_code == 200 and response.content == DATA
+    assert response.headers["ETag"] == f'"{hashlib.sha256(DATA).hexdigest()}"'
+    assert "immutable" in response.headers["Cache-Control"]
+
+    cached = client.get(url, headers={"If-None-Match": f'W/{response.headers["ETag"]}, "other"'})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+
+def test_range_request_returns_partial_content(client, make_user):
+    _, headers = make_user()
+    url = _upload(client, headers)
+
+    response = client.get(url, headers={"Range": "bytes=4-7"})
+    assert response.status_code == 206
+    assert response.content == DATA[4:8]
+    assert response.headers["Content-Range"] == f"bytes 4-7/{len(DATA)}"
+
+
+def test_legacy_avatar_revalidates_and_private_dirs_are_hidden(client):
+    os.makedirs(os.path.join(storage.UPLOAD_DIR, "avatars"), exist_ok=True)
+    with open(os.path.join(storage.UPLOAD_DIR, "avatars", "1_me.png"), "wb") as f:
+        f.write(DATA)
+
+    response = client.get("/uploads/avatars/1_me.png")
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert response.headers["ETag"] == f'"{hashlib.sha256(DATA).hexdigest()}"'
+
+    os.makedirs(storage.BLOB_TMP_DIR, exist_ok=True)
+    with open(os.path.join(storage.BLOB_TMP_DIR, "x.upload"), "wb") as f:
+        f.write(DATA)
+    assert client.get("/uploads/tmp/x.upload").status_code == 404
+    assert client.get("/uploads/../chat.db").status_code == 404
@@ -0,0 +1,202 @@
+# tests/test_websocket_manager.py
+import asyncio
+import json
+
+from app import pubsub, websocket_manager
+from app.websocket_manager import ConversationManager, RoomHistory
+
+
+class FakeSocket:
+    def __init__(self, stalled=False):
+        self.frames = []
+        self.close_code = None
+        self.stalled = stalled
+
+    async def send_text(self, text):
+        if self.stalled:
+            await asyncio.Event().wait()
+        self.frames.append(json.loads(text))
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+    def types(self):
+        return [frame["type"] for frame in self.frames]
+
+
+async def _drain():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def _run(scenario):
+    async def wrapped():
+        manager = ConversationManager(pubsub.InMemoryBackend())
+        try:
+            await scenario(manager)
+        finally:
+            manager.typing.stop()
+
+    asyncio.run(wrapped())
+
+
+# ============================================================
+# RESUME
+# ============================================================
+def test_resume_replays_missed_events():
+    async def scenario(manager):
+        first = FakeSocket()
+        await manager.connect(1, 10, first)
+        for i in range(3):
+            await manager.broadcast_safe(1, {"type": "message", "message": {"id": i}})
+        await _drain()
+        handshake, *events = first.frames
+        assert [e["seq"] for e in events] == [1, 2, 3]
+
+        again = FakeSocket()
+        await manager.connect(1, 11, again, last_seq=1, epoch=handshake["epoch"])
+        await _drain()
+        assert again.frames[0] == {"type": "resumed", "epoch": handshake["epoch"], "seq": 3, "replayed": 2}
+        assert [f["message"]["id"] for f in again.frames[1:]] == [1, 2]
+
+    _run(scenario)
+
+
+def test_resume_with_other_epoch_asks_for_catch_up():
+    async def scenario(manager):
+        socket = FakeSocket()
+        await manager.broadcast_safe(1, {"type": "message", "message": {"id": 1}})
+        await manager.connect(1, 10, socket, last_seq=0, epoch="restarted")
+        await _drain()
+        assert socket.types() == ["catch_up"]
+        assert manager.catch_up_total == 1
+
+    _run(scenario)
+
+
+def test_resume_past_replay_buffer_asks_for_catch_up(monkeypatch):
+    async def scenario(manager):
+        watcher = FakeSocket()
+        await manager.connect(1, 10, watcher)
+        manager.history[1] = history = RoomHistory(size=2)
+        for i in range(5):
+            await manager.broadcast_safe(1, {"type": "message", "message": {"id": i}})
+
+        # seq 1 đã trôi khỏi buffer 2 event
+        late = FakeSocket()
+        await manager.connect(1, 11, late, last_seq=1, epoch=history.epoch)
+        # Còn trong buffer nhưng phát lại sẽ làm đầy hàng đợi gửi
+        monkeypatch.setattr(websocket_manager, "WS_QUEUE_MAX", 1)
+        crowded = FakeSocket()
+        await manager.connect(1, 12, crowded, last_seq=3, epoch=history.epoch)
+        await _drain()
+
+        assert late.types() == ["catch_up"]
+        assert crowded.types() == ["catch_up"]
+        assert late.frames[0]["seq"] == 5
+
+    _run(scenario)
+
+
+# ============================================================
+# SLOW CONSUMER
+# ============================================================
+def test_full_queue_drops_typing_then_evicts_slow_consumer():
+    async def scenario(manager):
+        slow = FakeSocket(stalled=True)
+        slow.outbox = websocket_manager.OutboundQueue(slow, maxsize=3, send_timeout=60)
+        fast = FakeSocket()
+        for ws, uid in ((slow, 10), (fast, 11)):
+            await manager.connect(1, uid, ws)
+        await _drain()
+
+        await manager.broadcast_safe(1, {"type": "typing", "user_id": 11, "status": True})
+        for i in range(3):
+            await manager.broadcast_safe(1, {"type": "message", "message": {"id": i}})
+        # Đầy: typing bị bỏ trước, socket chưa bị đóng
+        assert slow.outbox.dropped == 1 and slow.close_code is None
+
+        await manager.broadcast_safe(1, {"type": "message", "message": {"id": 3}})
+        await _drain()
+        assert slow.close_code == websocket_manager.SLOW_CONSUMER_CLOSE_CODE
+        # Socket chậm không làm chậm người khác
+        assert [f["message"]["id"] for f in fast.frames if f["type"] == "message"] == [0, 1, 2, 3]
+
+        manager.detach(slow)
+        assert manager.evicted_total == 1
+
+    _run(scenario)
+
+
+def test_send_timeout_evicts_socket():
+    async def scenario(manager):
+        slow = FakeSocket(stalled=True)
+        queue = websocket_manager.OutboundQueue(slow, send_timeout=0.05)
+        queue.put(websocket_manager.Frame({"type": "message"}))
+        await asyncio.sleep(0.2)
+        assert queue.evicted
+        assert slow.close_code == websocket_manager.SLOW_CONSUMER_CLOSE_CODE
+        queue.stop()
+
+    _run(scenario)
+
+
+# ============================================================
+# TYPING
+# ============================================================
+def _record_broadcasts(manager):
+    sent = []
+
+    async def record(conversation_id, message, exclude_user=None):
+        sent.append(message)
+
+    manager.broadcast_safe = record
+    return sent
+
+
+def test_typing_start_is_debounced_and_stop_sent_once(monkeypatch):
+    monkeypatch.setattr(websocket_manager, "TYPING_START_DELAY", 0.05)
+
+    async def scenario(manager):
+        sent = _record_broadcasts(manager)
+
+        # Gõ rồi dừng trước hết delay → không phát gì
+        await manager.typing.update(1, 10, True)
+        await manager.typing.update(1, 10, False)
+        await asyncio.sleep(0.1)
+        assert sent == []
+
+        for _ in range(5):
+            await manager.typing.update(1, 10, True)
+        await asyncio.sleep(0.1)
+        await manager.typing.update(1, 10, False)
+        await manager.typing.update(1, 10, False)
+        await _drain()
+        assert sent == [
+            {"type": "typing", "user_id": 10, "status": True},
+            {"type": "typing", "user_id": 10, "status": False},
+        ]
+
+    _run(scenario)
+
+
+def test_large_room_gets_typing_digest(monkeypatch):
+    monkeypatch.setattr(websocket_manager, "TYPING_DIGEST_THRESHOLD", 2)
+    monkeypatch.setattr(websocket_manager, "TYPING_DIGEST_INTERVAL", 0.05)
+
+    async def scenario(manager):
+        for uid in (10, 11, 12):
+            await manager.connect(1, uid, FakeSocket())
+        sent = _record_broadcasts(manager)
+
+        await manager.typing.update(1, 10, True)
+        await manager.typing.update(1, 11, True)
+        await asyncio.sleep(0.12)
+        await manager.typing.update(1, 10, False)
+        await manager.typing.update(1, 11, False)
+        await asyncio.sleep(0.12)
+
+        assert all(m["type"] == "typing_digest" for m in sent)
+        assert [m["user_ids"] for m in sent] == [[10, 11], []]
+
+    _run(scenario)
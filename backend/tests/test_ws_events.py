@@ -0,0 +1,107 @@
+# tests/test_ws_events.py
+def _token(headers):
+    return headers["Authorization"].split()[1]
+
+
+def _receive(ws, kind):
+    while True:
+        frame = ws.receive_json()
+        if frame["type"] == kind:
+            return frame
+
+
+def test_bad_frames_get_error_and_keep_socket_open(client, make_user, make_conversation):
+    uid, headers = make_user()
+    cid = make_conversation(headers)
+    other_cid = make_conversation(headers)
+    foreign = client.post("/messages/", headers=headers, json={"conversation_id": other_cid, "content": "khác phòng"}).json()
+    own = client.post("/messages/", headers=headers, json={"conversation_id": cid, "content": "trong phòng"}).json()
+
+    with client.websocket_connect(f"/ws/{cid}/{uid}?token={_token(headers)}") as ws:
+        _receive(ws, "resumed")
+
+        ws.send_json({"type": "seen", "message_ids": ["abc"]})
+        assert _receive(ws, "error")["conversation_id"] == cid
+
+        # Tin của phòng khác → bị từ chối, không ghi reaction
+        ws.send_json({"type": "reaction", "message_id": foreign["id"], "emoji": "👍"})
+        assert _receive(ws, "error")["detail"] == "Message not found in this conversation"
+
+        ws.send_json({"type": "reaction", "message_id": own["id"], "emoji": "👍"})
+        delta = _receive(ws, "reaction_delta")
+        assert delta["message_id"] == own["id"]
+        assert delta["added"] == {"emoji": "👍", "count": 1}
+
+    foreign_reactions = client.get(f"/messages/reactions/{foreign['id']}", headers=headers)
+    assert foreign_reactions.status_code == 200
+    assert foreign_reactions.json()["reactions"] == []
+
+
+def test_failed_message_write_keeps_socket_open(client, make_user, make_conversation, monkeypatch):
+    import asyncio
+
+    from app import main
+
+    uid, headers = make_user()
+    cid = make_conversation(headers)
+    persist = main.persist_message
+
+    async def timeout(*args):
+        raise asyncio.TimeoutError()
+
+    with client.websocket_connect(f"/ws/{cid}/{uid}?token={_token(headers)}") as ws:
+        _receive(ws, "resumed")
+
+        monkeypatch.setattr(main, "persist_message", timeout)
+        ws.send_json({"type": "message", "content": "mất"})
+        assert _receive(ws, "error")["conversation_id"] == cid
+
+        monkeypatch.setattr(main, "persist_message", persist)
+        ws.send_json({"type": "message", "content": "được lưu"})
+        assert _receive(ws, "message")["message"]["content"] == "được lưu"
+
+
+def test_multiplexed_socket_survives_malformed_frames(client, make_user, make_conversation):
+    uid, headers = make_user()
+    cid = make_conversation(headers)
+
+    with client.websocket_connect(f"/ws/{uid}?token={_token(headers)}") as ws:
+        assert cid in _receive(ws, "subscribed")["conversation_ids"]
+
+        ws.send_text("không phải json")
+        assert _receive(ws, "error")["detail"] == "Frame must be a JSON object"
+        ws.send_json(["list"])
+        assert _receive(ws, "error")["detail"] == "Frame must be a JSON object"
+
+        for bad in (["x"], "7", {"a": 1}):
+            ws.send_json({"type": "subscribe", "conversation_ids": bad})
+            assert _receive(ws, "error")["detail"] == "conversation_ids must be a list of integers"
+
+        ws.send_json({"type": "unsubscribe", "conversation_ids": [cid]})
+        assert _receive(ws, "subscribed")["conversation_ids"] == []
+
+
+def test_image_broadcast_reuses_metadata_from_the_write(client, make_user, make_conversation, monkeypatch):
+    from app import db, main, models, storage
+
+    uid, headers = make_user()
+    cid = make_conversation(headers)
+    sha256 = "e" * 64
+    db_s = db.SessionLocal()
+    try:
+        db_s.add(models.Blob(sha256=sha256, size=4, ext=".png", width=40, height=30, blurhash="LKO2"))
+        db_s.commit()
+    finally:
+        db_s.close()
+
+    async def no_lookup(file_url):
+        raise AssertionError("image metadata read in a separate session")
+
+    monkeypatch.setattr(main, "file_preview", no_lookup)
+    with client.websocket_connect(f"/ws/{cid}/{uid}?token={_token(headers)}") as ws:
+        _receive(ws, "resumed")
+        ws.send_json({"type": "message", "content": "[File: a.png]", "file_url": storage.blob_url(sha256, ".png")})
+        message = _receive(ws, "message")["message"]
+
+    assert (message["width"], message["height"], message["blurhash"]) == (40, 30, "LKO2")
+    assert message["thumb_url"]
@@ -8,6 +8,7 @@ import './ChatApp.css';
 
 function ChatApp({ onLogout }) {
   const [conversations, setConversations] = useState([]);
+  const [conversationCursor, setConversationCursor] = useState(null);
   const [selectedConversation, setSelectedConversation] = useState(null);
   const [showNewConvModal, setShowNewConvModal] = useState(false);
   const [currentUser, setCurrentUser] = useState(null);
@@ -22,7 +23,18 @@ function ChatApp({ onLogout }) {
   const loadConversations = async () => {
     try {
       const response = await getMyConversations();
-      setConversations(response.data);
+      setConversations(response.data.items);
+      setConversationCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error loading conversations:', error);
+    }
+  };
+
+  const loadMoreConversations = async () => {
+    try {
+      const response = await getMyConversations({ cursor: conversationCursor });
+      setConversations(prev => [...prev, ...response.data.items]);
+      setConversationCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error loading conversations:', error);
     }
@@ -30,6 +42,10 @@ function ChatApp({ onLogout }) {
 
   const handleSelectConversation = (conv) => {
     setSelectedConversation(conv);
+    // ChatWindow gửi "seen" khi mở hội thoại → bỏ badge chưa đọc luôn
+    setConversations(prev =>
+      prev.map(c => (c.id === conv.id ? { ...c, unread_count: 0 } : c))
+    );
   };
 
   const handleNewConversation = () => {
@@ -63,6 +79,8 @@ function ChatApp({ onLogout }) {
           selectedConversation={selectedConversation}
           onSelectConversation={handleSelectConversation}
           currentUserId={currentUser?.id}
+          hasMore={!!conversationCursor}
+          onLoadMore={loadMoreConversations}
         />
       </div>
       <div className="chat-main">
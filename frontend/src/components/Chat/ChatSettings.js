@@ -10,6 +10,8 @@ function ChatSettings({ conversation, currentUser, onClose, onChangeTheme }) {
   const [groupNicknames, setGroupNicknames] = useState({});
   const [mediaImages, setMediaImages] = useState([]);
   const [mediaFiles, setMediaFiles] = useState([]);
+  const [mediaCursors, setMediaCursors] = useState({ images: null, files: null });
+  const [mediaCounts, setMediaCounts] = useState({});
   
   // Search states
   const [searchQuery, setSearchQuery] = useState('');
@@ -98,11 +100,32 @@ function ChatSettings({ conversation, currentUser, onClose, onChangeTheme }) {
     }
   }, [activeTab]);
 
+  const MEDIA_KINDS = { images: "image,video", files: "file,audio" };
+
   const loadMedia = async () => {
     try {
-      const res = await getMedia(conversation.id);
-      setMediaImages(res.data.images);
-      setMediaFiles(res.data.files);
+      const [images, files] = await Promise.all([
+        getMedia(conversation.id, { kind: MEDIA_KINDS.images }),
+        getMedia(conversation.id, { kind: MEDIA_KINDS.files })
+      ]);
+      setMediaImages(images.data.items);
+      setMediaFiles(files.data.items);
+      setMediaCursors({ images: images.data.next_cursor, files: files.data.next_cursor });
+      setMediaCounts(images.data.counts);
+    } catch (err) {
+      console.error(err);
+    }
+  };
+
+  const loadMoreMedia = async (group) => {
+    try {
+      const res = await getMedia(conversation.id, {
+        kind: MEDIA_KINDS[group],
+        cursor: mediaCursors[group]
+      });
+      const append = group === "images" ? setMediaImages : setMediaFiles;
+      append(prev => [...prev, ...res.data.items]);
+      setMediaCursors(prev => ({ ...prev, [group]: res.data.next_cursor }));
     } catch (err) {
       console.error(err);
     }
@@ -119,7 +142,7 @@ function ChatSettings({ conversation, currentUser, onClose, onChangeTheme }) {
     setIsSearching(true);
     try {
       const res = await searchMessages(conversation.id, searchQuery);
-      setSearchResults(res.data);
+      setSearchResults(res.data.items);
     } catch (err) {
       console.error('Search error:', err);
       alert('Lỗi khi tìm kiếm tin nhắn');
@@ -327,7 +350,7 @@ function ChatSettings({ conversation, currentUser, onClose, onChangeTheme }) {
           {activeTab === 'media' && (
             <div className="media-section">
 
-              <h3>Ảnh & Video đã chia sẻ</h3>
+              <h3>Ảnh & Video đã chia sẻ ({(mediaCounts.image || 0) + (mediaCounts.video || 0)})</h3>
               <div className="media-grid">
                 {mediaImages.length === 0 ? (
                   <div className="media-placeholder">
@@ -337,17 +360,33 @@ function ChatSettings({ conversation, currentUser, onClose, onChangeTheme }) {
                 ) : (
                   mediaImages.map(img => (
                     <div key={img.id} className="media-item">
-                      <img
-                        src={buildUrl(img.url)}
-                        alt=""
-                        onClick={() => window.open(buildUrl(img.url))}
-                      />
+                      {img.kind === "video" ? (
+                        <video
+                          src={buildUrl(img.url)}
+                          preload="metadata"
+                          onClick={() => window.open(buildUrl(img.url))}
+                        />
+                      ) : (
+                        <img
+                          src={buildUrl(img.thumb_url || img.url)}
+                          alt=""
+                          loading="lazy"
+                          onClick={() => window.open(buildUrl(img.preview_url || img.url))}
+                        />
+                      )}
                     </div>
                   ))
                 )}
               </div>
-
-              <h3 style={{ marginTop: "24px" }}>File đã chia sẻ</h3>
+              {mediaCursors.images && (
+                <button className="btn-load-more" onClick={() => loadMoreMedia("images")}>
+                  Xem thêm
+                </button>
+              )}
+
+              <h3 style={{ marginTop: "24px" }}>
+                File đã chia sẻ ({(mediaCounts.file || 0) + (mediaCounts.audio || 0)})
+              </h3>
               <div className="file-list">
                 {mediaFiles.length === 0 ? (
                   <div className="file-placeholder">
@@ -374,6 +413,11 @@ function ChatSettings({ conversation, currentUser, onClose, onChangeTheme }) {
                   ))
                 )}
               </div>
+              {mediaCursors.files && (
+                <button className="btn-load-more" onClick={() => loadMoreMedia("files")}>
+                  Xem thêm
+                </button>
+              )}
 
             </div>
           )}
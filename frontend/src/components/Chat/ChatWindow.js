@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useRef, useCallback } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { getMessages, uploadFile } from '../../services/api';
+import { getMessageReactions, getMessages, getSync, uploadFile } from '../../services/api';
 import wsService from '../../services/websocket';
 import MemberListModal from './MemberListModal';
 import ChatSettings from './ChatSettings';
@@ -9,6 +9,29 @@ import MessageReaction from './MessageReaction';
 import { getApiBase } from "../../config";
 import './ChatWindow.css';
 
+// Áp reaction_delta lên danh sách reaction của tin (count lấy theo server)
+function applyReactionDelta(reactions = [], delta) {
+  const { added, removed, username } = delta;
+  const next = reactions
+    .map(r => r.emoji === removed?.emoji
+      ? { ...r, count: removed.count, users: (r.users || []).filter(u => u !== username) }
+      : r)
+    .filter(r => r.count > 0);
+
+  const index = next.findIndex(r => r.emoji === added.emoji);
+  if (index === -1) {
+    next.push({ emoji: added.emoji, count: added.count, users: [username] });
+  } else {
+    const users = [...(next[index].users || []).filter(u => u !== username), username];
+    next[index] = { ...next[index], count: added.count, users };
+  }
+  return next;
+}
+
+// Danh sách người thả khớp số đếm → không cần tải lại
+const reactionsComplete = (reactions) =>
+  reactions.every(r => (r.users || []).length === r.count);
+
 function ChatWindow({ conversation, currentUser }) {
   const [messages, setMessages] = useState([]);
   const [inputMessage, setInputMessage] = useState('');
@@ -22,6 +45,11 @@ function ChatWindow({ conversation, currentUser }) {
   const messagesEndRef = useRef(null);
   const fileInputRef = useRef(null);
   const typingTimeoutRef = useRef(null);
+  const syncCursorRef = useRef(null);
+  const containerRef = useRef(null);
+  // prev_cursor của trang cũ nhất đã tải; null → đã tới tin đầu tiên
+  const olderCursorRef = useRef(null);
+  const loadingOlderRef = useRef(false);
   const navigate = useNavigate();
 
   // Load theme từ conversation (nếu có)
@@ -40,13 +68,100 @@ function ChatWindow({ conversation, currentUser }) {
   const loadMessages = useCallback(async () => {
     if (!conversation?.id) return;
     try {
+      // Lấy cursor trước khi tải → thay đổi xảy ra trong lúc tải sẽ có trong /sync
+      const sync = await getSync();
+      syncCursorRef.current = sync.data.cursor;
       const res = await getMessages(conversation.id);
-      setMessages(res.data);
+      olderCursorRef.current = res.data.prev_cursor;
+      setMessages(res.data.items);
       scrollToBottom();
     } catch (err) {
       console.error("Error loading messages:", err);
     }
   }, [conversation?.id]);
+
+  // -----------------------------
+  // Cuộn lên đầu → tải trang cũ hơn (prev_cursor), giữ nguyên vị trí đang xem
+  // -----------------------------
+  const loadOlder = useCallback(async () => {
+    const cursor = olderCursorRef.current;
+    if (!conversation?.id || !cursor || loadingOlderRef.current) return;
+    loadingOlderRef.current = true;
+    try {
+      const res = await getMessages(conversation.id, { cursor });
+      // Đã chuyển hội thoại / tải lại trong lúc chờ → bỏ trang này
+      if (olderCursorRef.current !== cursor) return;
+      olderCursorRef.current = res.data.prev_cursor;
+
+      const container = containerRef.current;
+      const previousHeight = container ? container.scrollHeight : 0;
+      setMessages(prev => {
+        const known = new Set(prev.map(m => m.id));
+        return [...res.data.items.filter(m => !known.has(m.id)), ...prev];
+      });
+      requestAnimationFrame(() => {
+        if (container) container.scrollTop += container.scrollHeight - previousHeight;
+      });
+    } catch (err) {
+      console.error("Error loading older messages:", err);
+    } finally {
+      loadingOlderRef.current = false;
+    }
+  }, [conversation?.id]);
+
+  const handleScroll = (e) => {
+    if (e.currentTarget.scrollTop < 80) loadOlder();
+  };
+
+  // -----------------------------
+  // Kết nối lại → chỉ tải phần thay đổi (GET /sync)
+  // -----------------------------
+  const catchUp = useCallback(async () => {
+    if (!conversation?.id || !syncCursorRef.current) return;
+    try {
+      let hasMore = true;
+      while (hasMore) {
+        const { data } = await getSync(syncCursorRef.current);
+        syncCursorRef.current = data.cursor;
+        hasMore = data.has_more;
+
+        if (data.reset) {
+          await loadMessages();
+          return;
+        }
+
+        const newMessages = data.messages.filter(m => m.conversation_id === conversation.id);
+        const reactions = Object.fromEntries(data.reactions.map(r => [r.message_id, r.reactions]));
+        const reads = data.reads.filter(r => r.conversation_id === conversation.id);
+
+        setMessages(prev => {
+          const known = new Set(prev.map(m => m.id));
+          const merged = [...prev, ...newMessages.filter(m => !known.has(m.id))];
+          return merged.map(m => {
+            let msg = reactions[m.id] ? { ...m, reactions: reactions[m.id] } : m;
+            reads.forEach(r => {
+              const seen = msg.seen_by || [];
+              if (msg.id <= r.last_read_message_id && msg.sender_id !== r.user_id &&
+                  !seen.some(s => s.user_id === r.user_id)) {
+                msg = { ...msg, seen_by: [...seen, { user_id: r.user_id, seen_at: null }] };
+              }
+            });
+            return msg;
+          });
+        });
+
+        const conv = data.conversations.find(c => c.id === conversation.id);
+        if (conv) setCurrentTheme(conv.theme || "default");
+      }
+      scrollToBottom();
+    } catch (err) {
+      console.error("Error syncing:", err);
+    }
+  }, [conversation?.id, loadMessages]);
+  const catchUpRef = useRef(catchUp);
+  catchUpRef.current = catchUp;
+  const messagesRef = useRef(messages);
+  messagesRef.current = messages;
   useEffect(() => {
     if (messages.length === 0) return;
   
@@ -67,6 +182,11 @@ function ChatWindow({ conversation, currentUser }) {
   // -----------------------------
   const handleWebSocketMessage = useCallback(
     (data) => {
+      // Khoảng hở lớn hơn buffer phát lại của server → lấy phần thiếu qua /sync
+      if (data.type === "catch_up") {
+        catchUpRef.current();
+      }
+
       if (data.type === 'online_list') {
         setOnlineUsers(new Set(data.users));
       }
@@ -102,20 +222,37 @@ function ChatWindow({ conversation, currentUser }) {
         }
       }
 
+      // Phòng đông: server gửi danh sách người đang nhập định kỳ
+      else if (data.type === "typing_digest") {
+        const others = data.user_ids.filter((id) => id !== currentUser.id);
+        setTyping(others.length ? others[0] : null);
+      }
+
       else if (data.type === "theme_changed") {
         if (data.conversation_id === conversation.id) {
           setCurrentTheme(data.theme);
         }
       }
       
-      else if (data.type === "reaction_changed") {
+      // Server chỉ gửi phần thay đổi; danh sách người thả bị thiếu → tải lại bản đầy đủ
+      else if (data.type === "reaction_delta") {
         setMessages(prev =>
           prev.map(msg =>
             msg.id === data.message_id
-              ? { ...msg, reactions: data.reactions }
+              ? { ...msg, reactions: applyReactionDelta(msg.reactions, data) }
               : msg
           )
         );
+        const known = messagesRef.current.find(m => m.id === data.message_id);
+        if (known && !reactionsComplete(applyReactionDelta(known.reactions, data))) {
+          getMessageReactions(data.message_id).then(res => {
+            setMessages(prev =>
+              prev.map(msg =>
+                msg.id === data.message_id ? { ...msg, reactions: res.data.reactions } : msg
+              )
+            );
+          }).catch(err => console.error("Load reactions failed:", err));
+        }
       }
       
       else if (data.type === "presence") {
@@ -374,7 +511,7 @@ function ChatWindow({ conversation, currentUser }) {
         </button>
       </div>
 
-      <div className="messages-container">
+      <div className="messages-container" ref={containerRef} onScroll={handleScroll}>
         {messages.map((msg) => {
           const senderAvatar = getSenderAvatar(msg.sender_id);
           return (
@@ -404,7 +541,17 @@ function ChatWindow({ conversation, currentUser }) {
                 )}
 
                 <div className="message-bubble">
-                  {msg.file_url ? (
+                  {msg.thumb_url ? (
+                    <a href={buildUrl(msg.preview_url || msg.file_url)} target="_blank" rel="noopener noreferrer">
+                      <img
+                        className="message-image"
+                        src={buildUrl(msg.thumb_url)}
+                        width={msg.width ? Math.min(msg.width, 320) : undefined}
+                        alt={msg.content || "Ảnh"}
+                        loading="lazy"
+                      />
+                    </a>
+                  ) : msg.file_url ? (
                     <a href={buildUrl(msg.file_url)} target="_blank" rel="noopener noreferrer">
                       📎 {msg.content || "File đính kèm"}
                     </a>
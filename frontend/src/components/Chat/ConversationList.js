@@ -8,6 +8,8 @@ function ConversationList({
   selectedConversation,
   onSelectConversation,
   currentUserId,
+  hasMore,
+  onLoadMore,
 }) {
   const navigate = useNavigate();
   const [search, setSearch] = useState("");
@@ -58,6 +60,15 @@ function ConversationList({
 
   const getAvatarUrl = (url) => buildUrl(url);
 
+  const getLastMessagePreview = (conv) => {
+    const last = conv.last_message;
+    if (!last) {
+      return conv.is_group ? `${conv.members.length} thành viên` : "Trò chuyện riêng";
+    }
+    const text = last.content || (last.file_url ? "📎 File đính kèm" : "");
+    return last.sender_id === currentUserId ? `Bạn: ${text}` : text;
+  };
+
   const handleAvatarClick = (e, conv) => {
     e.stopPropagation();
     if (!conv.is_group) {
@@ -121,16 +132,26 @@ function ConversationList({
                 <div className="conversation-name">
                   {getConversationName(conv)}
                 </div>
-                <div className="conversation-members">
-                  {conv.is_group
-                    ? `${conv.members.length} thành viên`
-                    : "Trò chuyện riêng"}
+                <div className={`conversation-members ${conv.unread_count > 0 ? "unread" : ""}`}>
+                  {getLastMessagePreview(conv)}
                 </div>
               </div>
+
+              {conv.unread_count > 0 && (
+                <div className="unread-badge">
+                  {conv.unread_count > 99 ? "99+" : conv.unread_count}
+                </div>
+              )}
             </div>
           );
         })
       )}
+
+      {hasMore && (
+        <button className="btn-load-more-conversations" onClick={onLoadMore}>
+          Xem thêm
+        </button>
+      )}
     </div>
   );
 }
@@ -48,7 +48,8 @@ export const getUserProfile = (userId) => api.get(`/users/${userId}`);
 // -------------------------------
 // CONVERSATION APIs
 // -------------------------------
-export const getMyConversations = () => api.get("/conversations/mine");
+export const getMyConversations = (params = {}) =>
+  api.get("/conversations/mine", { params });
 
 export const createConversation = (name, is_group, member_ids) =>
   api.post("/conversations/", { name, is_group, member_ids });
@@ -57,8 +58,8 @@ export const createConversation = (name, is_group, member_ids) =>
 // -------------------------------
 // MESSAGE APIs
 // -------------------------------
-export const getMessages = (conversationId) =>
-  api.get(`/messages/${conversationId}`);
+export const getMessages = (conversationId, params = {}) =>
+  api.get(`/messages/${conversationId}`, { params });
 
 export const sendMessage = (conversation_id, content, file_url = null) =>
   api.post("/messages/", { conversation_id, content, file_url });
@@ -68,6 +69,10 @@ export const searchMessages = (conversationId, query) =>
     params: { q: query }
   });
 
+// Danh sách reaction đầy đủ của 1 tin (WS chỉ gửi reaction_delta)
+export const getMessageReactions = (messageId) =>
+  api.get(`/messages/reactions/${messageId}`);
+
 
 // -------------------------------
 // FILE APIs
@@ -107,10 +112,16 @@ export const deleteConversation = (conversationId) =>
   api.delete(`/settings/${conversationId}`);
 
 
+// -------------------------------
+// SYNC (delta sau khi kết nối lại)
+// -------------------------------
+export const getSync = (since = null, params = {}) =>
+  api.get("/sync", { params: since ? { since, ...params } : params });
+
 // -------------------------------
 // MEDIA APIs
 // -------------------------------
-export const getMedia = (conversationId) =>
-  api.get(`/media/${conversationId}`);
+export const getMedia = (conversationId, params = {}) =>
+  api.get(`/media/${conversationId}`, { params });
 
 export default api;
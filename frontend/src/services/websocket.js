@@ -4,34 +4,73 @@ class WebSocketService {
   constructor() {
     this.ws = null;
     this.listeners = [];
+    this.params = null;
+    this.retryDelay = 1000;
+    this.retryTimer = null;
+    // Vị trí đã nhận trong phòng → server phát lại event bị lỡ khi kết nối lại
+    this.epoch = null;
+    this.lastSeq = null;
   }
 
   connect(conversationId, userId, token) {
     if (this.ws && this.ws.readyState === WebSocket.OPEN) return;
+    this.params = { conversationId, userId, token };
+    this.epoch = null;
+    this.lastSeq = null;
+    this.open(false);
+  }
+
+  open(isReconnect) {
+    if (!this.params) return;
+    const { conversationId, userId, token } = this.params;
 
     const wsBase = getWsBase();   // 🔥 luôn lấy giá trị mới nhất
-    const wsUrl = `${wsBase}/${conversationId}/${userId}?token=${token}`;
+    let wsUrl = `${wsBase}/${conversationId}/${userId}?token=${token}`;
+    if (isReconnect && this.epoch && this.lastSeq !== null) {
+      wsUrl += `&last_seq=${this.lastSeq}&epoch=${this.epoch}`;
+    }
 
     console.log("Connecting WebSocket:", wsUrl);
 
-    this.ws = new WebSocket(wsUrl);
+    const ws = new WebSocket(wsUrl);
+    this.ws = ws;
 
-    this.ws.onopen = () => console.log("WebSocket connected");
+    ws.onopen = () => {
+      console.log("WebSocket connected");
+      this.retryDelay = 1000;
+    };
 
-    this.ws.onmessage = (event) => {
+    ws.onmessage = (event) => {
       const data = JSON.parse(event.data);
+      // "resumed": server đã phát lại phần bị lỡ; "catch_up": khoảng hở quá cũ
+      // → listener tự gọi /sync. Cả 2 đều đặt lại vị trí hiện tại của phòng.
+      if (data.type === "resumed" || data.type === "catch_up") {
+        this.epoch = data.epoch;
+        this.lastSeq = data.seq;
+      } else if (typeof data.seq === "number") {
+        this.lastSeq = data.seq;
+      }
       this.listeners.forEach(cb => cb(data));
     };
 
-    this.ws.onerror = (err) => console.error("WebSocket error:", err);
+    ws.onerror = (err) => console.error("WebSocket error:", err);
 
-    this.ws.onclose = () => console.log("WebSocket disconnected");
+    ws.onclose = (event) => {
+      console.log("WebSocket disconnected");
+      // 1008: không còn là thành viên → không kết nối lại
+      if (this.ws !== ws || event.code === 1008) return;
+      this.retryTimer = setTimeout(() => this.open(true), this.retryDelay);
+      this.retryDelay = Math.min(this.retryDelay * 2, 10000);
+    };
   }
 
   disconnect() {
+    clearTimeout(this.retryTimer);
+    this.params = null;
     if (this.ws) {
-      this.ws.close();
+      const ws = this.ws;
       this.ws = null;
+      ws.close();
     }
   }
 